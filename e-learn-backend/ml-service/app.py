@@ -1,16 +1,23 @@
 import os
-from flask import Flask, jsonify, request
+import time
+STARTUP_STARTED = time.perf_counter() # Before the model imports below, so startup time includes them
+from functools import wraps
+from flask import Flask, Response, g, jsonify, request
 from flask_cors import CORS
 import logging
 
-from recommendation.predictor import get_hybrid_recommendations # Your recommendation logic
+from recommendation.predictor import get_hybrid_recommendations, get_hybrid_recommendations_batch, model_registry, recommendation_cache # Your recommendation logic
+from recommendation.predictor import add_course_to_index, search_similar_courses
 # Make sure database_utils is accessible, if it's external, adjust path/import
 # from database_utils import get_db_connection 
-# If database_utils is only for health check and not critical for the ML model itself,
-# you might not need it here unless get_hybrid_recommendations relies on it directly for its own DB access.
-# Assuming get_db_connection is still needed for health check.
-from database_utils import get_db_connection
+# The health check reads the cached result of a background ping (see database_utils.get_db_health)
+from database_utils import course_combined_features, get_db_health
 from question_generator.routes import question_gen_bp # Assuming this Blueprint is correctly structured
+from question_generator.question_cache import question_cache
+from question_generator.jobs import question_jobs
+from metrics import CallbackMetric, HYBRID_STAGE_SECONDS, render_metrics
+from profiling import ML_PROFILING_ENABLED, ProfilerBusy, request_profiles, sample_stacks
+from lifecycle import readiness, warm_up
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes
@@ -22,24 +29,49 @@ app.register_blueprint(question_gen_bp, url_prefix='/api/question-generator')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Upper bound on users per /recommendations/batch call, keeps a single request from monopolizing a worker
+MAX_BATCH_USERS = int(os.getenv('MAX_BATCH_USERS', 5000))
+# Shared secret for /admin endpoints (sent as X-Admin-Token); admin endpoints are disabled when unset
+ML_ADMIN_TOKEN = os.getenv('ML_ADMIN_TOKEN')
+
+def _has_admin_token():
+    return bool(ML_ADMIN_TOKEN) and request.headers.get('X-Admin-Token') == ML_ADMIN_TOKEN
+
+def require_admin_token(view):
+    """Rejects requests to admin endpoints that do not carry the configured X-Admin-Token."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not _has_admin_token():
+            logger.warning(f"Rejected admin request to {request.path}.")
+            return jsonify({"message": "Forbidden"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """
     Health check endpoint to verify service and database connectivity.
+    Serves the result of the background database pinger, so probes never wait on the network.
     """
-    try:
-        # Attempt to connect to the database
-        db = get_db_connection()
-        db.command('ping') # A simple command to check connection
-        logger.info("Health check successful: Database connection established.")
-        return jsonify({"status": "healthy", "database_connection": "successful"}), 200
-    except Exception as e:
-        logger.error(f"Health check failed: {e}", exc_info=True)
-        return jsonify({
-            "status": "unhealthy",
-            "database_connection": "failed",
-            "error": str(e)
-        }), 500
+    health = get_db_health()
+    if health["status"] != "healthy":
+        logger.error(f"Health check failed: {health.get('error')}")
+        return jsonify(health), 500
+    return jsonify(health), 200
+
+@app.route('/live', methods=['GET'])
+def liveness_check():
+    """Liveness probe: the worker process answers. Restart it only when this fails."""
+    return jsonify({"status": "alive"}), 200
+
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """
+    Readiness probe: models loaded, warm-up finished and not shutting down (see lifecycle.py).
+    Returns 503 otherwise, so the load balancer holds traffic back without restarting the worker.
+    """
+    ready, status = readiness()
+    return jsonify(status), 200 if ready else 503
 
 # CHANGED: Route for recommendations now accepts POST requests
 #          and the user_id is passed in the request body, not the URL.
@@ -67,7 +99,7 @@ def get_recommendations_route():
         
         user_id = user_data['user_id'] # Extract user_id from the payload for logging/predictor
 
-        logger.info(f"Generating recommendations for user: {user_id} with top_n={top_n}, alpha={alpha}")
+        logger.debug(f"Generating recommendations for user: {user_id} with top_n={top_n}, alpha={alpha}")
         
         # Call the hybrid recommendation function, passing the full user_data dictionary
         recommendations = get_hybrid_recommendations(user_id, top_n, alpha, user_data=user_data)
@@ -76,8 +108,10 @@ def get_recommendations_route():
             logger.error(f"Recommendation generation failed for user {user_id}: {recommendations['error']}")
             return jsonify({"message": recommendations["error"]}), 500
 
-        logger.info(f"Successfully generated {len(recommendations.get('recommendations', []))} recommendations for user {user_id}.")
-        return jsonify(recommendations) # recommendations is already a dict like {"recommendations": [...]}
+        logger.debug(f"Successfully generated {len(recommendations.get('recommendations', []))} recommendations for user {user_id}.")
+        with HYBRID_STAGE_SECONDS.time(stage="serialize"):
+            response = jsonify(recommendations) # recommendations is already a dict like {"recommendations": [...]}
+        return response
 
     except ValueError:
         logger.error("Invalid top_n or alpha parameter format in request.", exc_info=True)
@@ -86,13 +120,286 @@ def get_recommendations_route():
         logger.error(f"An unexpected error occurred in recommendation endpoint for user: {user_id}", exc_info=True)
         return jsonify({"message": "An internal error occurred while generating recommendations."}), 500
 
+@app.route('/recommendations/batch', methods=['POST'])
+def get_batch_recommendations_route():
+    """
+    Endpoint for bulk jobs (nightly emails, home feeds): scores many users in one call.
+    Expects a JSON body with 'users' (a list of 'user_data' payloads), 'top_n' (optional)
+    and 'alpha' (optional). Returns {"results": [{"user_id": ..., "recommendations": [...]}]}
+    in the same order as 'users'.
+    """
+    try:
+        data = request.get_json()
+
+        if not data:
+            logger.warning("Received empty or non-JSON request for batch recommendations.")
+            return jsonify({"message": "No input data provided. Expected JSON."}), 400
+
+        users_data = data.get('users')
+        top_n = int(data.get('top_n', 5)) # Default to 5 if not provided
+        alpha = float(data.get('alpha', 0.6)) # Default to 0.6 if not provided
+
+        if not isinstance(users_data, list) or not users_data:
+            return jsonify({"message": "'users' must be a non-empty list of user_data objects."}), 400
+        if len(users_data) > MAX_BATCH_USERS:
+            return jsonify({"message": f"Too many users in one batch (max {MAX_BATCH_USERS})."}), 400
+        if any(not isinstance(user_data, dict) or 'user_id' not in user_data for user_data in users_data):
+            logger.error("Missing 'user_id' in one or more batch user_data payloads.")
+            return jsonify({"message": "Every entry in 'users' must contain a user_id."}), 400
+
+        logger.debug(f"Generating batch recommendations for {len(users_data)} users with top_n={top_n}, alpha={alpha}")
+
+        recommendations = get_hybrid_recommendations_batch(users_data, top_n, alpha)
+
+        if "error" in recommendations:
+            logger.error(f"Batch recommendation generation failed: {recommendations['error']}")
+            return jsonify({"message": recommendations["error"]}), 500
+
+        with HYBRID_STAGE_SECONDS.time(stage="serialize"):
+            response = jsonify(recommendations)
+        return response
+
+    except ValueError:
+        logger.error("Invalid top_n or alpha parameter format in batch request.", exc_info=True)
+        return jsonify({"message": "Invalid 'top_n' or 'alpha' parameter. Please ensure they are numbers."}), 400
+    except Exception as e:
+        logger.error("An unexpected error occurred in batch recommendation endpoint.", exc_info=True)
+        return jsonify({"message": "An internal error occurred while generating recommendations."}), 500
+
+def _query_text(data):
+    """The text to vectorize from a request body: 'text' as-is, or the combined features of a 'course' document."""
+    if isinstance(data.get('text'), str) and data['text'].strip():
+        return data['text']
+    if isinstance(data.get('course'), dict):
+        return course_combined_features(data['course'])
+    return None
+
+@app.route('/recommendations/similar', methods=['POST'])
+def get_similar_courses_route():
+    """
+    Courses similar to a free-text query or to a course document that the model has not seen
+    (e.g. created after the last training run), scored against the inverted TF-IDF index.
+    Expects a JSON body with 'text' or 'course' (a course document with title, description,
+    subject, ...), 'top_n' (optional) and 'exclude' (optional list of CourseIDs).
+    Returns {"recommendations": [{"CourseID": ..., "Score": ...}]}.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        text = _query_text(data)
+        top_n = int(data.get('top_n', 5)) # Default to 5 if not provided
+        if text is None:
+            return jsonify({"message": "Expected a non-empty 'text' or a 'course' object."}), 400
+        exclude = data.get('exclude') or []
+        if not isinstance(exclude, list):
+            return jsonify({"message": "'exclude' must be a list of CourseIDs."}), 400
+        if isinstance(data.get('course'), dict) and data['course'].get('_id'):
+            exclude.append(data['course']['_id']) # A course is never similar to itself
+
+        recommendations = search_similar_courses(text, top_n, exclude)
+        if recommendations is None:
+            return jsonify({"message": "Recommendation models not initialized"}), 500
+        return jsonify({"recommendations": recommendations})
+
+    except ValueError:
+        return jsonify({"message": "Invalid 'top_n' parameter. Please ensure it is a number."}), 400
+    except Exception as e:
+        logger.error("An unexpected error occurred in similar courses endpoint.", exc_info=True)
+        return jsonify({"message": "An internal error occurred while searching courses."}), 500
+
+@app.route('/admin/courses', methods=['POST'])
+@require_admin_token
+def add_course_route():
+    """
+    Adds a course created or edited after the last training run to the content index of all
+    workers on this host, without a retrain: it is found by /recommendations/similar and
+    serves as a CBF seed. Expects a JSON body with 'course_id' and 'text' or 'course'
+    (the course document, turned into the same combined features training uses).
+    """
+    data = request.get_json(silent=True) or {}
+    course_id = data.get('course_id') or (data.get('course') or {}).get('_id')
+    features = _query_text(data)
+    if not course_id or features is None:
+        return jsonify({"message": "Expected a 'course_id' and a non-empty 'text' or a 'course' object."}), 400
+    models = model_registry.current()
+    if models is None or models.course_text_index is None:
+        return jsonify({"message": "The course text index is not available for the active model."}), 409
+
+    seq = add_course_to_index(str(course_id), features)
+    logger.info(f"Added course {course_id} to the content index (seq {seq}).")
+    return jsonify({"message": "Course added.", "course_id": str(course_id), "seq": seq, "index": models.course_text_index.stats()}), 201
+
+@app.route('/admin/models', methods=['GET'])
+@require_admin_token
+def get_model_status_route():
+    """
+    Shows the active model version, when and how fast it was loaded, versions still
+    draining in-flight requests and the versions available on disk.
+    """
+    return jsonify(model_registry.status())
+
+@app.route('/admin/models/reload', methods=['POST'])
+@require_admin_token
+def reload_models_route():
+    """
+    Loads the published model version in the background and swaps it in once validated.
+    Pass {"force": true} to reload even if the published version is already active.
+    """
+    data = request.get_json(silent=True) or {}
+    model_registry.reload_async(force=bool(data.get('force', False)))
+    logger.info("Model reload requested.")
+    return jsonify({"message": "Reload started.", "status": model_registry.status()}), 202
+
+@app.route('/admin/cache', methods=['GET'])
+@require_admin_token
+def get_cache_stats_route():
+    """
+    Recommendation cache counters (hits, misses, evictions, expirations, model-version
+    invalidations) of this worker and the current cache size.
+    """
+    if recommendation_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **recommendation_cache.stats()})
+
+@app.route('/admin/cache/clear', methods=['POST'])
+@require_admin_token
+def clear_cache_route():
+    """Drops every cached recommendation response (shared by all workers with the sqlite backend)."""
+    if recommendation_cache is not None:
+        recommendation_cache.clear()
+        logger.info("Recommendation cache cleared.")
+    return jsonify({"message": "Cache cleared."})
+
+# --- Profiling (see profiling.py), admin-only and disabled unless ML_PROFILING_ENABLED=true ---
+# Requests to these endpoints sent with 'X-Profile-Request: 1' and the admin token are run under
+# cProfile; the response carries X-Profile-Id, see /admin/profile/requests/<profile_id>
+PROFILED_ENDPOINTS = {'get_recommendations_route', 'question_gen_bp.generate_quiz_questions'}
+
+@app.before_request
+def start_request_profile():
+    if not ML_PROFILING_ENABLED or request.endpoint not in PROFILED_ENDPOINTS or request.headers.get('X-Profile-Request') != '1':
+        return
+    if not _has_admin_token():
+        logger.warning(f"Ignoring profiling flag on {request.path} without a valid admin token.")
+        return
+    g.request_profiler = request_profiles.start()
+    if g.request_profiler is None:
+        logger.info(f"Another request is being profiled, serving {request.path} unprofiled.")
+
+@app.after_request
+def finish_request_profile(response):
+    profiler = g.pop('request_profiler', None)
+    if profiler is not None:
+        response.headers['X-Profile-Id'] = request_profiles.finish(profiler)
+    return response
+
+@app.teardown_request
+def discard_request_profile(error=None):
+    # after_request is skipped when the view raised, the profiler must still be stopped
+    profiler = g.pop('request_profiler', None)
+    if profiler is not None:
+        request_profiles.finish(profiler)
+
+@app.route('/admin/profile', methods=['POST'])
+@require_admin_token
+def sample_profile_route():
+    """
+    Samples the stacks of this worker for a while and returns where request threads spend time.
+    Options (JSON body or query string): 'seconds' (default 10), 'hz' (default 100),
+    'threads' ("requests" or "all"), 'limit' (functions in the summary) and 'format':
+    "json" (default) or "collapsed" for plain collapsed stacks to feed a flamegraph tool.
+    """
+    if not ML_PROFILING_ENABLED:
+        return jsonify({"message": "Profiling is disabled (set ML_PROFILING_ENABLED=true)."}), 404
+    options = {**request.args.to_dict(), **(request.get_json(silent=True) or {})}
+    try:
+        seconds = float(options.get('seconds', 10))
+        hz = int(options.get('hz', 100))
+        limit = int(options.get('limit', 30))
+    except ValueError:
+        return jsonify({"message": "'seconds', 'hz' and 'limit' must be numbers."}), 400
+    threads = options.get('threads', 'requests')
+    if threads not in ('requests', 'all'):
+        return jsonify({"message": "'threads' must be 'requests' or 'all'."}), 400
+
+    logger.info(f"Sampling stacks for {seconds}s at {hz} Hz ({threads} threads).")
+    try:
+        profile = sample_stacks(seconds, hz, threads, limit)
+    except ProfilerBusy as e:
+        return jsonify({"message": str(e)}), 409
+    if options.get('format') == 'collapsed':
+        return Response(profile['collapsed'] + "\n", content_type='text/plain; charset=utf-8')
+    return jsonify(profile)
+
+@app.route('/admin/profile/requests/<profile_id>', methods=['GET'])
+@require_admin_token
+def get_request_profile_route(profile_id):
+    """
+    A stored per-request profile: a pstats text report (default, '?sort=' and '?limit=' apply)
+    or the raw pstats file with '?format=pstats' for snakeviz and similar tools.
+    """
+    if not ML_PROFILING_ENABLED:
+        return jsonify({"message": "Profiling is disabled (set ML_PROFILING_ENABLED=true)."}), 404
+    if request.args.get('format') == 'pstats':
+        path = request_profiles.path(profile_id)
+        if path is None:
+            return jsonify({"message": "Unknown profile."}), 404
+        with open(path, 'rb') as f:
+            return Response(f.read(), content_type='application/octet-stream',
+                            headers={'Content-Disposition': f'attachment; filename={profile_id}.pstats'})
+    try:
+        report = request_profiles.report(profile_id, request.args.get('sort', 'cumulative'), int(request.args.get('limit', 40)))
+    except (KeyError, ValueError):
+        return jsonify({"message": "Invalid 'sort' or 'limit'."}), 400
+    if report is None:
+        return jsonify({"message": "Unknown profile."}), 404
+    return Response(report, content_type='text/plain; charset=utf-8')
+
+# --- Metrics read from existing counters at scrape time (see metrics.py) ---
+RECOMMENDATION_CACHE_EVENTS = ("hits", "misses", "evictions", "expirations", "invalidations", "errors")
+QUESTION_CACHE_EVENTS = ("memory_hits", "disk_hits", "misses", "writes", "memory_evictions", "disk_evictions")
+
+def _recommendation_cache_events():
+    if recommendation_cache is None:
+        return {}
+    stats = recommendation_cache.stats()
+    return {(event,): stats[event] for event in RECOMMENDATION_CACHE_EVENTS}
+
+def _question_cache_events():
+    stats = question_cache.stats()
+    return {(event,): stats[event] for event in QUESTION_CACHE_EVENTS}
+
+def _active_model_info():
+    bundle = model_registry.current()
+    return {(bundle.version,): 1} if bundle is not None else {}
+
+CallbackMetric("ml_recommendation_cache_events", "Recommendation cache lookups and maintenance by event.",
+               _recommendation_cache_events, ["event"], metric_type="counter")
+CallbackMetric("ml_question_cache_events", "Question cache lookups and maintenance by event.",
+               _question_cache_events, ["event"], metric_type="counter")
+CallbackMetric("ml_question_cache_memory_entries", "Question sets in this worker's in-memory cache tier.",
+               lambda: {(): question_cache.stats()["memory_entries"]})
+CallbackMetric("ml_question_jobs", "Question generation jobs known to this worker, by status.",
+               lambda: {(status,): count for status, count in question_jobs.stats().items()}, ["status"])
+CallbackMetric("ml_model_info", "The model version this worker serves (value is always 1).", _active_model_info, ["version"])
+
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    """Prometheus scrape endpoint: latency histograms and cache/job counters of this worker."""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Import-to-ready time of this worker (models loaded, routes registered), checked by benchmarks/startup_benchmark.py
+STARTUP_SECONDS = time.perf_counter() - STARTUP_STARTED
+logger.info(f"ML Service initialized in {STARTUP_SECONDS:.2f}s.")
+
 if __name__ == '__main__':
     logger.info("🚀 Starting ML Service...")
     # Determine the port from environment variable or default to 5001
     port = int(os.getenv('PORT', 5001))
     # Determine debug mode from environment variable
     debug_mode = os.getenv('FLASK_DEBUG', 'false').lower() == 'true'
-    
+    # Development server only; in production run `gunicorn -c gunicorn.conf.py app:app`
+    warm_up(app)
+
     app.run(
         host='0.0.0.0', # Listen on all available network interfaces
         port=port,
@@ -0,0 +1,60 @@
+"""
+Latency of get_hybrid_recommendations for users with 1, 20 and 200 seed courses.
+
+Serves a synthetic model (see synthetic.py), so no database or trained models are needed.
+The recommendation cache is disabled so every call runs the full hybrid pipeline.
+
+Usage (from ml-service/):
+    python benchmarks/hybrid_benchmark.py --courses 20000 --users 50000 --seeds 1 20 200
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("RECOMMENDATION_CACHE_SIZE", "0")
+os.environ.setdefault("MODEL_RELOAD_INTERVAL", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from recommendation import predictor
+from synthetic import synthetic_bundle, synthetic_user_data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark get_hybrid_recommendations by seed-course count.")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--courses", type=int, default=10000)
+    parser.add_argument("--seeds", type=int, nargs="+", default=[1, 20, 200])
+    parser.add_argument("--requests", type=int, default=200, help="Calls per seed count")
+    parser.add_argument("--top-n", type=int, default=10)
+    args = parser.parse_args()
+
+    model_dir = tempfile.TemporaryDirectory() # Holds the mapped arrays until the process exits
+    with contextlib.redirect_stdout(io.StringIO()):
+        bundle = synthetic_bundle(model_dir.name, args.users, args.courses)
+    predictor.model_registry._active = bundle
+    rng = random.Random(0)
+    course_ids = bundle.hybrid_course_ids
+
+    print(f"{args.users} users, {args.courses} courses, top_n={args.top_n}")
+    print(f"{'seeds':>6} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+    for n_seeds in args.seeds:
+        payloads = [synthetic_user_data(rng, bundle.cf_user_positions.id_at(rng.randrange(args.users)), course_ids, n_seeds) for _ in range(args.requests)]
+        latencies = []
+        with contextlib.redirect_stdout(io.StringIO()): # The predictor logs every request
+            for payload in payloads:
+                started = time.perf_counter()
+                predictor.get_hybrid_recommendations(payload["user_id"], args.top_n, 0.6, user_data=payload)
+                latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+        print(f"{n_seeds:>6} {statistics.median(latencies):>8.2f} {p99:>8.2f} {statistics.mean(latencies):>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Throughput of /recommendations with 1..N pre-forked workers, as gunicorn.conf.py runs them.
+
+A master process loads a synthetic model (see synthetic.py), warms the app up and freezes
+the garbage collector, then forks the workers. Every worker warms up again and sends
+requests through the Flask stack for a fixed time. Reports requests per second per worker
+count, the scaling efficiency against one worker and the memory each worker does not share
+with the master (private pages: what an extra worker really costs).
+
+Usage (from ml-service/):
+    python benchmarks/prefork_benchmark.py --workers 1 2 4 --seconds 5
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+for blas_env in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(blas_env, "1") # As gunicorn.conf.py does
+os.environ.setdefault("RECOMMENDATION_CACHE_SIZE", "0")
+os.environ.setdefault("MODEL_RELOAD_INTERVAL", "0")
+os.environ.setdefault("WARMUP_REQUESTS", "20")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import rss_mb
+from synthetic import synthetic_bundle, synthetic_user_data
+
+
+def private_mb():
+    """Memory of this process not shared with any other process, in MB (Linux only)."""
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            return sum(int(line.split()[1]) for line in f if line.startswith(("Private_Clean:", "Private_Dirty:"))) / 1024
+    except OSError:
+        return None
+
+
+def run_worker(flask_app, payloads, seconds, write_fd):
+    """Body of one forked worker: warm up, then serve requests until `seconds` have passed."""
+    from lifecycle import warm_up
+
+    warm_up(flask_app)
+    client = flask_app.test_client()
+    served = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        response = client.post('/recommendations', json={"user_data": payloads[served % len(payloads)], "top_n": 10})
+        if response.status_code != 200:
+            raise RuntimeError(f"Request failed with {response.status_code}")
+        served += 1
+    elapsed = time.perf_counter() - started
+    os.write(write_fd, (json.dumps({"requests": served, "seconds": elapsed, "rss_mb": rss_mb(), "private_mb": private_mb()}) + "\n").encode())
+
+
+def run_pool(flask_app, payloads, n_workers, seconds):
+    read_fd, write_fd = os.pipe()
+    pids = []
+    for _ in range(n_workers):
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 0
+            try:
+                run_worker(flask_app, payloads, seconds, write_fd)
+            except Exception as e:
+                print(f"❌ Worker failed: {e}", file=sys.stderr)
+                code = 1
+            os._exit(code)
+        pids.append(pid)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as reader:
+        results = [json.loads(line) for line in reader]
+    for pid in pids:
+        os.waitpid(pid, 0)
+    if len(results) != n_workers:
+        raise RuntimeError(f"Only {len(results)} of {n_workers} workers finished")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /recommendations throughput by pre-forked worker count.")
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--courses", type=int, default=10000)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seconds", type=float, default=5.0, help="Serving time per worker count")
+    parser.add_argument("--seeds", type=int, default=20, help="Seed courses per synthetic user")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO) # Warm-up and per-request logs
+    model_dir = tempfile.TemporaryDirectory()
+    with contextlib.redirect_stdout(io.StringIO()):
+        from recommendation import predictor
+        bundle = synthetic_bundle(model_dir.name, args.users, args.courses)
+        predictor.model_registry._active = bundle
+        from app import app as flask_app
+        from lifecycle import warm_up
+        warm_up(flask_app)
+    gc.freeze()
+
+    rng = random.Random(0)
+    payloads = [synthetic_user_data(rng, f"bench-user-{i}", bundle.hybrid_course_ids, args.seeds) for i in range(500)]
+    print(f"{args.users} users, {args.courses} courses, {args.seeds} seed courses, {os.cpu_count()} cores, master RSS {rss_mb():.0f} MB")
+    print(f"{'workers':>7} {'req/s':>9} {'per worker':>10} {'scaling':>8} {'RSS MB':>7} {'private MB':>10}")
+    single = None
+    for n_workers in args.workers:
+        results = run_pool(flask_app, payloads, n_workers, args.seconds)
+        throughput = sum(r["requests"] / r["seconds"] for r in results)
+        single = single or throughput / n_workers
+        private = [r["private_mb"] for r in results if r["private_mb"] is not None]
+        print(f"{n_workers:>7} {throughput:>9.1f} {throughput / n_workers:>10.1f} {throughput / (single * n_workers):>8.0%} "
+              f"{max(r['rss_mb'] for r in results):>7.0f} {(f'{max(private):.0f}' if private else 'n/a'):>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Startup benchmark for the ML service.
+
+Starts a fresh interpreter that imports app.py (models loaded, blueprints registered, no
+requests served) several times and reports the time to ready and the idle resident memory
+of the worker. Fails when a budget is exceeded or when a heavy backend (torch /
+transformers) was imported although nothing asked for it.
+
+Usage (from ml-service/):
+    python benchmarks/startup_benchmark.py --runs 5 --max-seconds 10 --max-rss-mb 400
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ML_SERVICE_DIR = os.path.dirname(BENCHMARKS_DIR)
+RESULT_MARKER = "STARTUP_RESULT "
+# Backends that must only be imported on first use (or with QG_PRELOAD_T5=true)
+HEAVY_MODULES = ("torch", "transformers")
+
+# Runs inside the child interpreter
+CHILD_CODE = f"""
+import gc, json, sys, time
+started = time.perf_counter()
+import app
+import_seconds = time.perf_counter() - started
+gc.collect()
+sys.path.insert(0, {BENCHMARKS_DIR!r})
+from common import rss_mb
+
+print({RESULT_MARKER!r} + json.dumps({{
+    "import_seconds": import_seconds,
+    "app_startup_seconds": app.STARTUP_SECONDS,
+    "idle_rss_mb": rss_mb(),
+    "heavy_modules": [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+}}), flush=True)
+"""
+
+
+def run_once(env):
+    """Starts one worker interpreter and returns its measurements (plus process wall time)."""
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD_CODE], cwd=ML_SERVICE_DIR, env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    )
+    wall_seconds = time.perf_counter() - started
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            result = json.loads(line[len(RESULT_MARKER):])
+            result["wall_seconds"] = wall_seconds
+            return result
+    raise RuntimeError(f"Service import failed (exit code {completed.returncode}):\n{completed.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure ML service startup time and idle memory.")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh interpreters to start")
+    parser.add_argument("--max-seconds", type=float, default=15.0, help="Budget for the median wall time to ready")
+    parser.add_argument("--max-rss-mb", type=float, default=500.0, help="Budget for the median idle RSS")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    env.setdefault("MODEL_RELOAD_INTERVAL", "0") # No watcher thread needed for a startup measurement
+    preload_t5 = env.get("QG_PRELOAD_T5", "false").lower() == "true"
+
+    runs = []
+    for i in range(args.runs):
+        result = run_once(env)
+        runs.append(result)
+        if not args.json:
+            print(f"run {i + 1}: wall {result['wall_seconds']:.2f}s, import {result['import_seconds']:.2f}s, "
+                  f"idle RSS {result['idle_rss_mb']:.1f} MB, heavy modules {result['heavy_modules'] or 'none'}")
+
+    summary = {
+        "runs": args.runs,
+        "wall_seconds_median": statistics.median(r["wall_seconds"] for r in runs),
+        "wall_seconds_max": max(r["wall_seconds"] for r in runs),
+        "import_seconds_median": statistics.median(r["import_seconds"] for r in runs),
+        "idle_rss_mb_median": statistics.median(r["idle_rss_mb"] for r in runs),
+        "idle_rss_mb_max": max(r["idle_rss_mb"] for r in runs),
+        "heavy_modules": sorted({m for r in runs for m in r["heavy_modules"]}),
+    }
+
+    failures = []
+    if summary["wall_seconds_median"] > args.max_seconds:
+        failures.append(f"median startup {summary['wall_seconds_median']:.2f}s exceeds {args.max_seconds:.2f}s")
+    if summary["idle_rss_mb_median"] > args.max_rss_mb:
+        failures.append(f"median idle RSS {summary['idle_rss_mb_median']:.1f} MB exceeds {args.max_rss_mb:.1f} MB")
+    if summary["heavy_modules"] and not preload_t5:
+        failures.append(f"heavy modules imported at startup: {', '.join(summary['heavy_modules'])}")
+    summary["failures"] = failures
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"📊 Startup: median {summary['wall_seconds_median']:.2f}s (max {summary['wall_seconds_max']:.2f}s), "
+              f"idle RSS median {summary['idle_rss_mb_median']:.1f} MB (max {summary['idle_rss_mb_max']:.1f} MB)")
+        for failure in failures:
+            print(f"❌ {failure}")
+        if not failures:
+            print("✅ Startup within budget.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Benchmark suite for the recommendation and question-generation hot paths.
+
+Everything runs on synthetic data (see synthetic.py) at one of its SCALES, up to 10^6 users
+x 10^5 courses, so no database, trained models or Gemini quota are needed:
+
+  predict.*  get_hybrid_recommendations (trained and folded-in users), the batch form,
+             get_collaborative_recommendations, get_content_recommendations and the
+             free-text search of the course text index
+  train.*    the stages of train_recommendation.py: TF-IDF, neighbor index, one ALS
+             iteration, the scaled SVD and writing the artifacts
+  load.*     ModelBundle.load + validate of a model version, as a hot-reload does it
+  qg.*       Gemini question generation against the local stub, cache hits, stream parsing
+
+Every benchmark reports p50/p99 latency per call and the peak memory allocated during one
+extra call (tracemalloc, numpy arrays included; memory-mapped model files are not).
+
+Results can be stored as a baseline (benchmarks/baselines/<scale>.json by default) and
+later runs compared with it: a benchmark whose p50 or peak memory grew by more than
+--tolerance is reported as a regression and the run exits with status 1. Timings depend on
+the machine, so compare against a baseline recorded on the same host.
+
+Usage (from ml-service/):
+    python benchmarks/suite.py --scale small                  # run and compare with the baseline
+    python benchmarks/suite.py --scale small --save-baseline  # record a new baseline
+    python benchmarks/suite.py --scale large --only predict load --runs 100
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("RECOMMENDATION_CACHE_SIZE", "0") # Every call runs the full pipeline
+os.environ.setdefault("MODEL_RELOAD_INTERVAL", "0")
+os.environ["QG_CACHE_DIR"] = "" # Question cache stays in memory, nothing is written next to real models
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from common import peak_rss_mb
+from synthetic import (SCALES, generate_course_features, generate_interactions, synthetic_bundle,
+                       synthetic_model, synthetic_user_data, write_synthetic_model)
+from recommendation import predictor
+from recommendation.artifacts import save_artifacts
+from recommendation.cf_engine import DEFAULT_ALS_FACTORS, fit_implicit_als, fit_scaled_svd
+from recommendation.neighbors import DEFAULT_NEIGHBORS_K, build_topk_neighbors
+from recommendation.ann import build_ann_neighbors
+from recommendation.text_index import CourseTextIndex
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, "baselines")
+GROUPS = ("predict", "train", "load", "qg")
+TOP_N = 10
+ALPHA = 0.6
+SEED_COURSES = 20 # Courses in each synthetic request payload
+BATCH_USERS = 64 # Users per get_hybrid_recommendations_batch call
+# Changes smaller than these are noise, whatever the ratio
+MIN_REGRESSION_MS = 0.05
+MIN_REGRESSION_MB = 1.0
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q / 100 * len(sorted_values)))]
+
+
+def measure(call, runs):
+    """
+    Times `runs` calls of call(i), i = 0..runs-1, after one warm-up call(runs), then traces the
+    allocations of one more call(runs + 1). Inputs that must not repeat (e.g. users to fold in)
+    therefore need runs + 2 entries.
+    """
+    with contextlib.redirect_stdout(io.StringIO()): # The service code logs every request
+        call(runs)
+        latencies = []
+        for i in range(runs):
+            started = time.perf_counter()
+            call(i)
+            latencies.append((time.perf_counter() - started) * 1000)
+        tracemalloc.start()
+        try:
+            call(runs + 1)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    latencies.sort()
+    return {
+        "runs": runs,
+        "p50_ms": round(statistics.median(latencies), 4),
+        "p99_ms": round(percentile(latencies, 99), 4),
+        "mean_ms": round(statistics.mean(latencies), 4),
+        "peak_mb": round(peak_bytes / (1024 * 1024), 3),
+    }
+
+
+# --- Benchmark definitions: each returns [(name, call, runs), ...] ---
+
+def prediction_benchmarks(bundle, runs):
+    rng = random.Random(0)
+    n_users = len(bundle.cf_user_positions)
+    course_ids = bundle.hybrid_course_ids
+    known = [synthetic_user_data(rng, bundle.cf_user_positions.id_at(rng.randrange(n_users)), course_ids, SEED_COURSES)
+             for _ in range(runs + 2)]
+    # Users that joined after training are folded in; fresh IDs so the fold-in cache never hits
+    new = [synthetic_user_data(rng, f"new-user-{i}", course_ids, SEED_COURSES) for i in range(runs + 2)]
+    batches = [[synthetic_user_data(rng, bundle.cf_user_positions.id_at(rng.randrange(n_users)), course_ids, SEED_COURSES)
+                for _ in range(BATCH_USERS)] for _ in range(3)]
+    courses = [rng.choice(course_ids) for _ in range(runs + 2)]
+    batch_runs = max(1, runs // 10)
+    # The synthetic model has no TF-IDF vectors; index synthetic course texts, query with texts of new courses
+    texts = generate_course_features(len(course_ids))
+    vectorizer = TfidfVectorizer(stop_words="english")
+    text_index = CourseTextIndex(vectorizer, course_ids, vectorizer.fit_transform(texts))
+    queries = generate_course_features(runs + 2, seed=1)
+    return [
+        ("predict.hybrid", lambda i: predictor.get_hybrid_recommendations(known[i]["user_id"], TOP_N, ALPHA, user_data=known[i]), runs),
+        ("predict.hybrid_fold_in", lambda i: predictor.get_hybrid_recommendations(new[i]["user_id"], TOP_N, ALPHA, user_data=new[i]), runs),
+        (f"predict.hybrid_batch{BATCH_USERS}", lambda i: predictor.get_hybrid_recommendations_batch(batches[i % 3], TOP_N, ALPHA), batch_runs),
+        ("predict.collaborative", lambda i: predictor.get_collaborative_recommendations(known[i]["user_id"], TOP_N, models=bundle), runs),
+        ("predict.content", lambda i: predictor.get_content_recommendations(courses[i], TOP_N, models=bundle), runs),
+        ("predict.text_search", lambda i: text_index.search_text(queries[i], TOP_N), runs),
+    ]
+
+
+def training_benchmarks(n_users, n_courses, runs, work_dir):
+    print(f"Generating {n_users} users x {n_courses} courses of interactions and course texts...")
+    ratings, _, _ = generate_interactions(n_users, n_courses)
+    features = generate_course_features(n_courses)
+    tfidf = TfidfVectorizer(stop_words="english").fit_transform(features)
+    print(f"  {ratings.nnz} enrollments ({ratings.nnz / n_users:.1f} per user), {tfidf.shape[1]} TF-IDF terms")
+    factors = min(DEFAULT_ALS_FACTORS, min(ratings.shape))
+    arrays, id_maps, metadata = synthetic_model(n_users, n_courses, factors=factors)
+    artifacts_dir = os.path.join(work_dir, "save")
+    return [
+        ("train.tfidf", lambda i: TfidfVectorizer(stop_words="english").fit_transform(features), runs),
+        ("train.neighbors", lambda i: build_topk_neighbors(tfidf, k=DEFAULT_NEIGHBORS_K), runs),
+        ("train.neighbors_ann", lambda i: build_ann_neighbors(tfidf, k=DEFAULT_NEIGHBORS_K), runs),
+        ("train.als_iteration", lambda i: fit_implicit_als(ratings, factors=factors, iterations=1), runs),
+        ("train.svd", lambda i: fit_scaled_svd(ratings, min(100, min(ratings.shape) - 1), 3.0, 5.0), runs),
+        ("train.save_artifacts", lambda i: save_artifacts(artifacts_dir, arrays, id_maps=id_maps, metadata=metadata), runs),
+    ]
+
+
+def load_benchmarks(model_dir, runs):
+    def load_and_validate(i):
+        bundle = predictor.ModelBundle.load(model_dir, "benchmark")
+        if bundle.validate():
+            raise RuntimeError(f"Synthetic model failed validation: {bundle.validate()}")
+
+    return [("load.bundle", load_and_validate, runs)]
+
+
+def question_benchmarks(runs):
+    from question_generator.gemini_stub import start_stub_server
+
+    server, base_url = start_stub_server(n_questions=50, chunk_chars=40)
+    # The client reads its settings at import, so point it at the stub before importing it
+    os.environ["GEMINI_API_BASE"] = base_url
+    os.environ["GEMINI_API_KEY"] = "stub"
+    from question_generator.generator import generate_questions
+    from question_generator.question_cache import question_cache_key
+    from question_generator.streaming import QuestionStreamParser
+    from question_generator.gemini_stub import stub_questions
+
+    contexts = [f"Course {i}: " + " ".join(f"lesson{j} covers topic{(i + j) % 97}" for j in range(200)) for i in range(runs + 2)]
+    response = "```json\n" + json.dumps(stub_questions("a guide on binary search trees", 50)) + "\n```"
+    chunks = [response[start:start + 40] for start in range(0, len(response), 40)]
+
+    def parse_stream(i):
+        parser = QuestionStreamParser()
+        for chunk in chunks:
+            parser.feed(chunk)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        generate_questions(contexts[0], use_gemini=True) # Fills the cache for qg.cache_hit
+    return server, [
+        ("qg.gemini_stub", lambda i: generate_questions(contexts[i], use_gemini=True, force_refresh=True), runs),
+        ("qg.cache_hit", lambda i: generate_questions(contexts[0], use_gemini=True), runs),
+        ("qg.cache_key", lambda i: question_cache_key(contexts[i], "gemini", "model", 1), runs),
+        ("qg.stream_parser", parse_stream, runs),
+    ]
+
+
+# --- Baselines ---
+
+def compare_with_baseline(results, config, baseline, tolerance):
+    """
+    Returns (rows, regressions): per benchmark, its p50 and peak memory relative to the
+    baseline, and the names of the benchmarks that got slower or bigger beyond `tolerance`.
+    """
+    if baseline.get("config") != config:
+        print(f"⚠️ Baseline was recorded with {baseline.get('config')}, this run uses {config}; not comparing.")
+        return {}, []
+    rows, regressions = {}, []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        p50_ratio = result["p50_ms"] / base["p50_ms"] if base["p50_ms"] else None
+        slower = result["p50_ms"] > base["p50_ms"] * (1 + tolerance) and result["p50_ms"] - base["p50_ms"] > MIN_REGRESSION_MS
+        bigger = result["peak_mb"] > base["peak_mb"] * (1 + tolerance) and result["peak_mb"] - base["peak_mb"] > MIN_REGRESSION_MB
+        rows[name] = {"p50_ratio": p50_ratio, "baseline_p50_ms": base["p50_ms"], "baseline_peak_mb": base["peak_mb"],
+                      "slower": slower, "bigger": bigger}
+        if slower or bigger:
+            regressions.append(name)
+    return rows, regressions
+
+
+def print_report(results, comparison):
+    print(f"\n{'benchmark':<28} {'runs':>5} {'p50 ms':>10} {'p99 ms':>10} {'peak MB':>9}  vs baseline")
+    for name, r in results.items():
+        row = comparison.get(name)
+        note = ""
+        if row is not None:
+            note = f"p50 x{row['p50_ratio']:.2f}" if row["p50_ratio"] is not None else "p50 n/a"
+            note += f", peak {row['baseline_peak_mb']:.1f} -> {r['peak_mb']:.1f} MB"
+            if row["slower"] or row["bigger"]:
+                note += "  ❌ REGRESSION"
+        print(f"{name:<28} {r['runs']:>5} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f} {r['peak_mb']:>9.2f}  {note}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite for recommendations and question generation.")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--users", type=int, default=None, help="Overrides the user count of --scale")
+    parser.add_argument("--courses", type=int, default=None, help="Overrides the course count of --scale")
+    parser.add_argument("--only", nargs="+", default=None, help=f"Benchmark name prefixes to run (groups: {', '.join(GROUPS)})")
+    parser.add_argument("--runs", type=int, default=200, help="Timed calls per prediction and question benchmark")
+    parser.add_argument("--train-runs", type=int, default=3, help="Timed calls per training and load benchmark")
+    parser.add_argument("--baseline", default=None, help="Baseline JSON (default: benchmarks/baselines/<scale>.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative growth of p50 and peak memory")
+    parser.add_argument("--output", default=None, help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    n_users = args.users or SCALES[args.scale]["users"]
+    n_courses = args.courses or SCALES[args.scale]["courses"]
+    config = {"users": n_users, "courses": n_courses, "runs": args.runs, "train_runs": args.train_runs}
+    baseline_path = args.baseline or os.path.join(BASELINES_DIR, f"{args.scale}.json")
+
+    def wanted(group):
+        return args.only is None or any(prefix.split(".")[0] == group for prefix in args.only)
+
+    work_dir = tempfile.TemporaryDirectory(prefix="ml-benchmarks-") # Holds mapped model files until exit
+    model_dir = os.path.join(work_dir.name, "model")
+    benchmarks = []
+    stub_server = None
+    if wanted("predict") or wanted("load"):
+        print(f"Writing a synthetic model: {n_users} users x {n_courses} courses...")
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_synthetic_model(model_dir, n_users, n_courses, factors=DEFAULT_ALS_FACTORS)
+    if wanted("predict"):
+        with contextlib.redirect_stdout(io.StringIO()):
+            bundle = synthetic_bundle(model_dir, n_users, n_courses)
+        predictor.model_registry._active = bundle # The batch path serves the registry's current bundle
+        benchmarks += prediction_benchmarks(bundle, args.runs)
+    if wanted("train"):
+        benchmarks += training_benchmarks(n_users, n_courses, args.train_runs, work_dir.name)
+    if wanted("load"):
+        benchmarks += load_benchmarks(model_dir, args.train_runs)
+    if wanted("qg"):
+        stub_server, qg_benchmarks = question_benchmarks(args.runs)
+        benchmarks += qg_benchmarks
+    if args.only:
+        benchmarks = [b for b in benchmarks if any(b[0].startswith(prefix) for prefix in args.only)]
+
+    results = {}
+    for name, call, runs in benchmarks:
+        print(f"⏱️ {name} ({runs} runs)...", flush=True)
+        results[name] = measure(call, runs)
+    if stub_server is not None:
+        stub_server.shutdown()
+
+    report = {
+        "scale": args.scale,
+        "config": config,
+        "machine": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                    "cpus": os.cpu_count()},
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "results": results,
+    }
+
+    comparison, regressions = {}, []
+    if not args.save_baseline and os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            comparison, regressions = compare_with_baseline(results, config, json.load(f), args.tolerance)
+    print_report(results, comparison)
+    print(f"\nPeak RSS of the benchmark process: {report['peak_rss_mb']:.0f} MB")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        if os.path.exists(baseline_path):
+            # Keep the results of benchmarks this run skipped (e.g. with --only)
+            with open(baseline_path) as f:
+                previous = json.load(f)
+            if previous.get("config") == config:
+                report["results"] = {**previous["results"], **results}
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_path)), exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Baseline saved to {baseline_path}")
+    elif regressions:
+        print(f"❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    elif comparison:
+        print(f"✅ No regressions beyond {args.tolerance:.0%} against {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Synthetic data for the benchmarks, shaped like the production data but of any size.
+
+* Interactions: distinct (user, course) enrollments with ratings 3-5 like
+  database_utils._enrollment_ratings. Enrollments per user are geometric (most users take a
+  handful of courses, a few take many) and course popularity follows a Zipf law, so the
+  matrix is as sparse and as skewed as real enrollment data.
+* Course texts: course descriptions drawn from topic vocabularies, for the TF-IDF stage.
+* Models: random CF factors and a topic-clustered neighbor index in the artifact format
+  (recommendation/artifacts.py), so serving can be benchmarked at 10^6 users x 10^5 courses
+  without training at that size first.
+"""
+import os
+
+import numpy as np
+from scipy import sparse
+
+from recommendation.artifacts import save_artifacts
+
+SCALES = {
+    "small": {"users": 20_000, "courses": 2_000},
+    "medium": {"users": 200_000, "courses": 20_000},
+    "large": {"users": 1_000_000, "courses": 100_000},
+}
+MEAN_ENROLLMENTS_PER_USER = 6
+MAX_ENROLLMENTS_PER_USER = 300
+POPULARITY_SKEW = 0.8 # Zipf exponent of course popularity
+COURSES_PER_TOPIC = 40
+LEARNING_STYLES = ["visual", "auditory", "reading/writing", "kinesthetic"]
+
+
+def synthetic_ids(prefix, n):
+    """Fixed-width IDs like the 24-character ObjectId strings of the real data."""
+    return [f"{prefix}{i:0{24 - len(prefix)}d}" for i in range(n)]
+
+
+def generate_interactions(n_users, n_courses, mean_enrollments=MEAN_ENROLLMENTS_PER_USER,
+                          popularity_skew=POPULARITY_SKEW, seed=0):
+    """
+    A users x courses rating matrix in the layout fetch_user_item_matrix returns.
+
+    Returns:
+        (ratings, user_ids, course_ids): CSR float32 matrix (0 = not enrolled) and the row
+        and column IDs.
+    """
+    rng = np.random.default_rng(seed)
+    popularity = 1.0 / np.arange(1, n_courses + 1) ** popularity_skew
+    popularity = rng.permutation(popularity / popularity.sum()) # Popular courses are spread over all positions
+
+    counts = np.minimum(rng.geometric(1.0 / mean_enrollments, size=n_users), min(MAX_ENROLLMENTS_PER_USER, n_courses))
+    rows = np.repeat(np.arange(n_users, dtype=np.int64), counts)
+    cols = rng.choice(n_courses, size=rows.size, p=popularity)
+    # Repeated draws of the same course are one enrollment, as in stream_enrollments
+    pairs = np.unique(rows * n_courses + cols)
+    ratings = sparse.csr_matrix(
+        (rng.integers(3, 6, size=pairs.size).astype(np.float32), ((pairs // n_courses).astype(np.int32), (pairs % n_courses).astype(np.int32))),
+        shape=(n_users, n_courses))
+    return ratings, synthetic_ids("user", n_users), synthetic_ids("course", n_courses)
+
+
+def course_topics(n_courses, seed=0):
+    """Topic of every course, COURSES_PER_TOPIC courses per topic on average."""
+    n_topics = max(1, n_courses // COURSES_PER_TOPIC)
+    return np.random.default_rng(seed).integers(0, n_topics, size=n_courses)
+
+
+def generate_course_features(n_courses, words_per_course=40, topic_words=60, general_words=2000, seed=0):
+    """
+    `combined_features` texts: mostly words of the course's topic, some general vocabulary.
+
+    Returns:
+        list[str]: One text per course, in course position order.
+    """
+    rng = np.random.default_rng(seed)
+    topics = course_topics(n_courses, seed)
+    from_topic = rng.random((n_courses, words_per_course)) < 0.7
+    topic_word = rng.integers(0, topic_words, size=(n_courses, words_per_course))
+    general_word = rng.integers(0, general_words, size=(n_courses, words_per_course))
+    texts = []
+    for course in range(n_courses):
+        texts.append(" ".join(
+            f"t{topics[course]}w{topic_word[course, j]}" if from_topic[course, j] else f"word{general_word[course, j]}"
+            for j in range(words_per_course)))
+    return texts
+
+
+def synthetic_neighbor_index(n_courses, k, seed=0):
+    """
+    A (courses x k) neighbor index in the layout of build_topk_neighbors: neighbors are other
+    courses of the same topic with descending scores. Built in O(courses x k), so large
+    scales do not need the quadratic similarity pass.
+    """
+    rng = np.random.default_rng(seed)
+    topics = course_topics(n_courses, seed)
+    by_topic = np.argsort(topics, kind="stable")
+    topic_start = np.searchsorted(topics[by_topic], topics)
+    topic_size = np.bincount(topics)[topics]
+    offsets = (rng.random((n_courses, k)) * topic_size[:, np.newaxis]).astype(np.int64)
+    indices = by_topic[topic_start[:, np.newaxis] + offsets]
+    # A course is not its own neighbor; point those entries at the next course instead
+    own = indices == np.arange(n_courses)[:, np.newaxis]
+    indices[own] = (indices[own] + 1) % n_courses
+    scores = -np.sort(-rng.uniform(0.05, 0.9, size=(n_courses, k)), axis=1)
+    return indices.astype(np.int32), scores.astype(np.float32)
+
+
+def synthetic_model(n_users, n_courses, factors=64, neighbors=50, seed=0):
+    """
+    Model components in the artifact format: random ALS factors and a synthetic neighbor index.
+
+    Returns:
+        (arrays, id_maps, metadata): the arguments of save_artifacts.
+    """
+    rng = np.random.default_rng(seed)
+    neighbor_indices, neighbor_scores = synthetic_neighbor_index(n_courses, min(neighbors, n_courses - 1), seed)
+    scale = 1.0 / np.sqrt(factors) # Keeps predicted preferences around [-1, 1]
+    arrays = {
+        "content_neighbor_indices": neighbor_indices,
+        "content_neighbor_scores": neighbor_scores,
+        "cf_user_factors": (rng.standard_normal((n_users, factors), dtype=np.float32) * scale),
+        "cf_item_factors": (rng.standard_normal((factors, n_courses), dtype=np.float32) * scale),
+    }
+    course_ids = synthetic_ids("course", n_courses)
+    id_maps = {"content_courses": course_ids, "cf_users": synthetic_ids("user", n_users), "cf_courses": course_ids}
+    metadata = {
+        "cf_rating_scale": {"min_val": 0.0, "max_val": 1.0},
+        "cf_model": {"type": "als", "alpha": 10.0, "regularization": 0.1, "max_rating": 5.0},
+    }
+    return arrays, id_maps, metadata
+
+
+def write_synthetic_model(model_dir, n_users, n_courses, factors=64, neighbors=50, seed=0):
+    """Writes a synthetic model version to `model_dir`, ready for ModelBundle.load."""
+    arrays, id_maps, metadata = synthetic_model(n_users, n_courses, factors, neighbors, seed)
+    save_artifacts(model_dir, arrays, id_maps=id_maps, metadata=metadata)
+    return model_dir
+
+
+def synthetic_bundle(model_dir, n_users, n_courses, factors=64, neighbors=50, seed=0):
+    """A loaded and validated ModelBundle of a synthetic model written to `model_dir`."""
+    from recommendation.predictor import ModelBundle
+
+    if not os.path.exists(os.path.join(model_dir, "manifest.json")):
+        write_synthetic_model(model_dir, n_users, n_courses, factors, neighbors, seed)
+    bundle = ModelBundle.load(model_dir, "synthetic")
+    problems = bundle.validate()
+    if problems:
+        raise ValueError(f"Synthetic model is not servable: {', '.join(problems)}")
+    return bundle
+
+
+def synthetic_user_data(rng, user_id, course_ids, n_seeds):
+    """
+    A request payload as sent by the Node.js backend: `n_seeds` courses, half of them bare
+    enrollments and half with watched content.
+
+    Args:
+        rng (random.Random): Source of the course choice and learning style.
+    """
+    seeds = rng.sample(course_ids, n_seeds)
+    return {
+        "user_id": user_id,
+        "enrolledCourses": seeds[: n_seeds // 2],
+        "progress": [{"courseId": c, "watchedContent": ["intro"]} for c in seeds[n_seeds // 2:]],
+        "learningStyle": rng.choice(LEARNING_STYLES),
+    }
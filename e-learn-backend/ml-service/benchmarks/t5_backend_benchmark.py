@@ -0,0 +1,88 @@
+"""
+Latency per question and resident memory of each T5 backend (see question_generator/t5_backends.py).
+
+Every backend runs in its own interpreter so their memory does not mix. Each child loads
+the model through generator.load_t5_model(), measures RSS, then generates greedy questions
+for the parity contexts one at a time. The parent reports load time, RSS, p50/mean latency
+per question and how closely each backend's output matches the "torch" backend.
+
+Usage (from ml-service/, needs torch and transformers; convert the int8 artifact first):
+    python -m question_generator.t5_backends convert
+    python benchmarks/t5_backend_benchmark.py --backends torch int8 --repeats 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ML_SERVICE_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ML_SERVICE_DIR)
+
+from question_generator.t5_backends import compare_outputs
+
+RESULT_MARKER = "T5_BACKEND_RESULT "
+
+CHILD_CODE = f"""
+import json, sys, time
+sys.path.insert(0, {BENCHMARKS_DIR!r})
+from common import rss_mb
+from question_generator.generator import load_t5_model
+from question_generator.t5_backends import PARITY_CONTEXTS, greedy_questions
+
+started = time.perf_counter()
+tokenizer, model, device = load_t5_model()
+load_seconds = time.perf_counter() - started
+loaded_rss = rss_mb()
+
+greedy_questions(tokenizer, model, device, PARITY_CONTEXTS[:1]) # Warm-up
+latencies, outputs = [], []
+for _ in range(int(sys.argv[1])):
+    outputs = []
+    for context in PARITY_CONTEXTS:
+        started = time.perf_counter()
+        outputs.extend(greedy_questions(tokenizer, model, device, [context]))
+        latencies.append(time.perf_counter() - started)
+
+print({RESULT_MARKER!r} + json.dumps({{
+    "load_seconds": load_seconds,
+    "loaded_rss_mb": loaded_rss,
+    "peak_rss_mb": rss_mb(),
+    "latencies": latencies,
+    "outputs": outputs,
+}}), flush=True)
+"""
+
+
+def run_backend(backend, repeats):
+    env = dict(os.environ, QG_T5_BACKEND=backend, QG_PRELOAD_T5="false")
+    completed = subprocess.run([sys.executable, "-c", CHILD_CODE, str(repeats)], cwd=ML_SERVICE_DIR, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    raise RuntimeError(f"Backend '{backend}' failed (exit code {completed.returncode}):\n{completed.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare T5 backends: latency per question, memory and parity.")
+    parser.add_argument("--backends", nargs="+", default=["torch", "int8"])
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the parity contexts")
+    args = parser.parse_args()
+
+    results = {backend: run_backend(backend, args.repeats) for backend in args.backends}
+    reference = results.get("torch")
+
+    print(f"{'backend':>8} {'load s':>7} {'RSS MB':>8} {'peak MB':>8} {'p50 ms/q':>9} {'mean ms/q':>10} {'exact':>6} {'similar':>8}")
+    for backend, r in results.items():
+        parity = compare_outputs(reference["outputs"], r["outputs"]) if reference else None
+        print(f"{backend:>8} {r['load_seconds']:>7.1f} {r['loaded_rss_mb']:>8.0f} {r['peak_rss_mb']:>8.0f} "
+              f"{statistics.median(r['latencies']) * 1000:>9.1f} {statistics.mean(r['latencies']) * 1000:>10.1f} "
+              f"{parity['exact_match_rate'] if parity else float('nan'):>6.0%} "
+              f"{parity['mean_similarity'] if parity else float('nan'):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
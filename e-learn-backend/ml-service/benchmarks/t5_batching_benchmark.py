@@ -0,0 +1,96 @@
+"""
+Throughput and latency of T5 question generation at several micro-batch sizes.
+
+For every batch size a MicroBatcher is driven by `--concurrency` client threads that
+together send `--requests` contexts of mixed length. Reports requests per second,
+p50/p95 latency and the batch sizes the scheduler actually formed. Batch size 1 is the
+old one-request-per-generate behaviour.
+
+Usage (from ml-service/, needs torch and transformers):
+    python benchmarks/t5_batching_benchmark.py --batch-sizes 1 2 4 8 --requests 32 --concurrency 8
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from question_generator.batching import MicroBatcher
+from question_generator.generator import generate_questions_t5_batch, load_t5_model
+
+SAMPLE_CONTEXTS = [
+    "Python lists are ordered, mutable sequences. They can hold items of any type and grow as items are appended.",
+    "A <hl> binary search <hl> repeatedly halves a sorted array to find a target value in logarithmic time.",
+    "Photosynthesis converts light energy into chemical energy. Plants use carbon dioxide and water to produce "
+    "glucose and oxygen inside their chloroplasts, which contain the green pigment chlorophyll.",
+    "HTTP is a stateless protocol: every request carries all the information the server needs. Cookies and "
+    "tokens are used to build sessions on top of it. Status codes in the 2xx range mean success, 4xx client "
+    "errors and 5xx server errors. Caching headers such as ETag and Cache-Control let clients reuse responses.",
+]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def run(batch_size, n_requests, concurrency, max_wait_ms):
+    batcher = MicroBatcher(generate_questions_t5_batch, batch_size, max_wait_ms, name=f"bench-batcher-{batch_size}")
+    latencies = []
+    latencies_lock = threading.Lock()
+    next_request = iter(range(n_requests))
+    next_request_lock = threading.Lock()
+
+    def client():
+        while True:
+            with next_request_lock:
+                i = next(next_request, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            batcher(SAMPLE_CONTEXTS[i % len(SAMPLE_CONTEXTS)])
+            with latencies_lock:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    stats = batcher.stats()
+    return {
+        "batch_size": batch_size,
+        "requests_per_second": n_requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "mean_batch": stats["mean_batch_size"],
+        "max_batch": stats["max_batch_size_seen"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark T5 micro-batching.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per batch size")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent client threads")
+    parser.add_argument("--max-wait-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    load_t5_model()
+    generate_questions_t5_batch(SAMPLE_CONTEXTS[:1]) # Warm-up, first call pays one-off allocation costs
+
+    print(f"{'batch':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'mean batch':>11} {'max batch':>10}")
+    for batch_size in args.batch_sizes:
+        r = run(batch_size, args.requests, args.concurrency, args.max_wait_ms)
+        print(f"{r['batch_size']:>5} {r['requests_per_second']:>8.2f} {r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} "
+              f"{r['mean_batch'] or 0:>11.2f} {r['max_batch']:>10}")
+
+
+if __name__ == "__main__":
+    main()
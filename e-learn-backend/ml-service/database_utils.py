@@ -1,63 +1,283 @@
 import pandas as pd
+import numpy as np
+from scipy import sparse
 from pymongo import MongoClient
 import os
+import threading
+import time
 from dotenv import load_dotenv
-import random # <--- ADD THIS IMPORT!
 
 # Load environment variables from .env file (assuming it's at the project root)
 load_dotenv(os.path.join(os.path.dirname(os.path.dirname(__file__)), '.env'))
 
+# Connection pool settings, shared by every caller in the process
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 20))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 0))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 30000))
+# Health check caching: /health serves the last ping result, refreshed in the background
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 5)) # Seconds between background pings
+HEALTH_CACHE_TTL = float(os.getenv("HEALTH_CACHE_TTL", 15)) # Older results are refreshed inline
+
+_client = None
+_client_pid = None # PID that created _client; a forked worker must not reuse its parent's sockets
+_client_lock = threading.Lock()
+
+_health = None # Last ping result, see get_db_health
+_health_pinger_pid = None
+_health_lock = threading.Lock()
+
+def get_mongo_client():
+    """
+    Returns the process-wide MongoClient, creating it on first use.
+
+    MongoClient is thread-safe and pools its connections, so one instance serves the whole
+    process. It is not fork-safe: a process forked after the client was created (e.g. a
+    gunicorn worker) gets its own client on first use instead of the parent's.
+    """
+    global _client, _client_pid
+    if _client is not None and _client_pid == os.getpid():
+        return _client
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            db_uri = os.getenv("MONGO_URI")
+            if not db_uri:
+                raise ValueError("MONGO_URI environment variable not set. Please set it in your .env file.")
+            _client = MongoClient(
+                db_uri,
+                maxPoolSize=MONGO_MAX_POOL_SIZE,
+                minPoolSize=MONGO_MIN_POOL_SIZE,
+                serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                connect=False, # Connect on first operation, never during import or before a fork
+            )
+            _client_pid = os.getpid()
+    return _client
+
 def get_db_connection():
-    """Establishes a connection to MongoDB."""
-    db_uri = os.getenv("MONGO_URI")
-    if not db_uri:
-        raise ValueError("MONGO_URI environment variable not set. Please set it in your .env file.")
+    """Returns the database named in MONGO_URI, using the pooled process-wide client."""
     try:
-        client = MongoClient(db_uri)
-        return client.get_database() # This will get the database specified in the URI
+        return get_mongo_client().get_database() # This will get the database specified in the URI
     except Exception as e:
         print(f"Error connecting to MongoDB: {e}")
         raise
 
-def fetch_all_courses_for_content_based_training():
+def _ping_database():
+    """Pings MongoDB once and stores the result for get_db_health."""
+    global _health
+    started = time.perf_counter()
+    try:
+        get_db_connection().command('ping') # A simple command to check connection
+        result = {"status": "healthy", "database_connection": "successful"}
+    except Exception as e:
+        result = {"status": "unhealthy", "database_connection": "failed", "error": str(e)}
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    result["checked_at"] = time.time()
+    _health = result
+    return result
+
+def _health_pinger():
+    while True:
+        time.sleep(HEALTH_CHECK_INTERVAL)
+        _ping_database()
+
+def start_health_pinger():
+    """Starts the background pinger of this process (once per process, also after a fork)."""
+    global _health_pinger_pid
+    with _health_lock:
+        if _health_pinger_pid == os.getpid():
+            return
+        _health_pinger_pid = os.getpid()
+        threading.Thread(target=_health_pinger, name="mongo-health-pinger", daemon=True).start()
+
+def get_db_health():
+    """
+    Returns the cached database health without touching the network.
+
+    The result comes from the background pinger. Only the first call of a process, or a
+    result older than HEALTH_CACHE_TTL (e.g. the pinger is stuck on a slow server), pings inline.
+    """
+    start_health_pinger()
+    health = _health
+    if health is None or time.time() - health["checked_at"] > HEALTH_CACHE_TTL:
+        with _health_lock:
+            health = _health
+            if health is None or time.time() - health["checked_at"] > HEALTH_CACHE_TTL:
+                health = _ping_database()
+    return dict(health, age_seconds=round(time.time() - health["checked_at"], 3))
+
+def _changed_courses_filter(since=None, until=None):
+    """
+    Mongo filter for courses changed in the window (since, until], based on the `updatedAt`
+    timestamp that the Course model maintains (timestamps: true). No bounds means all courses.
+    """
+    updated_at = {}
+    if since is not None:
+        updated_at['$gt'] = since
+    if until is not None:
+        updated_at['$lte'] = until
+    return {'updatedAt': updated_at} if updated_at else {}
+
+def fetch_course_ids():
+    """Returns the IDs of all courses (used by incremental training to detect deleted courses)."""
+    db = get_db_connection()
+    return [str(course_doc['_id']) for course_doc in db['courses'].find({}, {'_id': 1})]
+
+# Documents per cursor round trip for bulk training fetches
+MONGO_FETCH_BATCH_SIZE = int(os.getenv("MONGO_FETCH_BATCH_SIZE", 10000))
+# Courses per chunk yielded by iter_course_feature_chunks
+COURSE_CHUNK_SIZE = int(os.getenv("COURSE_CHUNK_SIZE", 2000))
+
+# Only the fields that feed the combined feature string are sent over the wire
+COURSE_FEATURE_PROJECTION = {
+    'title': 1, 'description': 1, 'subject': 1, 'format': 1, 'difficulty': 1,
+    'videos.title': 1, 'textResources.summary': 1,
+}
+
+def course_combined_features(course_doc):
+    """Builds the combined feature string used for TF-IDF from one course document."""
+    title = course_doc.get('title', '')
+    description = course_doc.get('description', '')
+    subject = course_doc.get('subject', '')
+    format_val = course_doc.get('format', 'Mixed') # Default to 'Mixed' if not set
+    difficulty_val = course_doc.get('difficulty', 'Beginner') # Default to 'Beginner'
+
+    # Combine video titles/summaries (if you've added them)
+    video_content = " ".join([v.get('title', '') for v in course_doc.get('videos', [])])
+
+    # Combine text resource summaries
+    text_content = " ".join([tr.get('summary', '') for tr in course_doc.get('textResources', []) if tr.get('summary')])
+
+    # Create the combined features string for TF-IDF
+    # Prioritize title, description, and explicit tags. Add video/text content.
+    return f"{title} {description} {subject} {format_val} {difficulty_val} {video_content} {text_content}".strip()
+
+def iter_course_feature_chunks(since=None, until=None, chunk_size=None):
+    """
+    Streams courses from MongoDB as (course_ids, combined_features) list pairs of up to
+    `chunk_size` courses, so callers never hold the raw course documents in memory.
+
+    Args:
+        since (datetime, optional): Only fetch courses updated after this time (incremental training).
+        until (datetime, optional): Only fetch courses updated at or before this time.
+        chunk_size (int, optional): Courses per chunk (defaults to COURSE_CHUNK_SIZE).
+    """
+    chunk_size = chunk_size or COURSE_CHUNK_SIZE
+    db = get_db_connection()
+    cursor = db['courses'].find(_changed_courses_filter(since, until), COURSE_FEATURE_PROJECTION, batch_size=MONGO_FETCH_BATCH_SIZE)
+    course_ids, features = [], []
+    for course_doc in cursor:
+        course_ids.append(str(course_doc['_id'])) # Convert ObjectId to string
+        features.append(course_combined_features(course_doc))
+        if len(course_ids) >= chunk_size:
+            yield course_ids, features
+            course_ids, features = [], []
+    if course_ids:
+        yield course_ids, features
+
+def fetch_all_courses_for_content_based_training(since=None, until=None):
     """
     Fetches course data from MongoDB and prepares it for content-based filtering.
     Includes new 'subject', 'format', 'difficulty' fields and text resource summaries.
+    Returns a DataFrame with 'CourseID' and 'combined_features' columns.
+
+    Args:
+        since (datetime, optional): Only fetch courses updated after this time (incremental training).
+        until (datetime, optional): Only fetch courses updated at or before this time.
     """
-    db = get_db_connection()
-    courses_collection = db['courses'] # Assuming your collection is named 'courses'
-    
-    content_data_list = []
     print("Fetching courses for content-based training...")
-    for course_doc in courses_collection.find({}):
-        course_id = str(course_doc['_id']) # Convert ObjectId to string
-        title = course_doc.get('title', '')
-        description = course_doc.get('description', '')
-        subject = course_doc.get('subject', '')
-        format_val = course_doc.get('format', 'Mixed') # Default to 'Mixed' if not set
-        difficulty_val = course_doc.get('difficulty', 'Beginner') # Default to 'Beginner'
-
-        # Combine video titles/summaries (if you've added them)
-        video_content = " ".join([v.get('title', '') for v in course_doc.get('videos', [])])
-        
-        # Combine text resource summaries
-        text_content = " ".join([tr.get('summary', '') for tr in course_doc.get('textResources', []) if tr.get('summary')])
-        
-        # Create the combined features string for TF-IDF
-        # Prioritize title, description, and explicit tags. Add video/text content.
-        combined_features_str = f"{title} {description} {subject} {format_val} {difficulty_val} {video_content} {text_content}".strip()
-        
-        content_data_list.append({
-            'CourseID': course_id,
-            'Subject': subject,
-            'Format': format_val,
-            'Difficulty': difficulty_val,
-            'combined_features': combined_features_str # This is the main feature for TFIDF
-        })
-    print(f"Fetched {len(content_data_list)} courses.")
-    return pd.DataFrame(content_data_list)
-
-def fetch_user_ratings_and_enrollments():
+    course_ids, features = [], []
+    for chunk_ids, chunk_features in iter_course_feature_chunks(since, until):
+        course_ids.extend(chunk_ids)
+        features.extend(chunk_features)
+    print(f"Fetched {len(course_ids)} courses.")
+    return pd.DataFrame({'CourseID': course_ids, 'combined_features': features})
+
+def _intern(codes, key):
+    """Integer code of `key`, assigning the next free code to unseen keys."""
+    code = codes.get(key)
+    if code is None:
+        code = codes[key] = len(codes)
+    return code
+
+def stream_enrollments(since=None, until=None, course_ids=None):
+    """
+    Streams (user, course) enrollment pairs with a server-side $unwind aggregation and
+    interns the IDs to integer codes on the fly, filling growable COO arrays. No per-row
+    dicts or DataFrames are built, so memory stays at two int32 arrays plus the ID lists.
+
+    Args:
+        since (datetime, optional): Only fetch enrollments of courses updated after this time.
+        until (datetime, optional): Only fetch enrollments of courses updated at or before this time.
+        course_ids (list, optional): Known course order; these courses get the first codes
+            (e.g. to align columns with the content model) even if nobody is enrolled.
+
+    Returns:
+        (user_codes, course_codes, user_ids, course_ids): int32 code arrays (one entry per
+        distinct enrollment) and the IDs in code order.
+    """
+    db = get_db_connection()
+    user_codes_map = {}
+    course_codes_map = {}
+    for course_id in course_ids or []:
+        _intern(course_codes_map, str(course_id))
+
+    pipeline = [
+        {'$match': _changed_courses_filter(since, until)},
+        {'$project': {'enrolledStudents': 1}},
+        {'$unwind': '$enrolledStudents'},
+    ]
+    capacity = MONGO_FETCH_BATCH_SIZE
+    user_codes = np.empty(capacity, dtype=np.int32)
+    course_codes = np.empty(capacity, dtype=np.int32)
+    count = 0
+    # Consecutive unwound documents share the course, so its code is looked up once per course
+    last_course_oid, last_course_code = None, None
+    for doc in db['courses'].aggregate(pipeline, batchSize=MONGO_FETCH_BATCH_SIZE, allowDiskUse=True):
+        if count == capacity:
+            capacity *= 2
+            user_codes = np.resize(user_codes, capacity)
+            course_codes = np.resize(course_codes, capacity)
+        if doc['_id'] != last_course_oid:
+            last_course_oid, last_course_code = doc['_id'], _intern(course_codes_map, str(doc['_id']))
+        user_codes[count] = _intern(user_codes_map, str(doc['enrolledStudents'])) # Convert ObjectId to string
+        course_codes[count] = last_course_code
+        count += 1
+
+    # A student listed twice in enrolledStudents counts as one enrollment
+    n_courses = max(len(course_codes_map), 1)
+    pairs = np.unique(user_codes[:count].astype(np.int64) * n_courses + course_codes[:count])
+    return (pairs // n_courses).astype(np.int32), (pairs % n_courses).astype(np.int32), list(user_codes_map), list(course_codes_map)
+
+def _enrollment_ratings(n):
+    """
+    Assign a default 'rating' to each enrollment, since none is stored.
+    In a real system, you might get this from a 'progress' or 'rating' collection.
+    """
+    # rating = 5 # Assume enrollment means a positive interaction/rating
+    # Random rating between 3 and 5 (inclusive) to introduce variance
+    return np.random.randint(3, 6, size=n).astype(np.float32)
+
+def fetch_user_item_matrix(since=None, until=None, course_ids=None):
+    """
+    Fetches user-course interaction data for collaborative filtering directly as a sparse
+    (users x courses) rating matrix, see stream_enrollments.
+
+    Returns:
+        (ratings, user_ids, course_ids): scipy.sparse CSR matrix of ratings (0 = no
+        interaction) and the IDs of its rows and columns.
+    """
+    print("Fetching user interactions for collaborative filtering...")
+    user_codes, course_codes, user_ids, course_ids = stream_enrollments(since, until, course_ids)
+    ratings = sparse.csr_matrix((_enrollment_ratings(user_codes.size), (user_codes, course_codes)), shape=(len(user_ids), len(course_ids)))
+    print(f"Fetched {ratings.nnz} user interactions ({len(user_ids)} users, {len(course_ids)} courses).")
+    if ratings.nnz == 0:
+        print("WARNING: No user interactions found. Collaborative Filtering might not be effective.")
+    return ratings, user_ids, course_ids
+
+def fetch_user_ratings_and_enrollments(since=None, until=None):
     """
     Fetches user-course interaction data for collaborative filtering.
     This function's logic is highly dependent on your actual user interaction schema.
@@ -67,34 +287,19 @@ def fetch_user_ratings_and_enrollments():
       Each enrollment implies a positive interaction (e.g., a 'rating' of 5).
     2. Ideally, you would have a dedicated 'enrollments' or 'user_progress'
       collection with explicit ratings or completion statuses.
+
+    Returns a DataFrame with 'UserID', 'CourseID' and 'Rating' columns. Prefer
+    fetch_user_item_matrix for bulk training, it never builds per-interaction rows.
+
+    Args:
+        since (datetime, optional): Only fetch enrollments of courses updated after this time.
+            Enrolling a student updates the course, so this returns the complete current
+            enrollments of every changed course.
+        until (datetime, optional): Only fetch enrollments of courses updated at or before this time.
     """
-    db = get_db_connection()
-    user_interactions = []
-    
     print("Fetching user interactions for collaborative filtering...")
-    # Iterate through courses and their enrolled students
-    courses_collection = db['courses']
-    for course_doc in courses_collection.find({}, {'_id': 1, 'enrolledStudents': 1}):
-        course_id = str(course_doc['_id'])
-        enrolled_students = course_doc.get('enrolledStudents', [])
-        
-        for student_oid in enrolled_students:
-            user_id = str(student_oid) # Convert ObjectId to string
-            # Assign a default 'rating' if not explicitly stored.
-            # In a real system, you might get this from a 'progress' or 'rating' collection.
-            
-            # --- REPLACE THIS LINE ---
-            # rating = 5 # Assume enrollment means a positive interaction/rating
-            
-            # --- WITH THIS LINE TO INTRODUCE VARIANCE ---
-            rating = random.randint(3, 5) # Assigns a random rating between 3 and 5 (inclusive)
-            
-            user_interactions.append({
-                'UserID': user_id,
-                'CourseID': course_id,
-                'Rating': rating
-            })
-            
+    user_codes, course_codes, user_ids, course_ids = stream_enrollments(since, until)
+
     # --- IMPORTANT ---
     # If you have a separate collection for explicit ratings/progress, query that instead.
     # Example if you had a 'ratings' collection:
@@ -106,7 +311,11 @@ def fetch_user_ratings_and_enrollments():
     #       'Rating': rating_doc['value'] # Assuming 'value' is the rating
     #   })
 
-    print(f"Fetched {len(user_interactions)} user interactions.")
-    if not user_interactions:
+    print(f"Fetched {user_codes.size} user interactions.")
+    if user_codes.size == 0:
         print("WARNING: No user interactions found. Collaborative Filtering might not be effective.")
-    return pd.DataFrame(user_interactions)
\ No newline at end of file
+    return pd.DataFrame({
+        'UserID': np.array(user_ids, dtype=object)[user_codes],
+        'CourseID': np.array(course_ids, dtype=object)[course_codes],
+        'Rating': _enrollment_ratings(user_codes.size).astype(int),
+    })
@@ -0,0 +1,74 @@
+"""
+Production server for the ML service: a pre-fork pool of gunicorn workers.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The master imports the app (and loads the recommendation models) once, warms it up and
+forks the workers, so the models and the lazily built scoring state are shared
+copy-on-write instead of loaded once per worker. Every worker then starts its own
+background threads (threads do not survive a fork), runs its own warm-up and only then
+accepts connections. GET /live and GET /ready are the liveness and readiness probes.
+
+On SIGTERM the master stops its workers gracefully: they report not ready, stop accepting
+and finish the requests in flight within GRACEFUL_TIMEOUT seconds.
+"""
+import gc
+import multiprocessing
+import os
+import signal
+
+# Recommendation scoring is many small matrix products per request. One BLAS thread per
+# worker thread lets throughput grow with WEB_CONCURRENCY instead of every worker fighting
+# over all cores. Must be set before numpy is imported (the app is imported after this file).
+ML_BLAS_THREADS = os.getenv("ML_BLAS_THREADS", "1")
+for blas_env in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+    os.environ.setdefault(blas_env, ML_BLAS_THREADS)
+# The master only loads models, workers start the model watcher after the fork (see predictor.py)
+os.environ["ML_PREFORK_MASTER"] = "true"
+
+bind = f"0.0.0.0:{int(os.getenv('PORT', 5001))}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count())) # One process per core
+# gthread workers serve several requests per process: question generation mostly waits on
+# Gemini, and the admin profiler blocks its own thread while it samples the others
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120)) # A worker silent for this long is restarted
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30)) # Time to finish in-flight requests on SIGTERM
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") # e.g. "-" for stdout, off by default
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def when_ready(server):
+    """Runs in the master before the first fork: warms the shared state up once, then freezes it."""
+    if not preload_app:
+        return
+    from app import app as flask_app
+    from lifecycle import warm_up
+
+    warm_up(flask_app)
+    # Objects created so far move to a generation the collector never scans, so collections
+    # in the workers do not write to (and un-share) the pages of the preloaded models
+    gc.freeze()
+    server.log.info(f"🚀 Models preloaded, starting {workers} workers x {threads} threads.")
+
+
+def post_fork(server, worker):
+    # Without preload_app the worker imports the app itself and should start its watcher as usual
+    os.environ.pop("ML_PREFORK_MASTER", None)
+
+
+def post_worker_init(worker):
+    """Runs in each worker after the app is loaded and before it accepts connections."""
+    from lifecycle import drain_on_signal, warm_up
+    from recommendation.predictor import MODEL_RELOAD_INTERVAL, model_registry
+
+    model_registry.start_watcher(MODEL_RELOAD_INTERVAL)
+    worker.notify() # A long warm-up must not count as a hung worker
+    warm_up(worker.wsgi)
+    drain_on_signal(signal.SIGTERM)
+
+
+def worker_exit(server, worker):
+    server.log.info(f"👋 Worker {worker.pid} stopped.")
@@ -0,0 +1,121 @@
+"""
+Worker lifecycle for the pre-fork server (gunicorn.conf.py): warm-up before taking
+traffic, readiness and draining on shutdown.
+
+GET /live only says that the process answers. GET /ready additionally needs the
+recommendation models loaded, a finished warm-up in this process and no shutdown in
+progress, so a load balancer only sends traffic to workers that will answer fast.
+
+State is kept per process (by pid), so a worker forked from a warmed-up master still runs
+its own warm-up before it reports ready.
+"""
+import logging
+import os
+import random
+import signal
+import time
+
+from recommendation.predictor import model_registry
+
+WARMUP_REQUESTS = int(os.getenv("WARMUP_REQUESTS", 20)) # Synthetic /recommendations calls per warm-up (0 skips it)
+WARMUP_BATCH_USERS = int(os.getenv("WARMUP_BATCH_USERS", 50)) # Users in the synthetic /recommendations/batch call
+WARMUP_SEED_COURSES = (1, 5, 20) # Seed-course counts of the synthetic users, covers the sparse and dense paths
+
+logger = logging.getLogger(__name__)
+_ready_pid = None
+_draining_pid = None
+_warmup_seconds = None
+
+
+def _warmup_user(rng, user_id, course_ids, n_seeds):
+    seeds = rng.sample(course_ids, min(n_seeds, len(course_ids)))
+    return {
+        "user_id": user_id,
+        "enrolledCourses": seeds[: len(seeds) // 2],
+        "progress": [{"courseId": c, "watchedContent": ["warmup"]} for c in seeds[len(seeds) // 2:]],
+        "learningStyle": "visual",
+    }
+
+
+def warm_up(flask_app):
+    """
+    Sends synthetic recommendation requests through the whole Flask stack of `flask_app`
+    and marks this process ready.
+
+    The first requests of a process pay for lazily built state (CBF rank matrices, fold-in
+    solvers, the learning-mode cache, imports done on first use); the warm-up pays it
+    instead of real users. Synthetic users are unknown to the CF model, so they take the
+    fold-in path, and their results go through the recommendation cache like any request.
+
+    Returns:
+        float: Seconds the warm-up took.
+    """
+    global _ready_pid, _warmup_seconds
+    started = time.perf_counter()
+    models = model_registry.current()
+    course_ids = list(models.hybrid_course_ids) if models is not None else []
+    if WARMUP_REQUESTS > 0 and course_ids:
+        rng = random.Random(0)
+        client = flask_app.test_client()
+        prefix = f"warmup-{os.getpid()}"
+        try:
+            for i in range(WARMUP_REQUESTS):
+                user = _warmup_user(rng, f"{prefix}-{i}", course_ids, WARMUP_SEED_COURSES[i % len(WARMUP_SEED_COURSES)])
+                client.post('/recommendations', json={"user_data": user, "top_n": 10})
+            if WARMUP_BATCH_USERS > 0:
+                users = [_warmup_user(rng, f"{prefix}-batch-{i}", course_ids, WARMUP_SEED_COURSES[i % len(WARMUP_SEED_COURSES)])
+                         for i in range(WARMUP_BATCH_USERS)]
+                client.post('/recommendations/batch', json={"users": users, "top_n": 10})
+        except Exception as e: # A failed warm-up only costs latency, the worker still serves
+            logger.warning(f"⚠️ Warm-up failed: {e}")
+    elif WARMUP_REQUESTS > 0:
+        logger.warning("⚠️ No recommendation model loaded, skipping warm-up.")
+
+    _warmup_seconds = time.perf_counter() - started
+    _ready_pid = os.getpid()
+    logger.info(f"✅ Worker {os.getpid()} warmed up in {_warmup_seconds:.2f}s.")
+    return _warmup_seconds
+
+
+def mark_draining():
+    """Reports this process as not ready from now on (it is shutting down)."""
+    global _draining_pid
+    _draining_pid = os.getpid()
+    logger.info(f"🛑 Worker {os.getpid()} draining, reporting not ready.")
+
+
+def drain_on_signal(signum=signal.SIGTERM):
+    """
+    Marks the process draining when `signum` arrives, then runs the handler installed before
+    (the server's own graceful shutdown). Must be called from the main thread.
+    """
+    previous = signal.getsignal(signum)
+    if not callable(previous):
+        return # Default handling ends the process at once, nothing would observe the flag
+
+    def handler(sig, frame):
+        mark_draining()
+        previous(sig, frame)
+
+    signal.signal(signum, handler)
+
+
+def readiness():
+    """
+    Returns:
+        (bool, dict): Whether this process should receive traffic, and the checks behind it.
+    """
+    models = model_registry.current()
+    models_loaded = models is not None and models.cf_model_loaded() and models.content_model_loaded()
+    warmed_up = _ready_pid == os.getpid()
+    draining = _draining_pid == os.getpid()
+    ready = models_loaded and warmed_up and not draining
+    return ready, {
+        "status": "ready" if ready else "not_ready",
+        "models_loaded": models_loaded,
+        "model_version": models.version if models is not None else None,
+        "warmed_up": warmed_up,
+        "warmup_seconds": round(_warmup_seconds, 3) if warmed_up and _warmup_seconds is not None else None,
+        "draining": draining,
+        "worker": os.getpid(),
+    }
@@ -0,0 +1,236 @@
+"""
+In-process metrics in the Prometheus text format, served by GET /metrics in app.py.
+
+Histograms time the hot paths (hybrid recommendation stages, model loads, question
+generation backends); callback metrics read counters the caches already keep when
+/metrics is scraped, so the hot paths pay nothing extra for them.
+
+Metrics live in the memory of one process: with several workers every worker reports its
+own values, labelled with its pid (worker="..."), and Prometheus sums them with
+sum without (worker). Work done in the T5 job process (question_generator/jobs.py) is not
+included.
+
+Also provides RateLimitFilter, which keeps per-request log lines from flooding the log
+(and from costing real time) at high request rates.
+"""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+LOG_RATE_LIMIT_SECONDS = float(os.getenv("LOG_RATE_LIMIT_SECONDS", 10)) # Repeats of one log message are dropped for this long
+
+_metrics = [] # Every metric created in this process, in registration order
+_metrics_lock = threading.Lock()
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label_value(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    def __init__(self, name, documentation, labelnames, metric_type):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.metric_type = metric_type
+        self._lock = threading.Lock()
+        with _metrics_lock:
+            _metrics.append(self)
+
+    def _label_values(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(suffix, [(label, value), ...], value), ...] for the exposition."""
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """A monotonically increasing count, optionally split by labels."""
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames, "counter")
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        return [("_total", list(zip(self.labelnames, key)), value) for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    """
+    Cumulative-bucket histogram of observed values (seconds, for the latency metrics).
+
+    Args:
+        buckets (tuple): Upper bounds of the buckets, ascending; +Inf is added implicitly.
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames, "histogram")
+        self.buckets = tuple(buckets)
+        self._values = {} # label values -> [per-bucket counts (+Inf last), sum, count]
+
+    def observe(self, value, **labels):
+        key = self._label_values(labels)
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bucket] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall time of the `with` block."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: ([*counts], total, count) for key, (counts, total, count) in self._values.items()}
+        samples = []
+        for key, (counts, total, count) in values.items():
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                samples.append(("_bucket", labels + [("le", _format_value(float(bound)))], cumulative))
+            samples.append(("_sum", labels, total))
+            samples.append(("_count", labels, count))
+        return samples
+
+
+class CallbackMetric(_Metric):
+    """
+    A counter or gauge whose values are read from `callback` at scrape time, for statistics
+    another component already keeps (e.g. the cache stats() dicts).
+
+    Args:
+        callback: Returns {label values tuple: value}; () is the key without labels.
+        metric_type (str): "counter" or "gauge".
+    """
+
+    def __init__(self, name, documentation, callback, labelnames=(), metric_type="gauge"):
+        super().__init__(name, documentation, labelnames, metric_type)
+        self.callback = callback
+
+    def samples(self):
+        suffix = "_total" if self.metric_type == "counter" else ""
+        return [(suffix, list(zip(self.labelnames, key)), value)
+                for key, value in self.callback().items() if value is not None]
+
+
+def render_metrics():
+    """All metrics of this process in the Prometheus text exposition format (version 0.0.4)."""
+    worker = [("worker", str(os.getpid()))]
+    lines = []
+    with _metrics_lock:
+        metrics = list(_metrics)
+    for metric in metrics:
+        try:
+            samples = metric.samples()
+        except Exception as e: # A failing callback must not break the whole scrape
+            logging.getLogger(__name__).warning(f"⚠️ Could not collect metric {metric.name}: {e}")
+            continue
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.metric_type}")
+        for suffix, labels, value in samples:
+            lines.append(f"{metric.name}{suffix}{_format_labels(worker + labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets each distinct log message through at most once per `interval_seconds`; the next one
+    that passes reports how many were dropped in between. Messages are told apart by their
+    logger, level and unformatted template, so log with %-style arguments
+    (logger.warning("User %s not found", user_id)) to group per-user lines together.
+    """
+
+    def __init__(self, interval_seconds=LOG_RATE_LIMIT_SECONDS):
+        super().__init__()
+        self.interval_seconds = interval_seconds
+        self._lock = threading.Lock()
+        self._last = {} # (logger, level, template) -> (last emitted at, suppressed since)
+
+    def filter(self, record):
+        if self.interval_seconds <= 0:
+            return True
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            last_emitted, suppressed = self._last.get(key, (None, 0))
+            if last_emitted is not None and now - last_emitted < self.interval_seconds:
+                self._last[key] = (last_emitted, suppressed + 1)
+                return False
+            self._last[key] = (now, 0)
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+def rate_limited_logger(name):
+    """logging.getLogger(name) with a RateLimitFilter attached (once)."""
+    logger = logging.getLogger(name)
+    if not any(isinstance(f, RateLimitFilter) for f in logger.filters):
+        logger.addFilter(RateLimitFilter())
+    return logger
+
+
+# --- Service metrics ---
+
+HYBRID_STAGE_SECONDS = Histogram(
+    "ml_hybrid_stage_seconds",
+    "Time per stage of hybrid recommendation scoring (per chunk of users for batch requests).",
+    ["stage"])
+RECOMMENDATION_REQUEST_SECONDS = Histogram(
+    "ml_recommendation_request_seconds",
+    "Recommendation requests by endpoint and result cache outcome.",
+    ["endpoint", "cache"])
+MODEL_LOAD_SECONDS = Histogram(
+    "ml_model_load_seconds",
+    "Time to load a recommendation model version.",
+    buckets=SLOW_LATENCY_BUCKETS)
+QUESTION_GENERATION_SECONDS = Histogram(
+    "ml_question_generation_seconds",
+    "Question generation by backend and outcome (cache hits are not backend calls).",
+    ["backend", "outcome"],
+    buckets=SLOW_LATENCY_BUCKETS)
+QUESTION_STREAM_FIRST_QUESTION_SECONDS = Histogram(
+    "ml_question_stream_first_question_seconds",
+    "Time from the start of a question stream to its first question.",
+    buckets=SLOW_LATENCY_BUCKETS)
+GEMINI_RETRIES = Counter(
+    "ml_gemini_retries",
+    "Gemini requests retried, by HTTP status ('connection' for network errors and timeouts).",
+    ["status"])
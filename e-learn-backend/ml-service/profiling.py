@@ -0,0 +1,216 @@
+"""
+On-demand profiling of a live worker, behind the admin endpoints in app.py.
+
+Two tools:
+
+* sample_stacks: a sampling profiler. The calling (admin request) thread reads the Python
+  stack of every other thread (sys._current_frames) `hz` times per second for a few
+  seconds. The sampled threads are never paused or traced, so the cost is one stack walk
+  per thread per sample and it is safe on production traffic; the measured share of time
+  spent sampling is part of the result. The stacks come back in the collapsed format of
+  flamegraph.pl / speedscope, plus a per-function summary. The worker must serve requests
+  on several threads (the Flask server does, as do gthread workers) or there is nothing
+  to sample while the admin request waits.
+* RequestProfiles: a deterministic cProfile of one flagged request. Profiles are written
+  as pstats files to PROFILE_DIR, so any worker on the host can serve them afterwards.
+
+Both are disabled unless ML_PROFILING_ENABLED=true.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+ML_SERVICE_DIR = os.path.dirname(os.path.abspath(__file__))
+ML_PROFILING_ENABLED = os.getenv("ML_PROFILING_ENABLED", "false").lower() == "true"
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", 60)) # Longest sampling session
+PROFILER_MAX_HZ = int(os.getenv("PROFILER_MAX_HZ", 1000))
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "ml-service-profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50)) # Request profiles kept on disk, oldest are deleted
+# A stack containing this Flask frame is a thread serving a request
+REQUEST_FRAME = "full_dispatch_request"
+
+_sampling_lock = threading.Lock() # One sampling session per process at a time
+_frame_labels = {} # code object -> "function (file:line)", shared by all sessions
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _short_path(path):
+    if path.startswith(ML_SERVICE_DIR + os.sep):
+        return os.path.relpath(path, ML_SERVICE_DIR)
+    parts = path.replace("\\", "/").split("/")
+    return "/".join(parts[-2:]) # e.g. flask/app.py, site-packages are not interesting beyond that
+
+
+def _frame_label(code):
+    label = _frame_labels.get(code)
+    if label is None:
+        # ';' separates frames in the collapsed format
+        label = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+        _frame_labels[code] = label
+    return label
+
+
+def _stack_codes(frame):
+    """Code objects of a thread's stack, outermost first."""
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+    return tuple(codes)
+
+
+def sample_stacks(seconds, hz=100, threads="requests", limit=30):
+    """
+    Samples the stacks of this process's threads for `seconds` at `hz` samples per second.
+
+    Args:
+        threads (str): "requests" keeps only threads serving a request (the latency that
+            users see), "all" keeps every thread (model watcher, batchers, idle pools).
+        limit (int): Functions listed in the summary.
+
+    Returns:
+        dict: 'collapsed' ("frame;frame;frame count" lines, outermost frame first), 'functions'
+        (self/total samples per function, busiest first) and sampling statistics.
+
+    Raises:
+        ProfilerBusy: Another session is already running in this process.
+    """
+    if not _sampling_lock.acquire(blocking=False):
+        raise ProfilerBusy("A profiling session is already running in this worker")
+    try:
+        seconds = min(max(float(seconds), 0.1), PROFILER_MAX_SECONDS)
+        hz = min(max(int(hz), 1), PROFILER_MAX_HZ)
+        interval = 1.0 / hz
+        own_thread = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        sampler_seconds = 0.0
+        started = time.perf_counter()
+        next_sample = started
+        while True:
+            now = time.perf_counter()
+            if now - started >= seconds:
+                break
+            if now < next_sample:
+                time.sleep(next_sample - now)
+            sample_started = time.perf_counter()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                codes = _stack_codes(frame)
+                if threads == "requests" and not any(code.co_name == REQUEST_FRAME for code in codes):
+                    continue
+                stacks[codes] += 1
+            samples += 1
+            sampler_seconds += time.perf_counter() - sample_started
+            next_sample += interval
+            if next_sample < time.perf_counter(): # Fell behind (e.g. a long GIL hold), do not burst to catch up
+                next_sample = time.perf_counter()
+        elapsed = time.perf_counter() - started
+    finally:
+        _sampling_lock.release()
+
+    self_counts, total_counts = Counter(), Counter()
+    for codes, count in stacks.items():
+        self_counts[codes[-1]] += count
+        for code in set(codes):
+            total_counts[code] += count
+    stack_samples = sum(stacks.values())
+    functions = [{
+        "function": _frame_label(code),
+        "self_samples": self_counts[code],
+        "total_samples": total,
+        "self_pct": round(100 * self_counts[code] / stack_samples, 2),
+        "total_pct": round(100 * total / stack_samples, 2),
+    } for code, total in sorted(total_counts.items(), key=lambda item: (-self_counts[item[0]], -item[1]))[:limit]]
+
+    return {
+        "seconds": round(elapsed, 3),
+        "hz": hz,
+        "threads": threads,
+        "samples": samples,
+        "stack_samples": stack_samples,
+        "sampler_overhead_pct": round(100 * sampler_seconds / elapsed, 3) if elapsed else None,
+        "worker": os.getpid(),
+        "collapsed": "\n".join(f"{';'.join(_frame_label(code) for code in codes)} {count}"
+                               for codes, count in stacks.most_common()),
+        "functions": functions,
+    }
+
+
+class RequestProfiles:
+    """
+    cProfile of single requests, stored as pstats files in `profile_dir`.
+
+    One request per process is profiled at a time; start() returns None while another one
+    is running, and that request is served unprofiled.
+    """
+
+    def __init__(self, profile_dir, keep):
+        self.profile_dir = profile_dir
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def start(self):
+        if not self._lock.acquire(blocking=False):
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except Exception: # e.g. another profiling tool is active
+            self._lock.release()
+            return None
+        return profiler
+
+    def finish(self, profiler):
+        """Stops `profiler`, writes its stats and returns the profile ID."""
+        try:
+            profiler.disable()
+        finally:
+            self._lock.release()
+        profile_id = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        os.makedirs(self.profile_dir, exist_ok=True)
+        profiler.dump_stats(self._path(profile_id))
+        self._prune()
+        return profile_id
+
+    def _path(self, profile_id):
+        return os.path.join(self.profile_dir, f"{profile_id}.pstats")
+
+    def _prune(self):
+        files = sorted(f for f in os.listdir(self.profile_dir) if f.endswith(".pstats"))
+        for name in files[:max(0, len(files) - self.keep)]:
+            try:
+                os.remove(os.path.join(self.profile_dir, name))
+            except OSError:
+                pass # Another worker pruned it first
+
+    def path(self, profile_id):
+        """Path of a stored profile, or None if it does not exist (or the ID is malformed)."""
+        if not profile_id.replace("-", "").isalnum():
+            return None
+        path = self._path(profile_id)
+        return path if os.path.exists(path) else None
+
+    def report(self, profile_id, sort="cumulative", limit=40):
+        """pstats text report of a stored profile, or None if it does not exist."""
+        path = self.path(profile_id)
+        if path is None:
+            return None
+        output = io.StringIO()
+        pstats.Stats(path, stream=output).strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+
+request_profiles = RequestProfiles(PROFILE_DIR, PROFILE_KEEP)
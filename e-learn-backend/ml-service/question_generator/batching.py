@@ -0,0 +1,86 @@
+"""
+Micro-batching for model inference.
+
+Concurrent callers submit single inputs; one scheduler thread collects them for at most
+`max_wait_ms` (or until `max_batch_size` inputs are waiting), runs the batch function once
+and hands every caller its own output. On CPU one forward pass over a batch is much cheaper
+than the same number of passes over single inputs, and callers no longer serialize on the
+model.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class MicroBatcher:
+    """
+    Args:
+        process_batch (callable): process_batch(list of inputs) -> list of outputs, same order.
+        max_batch_size (int): Upper bound on inputs per call of process_batch.
+        max_wait_ms (float): How long the first input of a batch may wait for company.
+        name (str): Name of the scheduler thread.
+    """
+
+    def __init__(self, process_batch, max_batch_size=8, max_wait_ms=20, name="micro-batcher"):
+        self._process_batch = process_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_seconds = max(0.0, max_wait_ms / 1000)
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "items": 0, "max_batch_size_seen": 0, "errors": 0}
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queues one input and returns a Future resolving to its output."""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        """Blocking form of submit()."""
+        return self.submit(item).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()] # Sleep until there is work
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # A caller that gave up (cancelled future) does not need to be computed
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                outputs = self._process_batch([item for item, _ in batch])
+                if len(outputs) != len(batch):
+                    raise RuntimeError(f"Batch function returned {len(outputs)} outputs for {len(batch)} inputs")
+            except Exception as e: # Every caller of the batch sees the error, the scheduler keeps running
+                print(f"❌ Batch inference failed: {e}")
+                with self._stats_lock:
+                    self._stats["errors"] += 1
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+            with self._stats_lock:
+                self._stats["batches"] += 1
+                self._stats["items"] += len(batch)
+                self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], len(batch))
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["mean_batch_size"] = round(stats["items"] / stats["batches"], 2) if stats["batches"] else None
+        stats["queued"] = self._queue.qsize()
+        return stats
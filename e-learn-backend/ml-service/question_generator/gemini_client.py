@@ -0,0 +1,231 @@
+"""
+Shared HTTP client for the Gemini generateContent API.
+
+One keep-alive requests.Session per process (recreated after a fork) pools TCP+TLS
+connections across calls. Every request has connect/read timeouts, at most
+GEMINI_MAX_CONCURRENCY calls run at once per process, and transient failures
+(connection errors, timeouts, 429 and 5xx) are retried with jittered exponential backoff.
+
+GEMINI_API_BASE points the client at another server, e.g. the local stub in
+gemini_stub.py.
+"""
+import asyncio
+import functools
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import GEMINI_RETRIES, rate_limited_logger
+
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com").rstrip("/")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", 5)) # seconds
+GEMINI_READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", 60)) # seconds, LLM responses take a while
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 3)) # retries after the first attempt
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", 0.5)) # seconds, doubled per retry
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", 8))
+# Concurrent Gemini calls per process; callers wait up to GEMINI_QUEUE_TIMEOUT seconds for a slot
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 8))
+GEMINI_QUEUE_TIMEOUT = float(os.getenv("GEMINI_QUEUE_TIMEOUT", 30))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+logger = rate_limited_logger(__name__)
+
+_session = None
+_session_pid = None
+_concurrency = None
+_executor = None
+_client_lock = threading.Lock()
+
+
+class GeminiError(Exception):
+    """A Gemini call that failed for good (after retries, or with a non-retryable status)."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _ensure_client():
+    """Creates the session, concurrency limit and async executor once per process."""
+    global _session, _session_pid, _concurrency, _executor
+    if _session is not None and _session_pid == os.getpid():
+        return
+    with _client_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=GEMINI_MAX_CONCURRENCY)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Content-Type": "application/json"})
+            _concurrency = threading.BoundedSemaphore(GEMINI_MAX_CONCURRENCY)
+            _executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_CONCURRENCY, thread_name_prefix="gemini")
+            _session = session
+            _session_pid = os.getpid()
+
+
+def get_session():
+    """The pooled keep-alive session of this process."""
+    _ensure_client()
+    return _session
+
+
+def model_url(model=None, method="generateContent"):
+    return f"{GEMINI_API_BASE}/v1beta/models/{model or GEMINI_MODEL}:{method}"
+
+
+def _backoff_seconds(retry, retry_after=None):
+    """Full-jitter exponential backoff; a Retry-After header (in seconds) is a lower bound."""
+    delay = random.uniform(0, min(GEMINI_BACKOFF_MAX, GEMINI_BACKOFF_BASE * 2 ** retry))
+    try:
+        return min(GEMINI_BACKOFF_MAX, max(delay, float(retry_after))) if retry_after else delay
+    except ValueError: # HTTP-date form, not worth parsing
+        return delay
+
+
+def _slot_release():
+    """A callable that frees one concurrency slot the first time it is called."""
+    released = threading.Event()
+
+    def release():
+        if not released.is_set():
+            released.set()
+            _concurrency.release()
+    return release
+
+
+def _post(session, url, api_key, payload, timeout, stream=False):
+    """
+    One attempt, inside the per-process concurrency limit.
+
+    Returns:
+        (response, release): A successful streamed response keeps its slot until release()
+        is called, since its body is still to be read; otherwise the slot is already free.
+    """
+    if not _concurrency.acquire(timeout=GEMINI_QUEUE_TIMEOUT):
+        raise GeminiError(f"No Gemini slot free within {GEMINI_QUEUE_TIMEOUT:g}s ({GEMINI_MAX_CONCURRENCY} calls in flight)")
+    release = _slot_release()
+    try:
+        # The key goes in a header so it never shows up in URLs or access logs
+        response = session.post(url, headers={"x-goog-api-key": api_key}, json=payload, timeout=timeout, stream=stream)
+    except BaseException:
+        release()
+        raise
+    if not (stream and response.ok):
+        release()
+    return response, release
+
+
+def post_with_retries(url, api_key, payload, timeout=None, stream=False):
+    """
+    POSTs `payload` to a Gemini endpoint, retrying transient failures. With `stream`, only
+    the request and response headers are retried; the body is left to the caller.
+
+    Returns:
+        The successful requests.Response. With `stream`, (response, release): the call keeps
+        its concurrency slot while the body is read, the caller must call release() when done.
+
+    Raises:
+        GeminiError: Non-retryable status, or still failing after GEMINI_MAX_RETRIES retries.
+    """
+    session = get_session()
+    timeout = timeout or (GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT)
+    for attempt in range(GEMINI_MAX_RETRIES + 1):
+        retry_after = None
+        try:
+            response, release = _post(session, url, api_key, payload, timeout, stream)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = GeminiError(f"Gemini request failed: {e}")
+            error.__cause__ = e
+        else:
+            if response.ok:
+                return (response, release) if stream else response
+            error = GeminiError(f"Gemini returned HTTP {response.status_code}: {response.text[:200]}", response.status_code)
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            if response.status_code not in RETRY_STATUS_CODES:
+                raise error
+        if attempt == GEMINI_MAX_RETRIES:
+            raise error
+        delay = _backoff_seconds(attempt, retry_after)
+        GEMINI_RETRIES.inc(status=error.status_code or "connection")
+        logger.warning("⚠️ %s Retrying in %.2fs (%d/%d).", error, delay, attempt + 1, GEMINI_MAX_RETRIES)
+        time.sleep(delay)
+
+
+def generate_content(prompt, api_key=None, model=None, timeout=None):
+    """
+    Calls generateContent with a single text prompt.
+
+    Args:
+        prompt (str): The prompt text.
+        api_key (str, optional): Defaults to the GEMINI_API_KEY environment variable.
+        model (str, optional): Defaults to GEMINI_MODEL.
+        timeout (float or (connect, read) tuple, optional): Defaults to the GEMINI_*_TIMEOUT settings.
+
+    Returns:
+        dict: The decoded generateContent response.
+    """
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    response = post_with_retries(model_url(model), api_key or os.getenv("GEMINI_API_KEY"), payload, timeout)
+    try:
+        return response.json()
+    except ValueError as e:
+        raise GeminiError(f"Gemini returned invalid JSON: {e}") from e
+
+
+async def generate_content_async(prompt, api_key=None, model=None, timeout=None):
+    """
+    Awaitable generate_content for async routes. The blocking call runs on this process's
+    Gemini executor (sized to the concurrency limit), so the event loop is never blocked and
+    the pooled connections are shared with the synchronous path.
+    """
+    _ensure_client()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(generate_content, prompt, api_key, model, timeout))
+
+
+def stream_generate_content(prompt, api_key=None, model=None, timeout=None):
+    """
+    Calls streamGenerateContent (server-sent events) and yields the text of every chunk as
+    soon as it arrives. The read timeout applies to the gap between chunks. Closing the
+    generator closes the connection, which stops the generation upstream. The call holds one
+    of the GEMINI_MAX_CONCURRENCY slots until then.
+    """
+    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    url = model_url(model, "streamGenerateContent") + "?alt=sse"
+    response, release = post_with_retries(url, api_key or os.getenv("GEMINI_API_KEY"), payload, timeout, stream=True)
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            try:
+                chunk = json.loads(line[len("data:"):])
+            except ValueError as e:
+                raise GeminiError(f"Gemini stream sent invalid JSON: {e}") from e
+            # Not response_text(): whitespace at chunk edges belongs to the text
+            candidates = chunk.get("candidates") or [{}]
+            text = "".join(part.get("text", "") for part in candidates[0].get("content", {}).get("parts", []))
+            if text:
+                yield text
+    except (requests.ConnectionError, requests.Timeout) as e:
+        raise GeminiError(f"Gemini stream interrupted: {e}") from e
+    finally:
+        response.close()
+        release()
+
+
+def response_text(response_json):
+    """Concatenated text parts of the first candidate ('' when there is none)."""
+    candidates = response_json.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get("content", {}).get("parts", [])
+    return " ".join(part.get("text", "") for part in parts).strip()
@@ -0,0 +1,141 @@
+"""
+Local stand-in for the Gemini generateContent API, for exercising gemini_client without
+network access or quota.
+
+It answers POST /v1beta/models/<model>:generateContent with the same response shape as
+Gemini: a fenced JSON array of questions about the prompt. :streamGenerateContent?alt=sse
+sends the same text as server-sent events of --chunk-chars characters, --chunk-delay apart.
+It can add latency and fail some requests with 503 to exercise timeouts and retries. It also
+counts requests and TCP connections, so connection reuse is visible.
+
+    python -m question_generator.gemini_stub --port 8089 --delay 0.2 --fail-first 2
+    GEMINI_API_BASE=http://127.0.0.1:8089 GEMINI_API_KEY=stub python app.py
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    """Behaviour and counters shared by all handler threads of one stub server."""
+
+    def __init__(self, delay=0.0, fail_first=0, fail_status=503, n_questions=12, chunk_chars=40, chunk_delay=0.0):
+        self.delay = delay
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.n_questions = n_questions
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = chunk_delay
+        self.requests = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+
+def stub_questions(prompt, n_questions):
+    topic = prompt.split(" on ", 1)[-1].split(",", 1)[0][:60] if " on " in prompt else "the topic"
+    return [f"Question {i + 1} about {topic} in English" for i in range(n_questions)]
+
+
+class StubGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the real API
+
+    def setup(self):
+        super().setup()
+        with self.server.state.lock:
+            self.server.state.connections += 1
+
+    def log_message(self, format, *args): # Keep test output readable
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_stream(self, text):
+        """Server-sent events, one generateContent-shaped chunk per event (chunked encoding)."""
+        state = self.server.state
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for start in range(0, len(text), state.chunk_chars):
+                chunk = {"candidates": [{"content": {"parts": [{"text": text[start:start + state.chunk_chars]}], "role": "model"}, "index": 0}]}
+                event = f"data: {json.dumps(chunk)}\r\n\r\n".encode("utf-8")
+                self.wfile.write(f"{len(event):X}\r\n".encode("ascii") + event + b"\r\n")
+                self.wfile.flush()
+                time.sleep(state.chunk_delay)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError): # The client stopped reading early
+            self.close_connection = True
+
+    def do_POST(self):
+        state = self.server.state
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with state.lock:
+            state.requests += 1
+            request_number = state.requests
+
+        streaming = ":streamGenerateContent" in self.path
+        if not self.path.startswith("/v1beta/models/") or not (streaming or ":generateContent" in self.path):
+            return self._send_json(404, {"error": {"code": 404, "message": f"Unknown path {self.path}"}})
+        if not self.headers.get("x-goog-api-key"):
+            return self._send_json(403, {"error": {"code": 403, "message": "API key missing"}})
+        if request_number <= state.fail_first:
+            return self._send_json(state.fail_status, {"error": {"code": state.fail_status, "message": "Stub failure"}})
+
+        time.sleep(state.delay)
+        prompt = body.get("contents", [{}])[0].get("parts", [{}])[0].get("text", "")
+        text = "```json\n" + json.dumps(stub_questions(prompt, state.n_questions)) + "\n```"
+        if streaming:
+            return self._send_stream(text)
+        self._send_json(200, {
+            "candidates": [{"content": {"parts": [{"text": text}], "role": "model"}, "finishReason": "STOP", "index": 0}],
+            "modelVersion": "stub",
+        })
+
+
+def start_stub_server(port=0, **options):
+    """
+    Starts the stub on a background thread.
+
+    Returns:
+        (server, base_url): server.state holds the counters; call server.shutdown() to stop.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubGeminiHandler)
+    server.daemon_threads = True
+    server.state = StubState(**options)
+    threading.Thread(target=server.serve_forever, name="gemini-stub", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Gemini generateContent stub.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--delay", type=float, default=0.0, help="Seconds before each successful response")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N requests with --fail-status")
+    parser.add_argument("--fail-status", type=int, default=503)
+    parser.add_argument("--questions", type=int, default=12)
+    parser.add_argument("--chunk-chars", type=int, default=40, help="Characters per streamed chunk")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="Seconds between streamed chunks")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.port, delay=args.delay, fail_first=args.fail_first,
+                                         fail_status=args.fail_status, n_questions=args.questions,
+                                         chunk_chars=args.chunk_chars, chunk_delay=args.chunk_delay)
+    print(f"🧪 Gemini stub listening on {base_url} (set GEMINI_API_BASE={base_url})")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,119 @@
-from transformers import T5ForConditionalGeneration, T5Tokenizer
-import torch
-import requests
 from dotenv import load_dotenv
 import os
+import threading
+import time
+
+from .batching import MicroBatcher
+from .t5_backends import load_t5_backend
+from .gemini_client import (GEMINI_MODEL, GeminiError, generate_content, generate_content_async, response_text,
+                            stream_generate_content)
+from .streaming import QuestionStreamParser
+from .question_cache import question_cache, question_cache_key
+from metrics import QUESTION_GENERATION_SECONDS, rate_limited_logger
 
 load_dotenv()
+logger = rate_limited_logger(__name__) # Per-request messages; model loading keeps printing
 # ---------- T5 Model Setup ----------
-print("🚀 Loading T5 model...")
-tokenizer = T5Tokenizer.from_pretrained("valhalla/t5-base-qg-hl")
-model = T5ForConditionalGeneration.from_pretrained("valhalla/t5-base-qg-hl")
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model = model.to(device)
-print("✅ T5 model loaded")
+# torch/transformers and the T5 weights are only loaded on the first T5 request: the service
+# routes use Gemini, so most workers never need them. Set QG_PRELOAD_T5=true to load at startup.
+T5_MODEL_NAME = os.getenv("T5_MODEL_NAME", "valhalla/t5-base-qg-hl")
+QG_PRELOAD_T5 = os.getenv("QG_PRELOAD_T5", "false").lower() == "true"
+# "torch" (full precision) or "int8" (dynamically quantized, CPU), see t5_backends.py
+QG_T5_BACKEND = os.getenv("QG_T5_BACKEND", "torch")
+# Intra-op threads for T5 inference (0 keeps torch's default of one per core)
+QG_TORCH_THREADS = int(os.getenv("QG_TORCH_THREADS", 0))
+# Concurrent T5 requests are merged into one generate call (QG_BATCH_MAX_SIZE=1 disables batching)
+QG_BATCH_MAX_SIZE = int(os.getenv("QG_BATCH_MAX_SIZE", 8))
+QG_BATCH_MAX_WAIT_MS = float(os.getenv("QG_BATCH_MAX_WAIT_MS", 20))
+T5_MAX_INPUT_TOKENS = 512
+T5_MAX_OUTPUT_TOKENS = 64
+T5_QUESTIONS_PER_CONTEXT = 5
+# Bump when the T5 input format or generation settings change, so cached question sets are not reused
+T5_PROMPT_VERSION = 1
+
+tokenizer = None
+model = None
+device = None
+_t5_lock = threading.Lock()
+_t5_batcher = None
+
+
+def load_t5_model():
+    """Loads the T5 tokenizer and model once per process and returns (tokenizer, model, device)."""
+    global tokenizer, model, device
+    if model is not None:
+        return tokenizer, model, device
+    with _t5_lock:
+        if model is None:
+            import torch
+
+            print(f"🚀 Loading T5 model ({QG_T5_BACKEND} backend)...")
+            if QG_TORCH_THREADS > 0:
+                torch.set_num_threads(QG_TORCH_THREADS)
+            t5_tokenizer, t5_model, t5_device = load_t5_backend(QG_T5_BACKEND, T5_MODEL_NAME)
+            tokenizer, device = t5_tokenizer, t5_device
+            model = t5_model # Published last, other threads only skip the lock once everything is set
+            print("✅ T5 model loaded")
+    return tokenizer, model, device
+
 
 # ---------- T5-Based Question Generation ----------
-def generate_questions_t5(context):
-    print("📘 Generating questions using T5 for content:", context)
+def generate_questions_t5_batch(contexts):
+    """
+    Raw T5 questions for several contexts in one generate call.
 
-    input_text = "generate questions: " + context
-    encoding = tokenizer.encode_plus(
-        input_text,
+    Inputs are padded to the longest context of the batch (not to the 512-token limit) and
+    generation runs under inference mode, so no autograd state is kept.
+
+    Args:
+        contexts (list[str]): Course content, one entry per request.
+
+    Returns:
+        list[list[str]]: T5_QUESTIONS_PER_CONTEXT questions per context, in input order.
+    """
+    import torch
+
+    tokenizer, model, device = load_t5_model()
+    encoding = tokenizer(
+        ["generate questions: " + context for context in contexts],
         return_tensors="pt",
-        padding="max_length",
+        padding="longest",
         truncation=True,
-        max_length=512
+        max_length=T5_MAX_INPUT_TOKENS
     ).to(device)
 
-    output = model.generate(
-        input_ids=encoding['input_ids'],
-        attention_mask=encoding['attention_mask'],
-        max_length=64,
-        num_return_sequences=5,
-        do_sample=True,
-        top_k=50,
-        top_p=0.95
-    )
+    with torch.inference_mode():
+        output = model.generate(
+            input_ids=encoding['input_ids'],
+            attention_mask=encoding['attention_mask'],
+            max_length=T5_MAX_OUTPUT_TOKENS,
+            num_return_sequences=T5_QUESTIONS_PER_CONTEXT,
+            do_sample=True,
+            top_k=50,
+            top_p=0.95
+        )
+
+    # generate() returns the sequences of each input next to each other
+    decoded = tokenizer.batch_decode(output, skip_special_tokens=True)
+    return [decoded[i * T5_QUESTIONS_PER_CONTEXT:(i + 1) * T5_QUESTIONS_PER_CONTEXT] for i in range(len(contexts))]
+
+
+def get_t5_batcher():
+    """The process-wide micro-batcher for T5 requests, started on first use (after any fork)."""
+    global _t5_batcher
+    with _t5_lock:
+        if _t5_batcher is None:
+            _t5_batcher = MicroBatcher(generate_questions_t5_batch, QG_BATCH_MAX_SIZE, QG_BATCH_MAX_WAIT_MS, name="t5-batcher")
+    return _t5_batcher
+
 
-    questions = [tokenizer.decode(q, skip_special_tokens=True) for q in output]
-    print("🎯 T5 Raw questions:", questions)
+def generate_questions_t5(context):
+    logger.debug("📘 Generating questions using T5 for %d characters of content.", len(context))
+    if QG_BATCH_MAX_SIZE > 1:
+        questions = get_t5_batcher()(context)
+    else:
+        questions = generate_questions_t5_batch([context])[0]
+    logger.debug("🎯 T5 raw questions: %s", questions)
 
     # Simple MCQ option generation (placeholder logic)
     def create_options(question):
@@ -59,70 +135,158 @@ def generate_questions_t5(context):
     return result
 
 # ---------- Gemini-Based Question Generation ----------
-def generate_questions_gemini(query: str):
-    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-    if not GEMINI_API_KEY:
-        print("❌ GEMINI_API_KEY environment variable not set")
-        return []
+# Bump whenever the prompt or _format_gemini_questions changes, so cached question sets are not reused
+GEMINI_PROMPT_VERSION = 2
+GEMINI_MAX_QUESTIONS = 10 # Limit for display
 
-    print("🌐 Calling Gemini API for question generation...")
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={GEMINI_API_KEY}"
-    headers = { "Content-Type": "application/json" }
 
-    prompt = f"""Please generate a comprehensive step-by-step learning guide on {query}, formatted as an array of questions. 
+def gemini_question_prompt(query):
+    return f"""Please generate a comprehensive step-by-step learning guide on {query}, formatted as an array of questions. 
 Each question should be clear, relevant, and designed to build understanding progressively. 
 The array should include approximately 50 questions. 
 Each question must end with 'in English'. 
 Format the response as a JSON array like: ["Question 1 in English", "Question 2 in English", ...]"""
 
-    data = {
-        "contents": [
-            {
-                "parts": [{"text": prompt}]
-            }
-        ]
-    }
 
-    try:
-        response = requests.post(url, headers=headers, json=data)
-        response.raise_for_status()
-        res_json = response.json()
-        candidates = res_json.get("candidates", [])
-        if not candidates:
-            print("⚠️ No candidates returned from Gemini")
-            return []
+def _format_gemini_question(i, q):
+    return {
+        "type": "mcq" if i % 2 == 0 else "descriptive",
+        "question": q.replace("in English", "").strip(),
+        "options": [q, "Option B", "Option C", "Option D"] if i % 2 == 0 else [],
+        "answer": q if i % 2 == 0 else None
+    }
 
-        parts = candidates[0].get("content", {}).get("parts", [])
-        raw_text = " ".join(part.get("text", "") for part in parts).strip()
 
-        # Clean and extract JSON-like array
+def _format_gemini_questions(raw_text):
+    # The array items are parsed as JSON strings, so questions containing commas stay whole
+    questions = [q.strip() for q in QuestionStreamParser().feed(raw_text) if q.strip()]
+    if not questions:
+        # Not a JSON array of strings, fall back to splitting the text on commas
         raw_text = raw_text.replace("```json", "").replace("```", "").strip()
         raw_text = raw_text.strip("[]")
         questions = [q.strip().strip('"') for q in raw_text.split(",") if q.strip()]
 
-        print(f"✅ Gemini generated {len(questions)} questions.")
-        formatted = []
-        for i, q in enumerate(questions[:10]):  # Limit to 10 for display
-            formatted.append({
-                "type": "mcq" if i % 2 == 0 else "descriptive",
-                "question": q.replace("in English", "").strip(),
-                "options": [q, "Option B", "Option C", "Option D"] if i % 2 == 0 else [],
-                "answer": q if i % 2 == 0 else None
-            })
-        return formatted
+    logger.info("✅ Gemini generated %d questions.", len(questions))
+    return [_format_gemini_question(i, q) for i, q in enumerate(questions[:GEMINI_MAX_QUESTIONS])]
+
+
+def generate_questions_gemini(query: str):
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    if not GEMINI_API_KEY:
+        logger.error("❌ GEMINI_API_KEY environment variable not set")
+        return []
+
+    logger.debug("🌐 Calling Gemini API for question generation...")
+    try:
+        raw_text = response_text(generate_content(gemini_question_prompt(query), GEMINI_API_KEY))
+        if not raw_text:
+            logger.warning("⚠️ No candidates returned from Gemini")
+            return []
+        return _format_gemini_questions(raw_text)
+    except Exception as e:
+        logger.error("❌ Error in Gemini API: %s", e)
+        return []
+
+
+async def generate_questions_gemini_async(query: str):
+    """Awaitable generate_questions_gemini for async routes (same pooled client and limits)."""
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    if not GEMINI_API_KEY:
+        logger.error("❌ GEMINI_API_KEY environment variable not set")
+        return []
+
+    logger.debug("🌐 Calling Gemini API for question generation...")
+    try:
+        raw_text = response_text(await generate_content_async(gemini_question_prompt(query), GEMINI_API_KEY))
+        if not raw_text:
+            logger.warning("⚠️ No candidates returned from Gemini")
+            return []
+        return _format_gemini_questions(raw_text)
     except Exception as e:
-        print("❌ Error in Gemini API:", e)
+        logger.error("❌ Error in Gemini API: %s", e)
         return []
 
+def stream_questions_gemini(query: str, force_refresh=False):
+    """
+    Yields formatted Gemini questions one at a time, each as soon as the streamed response
+    contains it completely. A cached question set is replayed instead of calling Gemini
+    (unless `force_refresh`), and a completed stream is cached like generate_questions does.
+    Errors are raised to the caller, which has already sent part of its response.
+    """
+    key = generation_key(query, use_gemini=True)
+    if not force_refresh:
+        cached = question_cache.get(key)
+        if cached is not None:
+            logger.debug("⚡ Streaming %d cached questions.", len(cached))
+            yield from cached
+            return
+
+    GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+    if not GEMINI_API_KEY:
+        raise GeminiError("GEMINI_API_KEY environment variable not set")
+
+    logger.debug("🌐 Streaming questions from Gemini...")
+    parser = QuestionStreamParser()
+    questions = []
+    raw_text = []
+    chunks = stream_generate_content(gemini_question_prompt(query), GEMINI_API_KEY)
+    try:
+        for text in chunks:
+            raw_text.append(text)
+            for q in parser.feed(text):
+                if not q.strip():
+                    continue
+                question = _format_gemini_question(len(questions), q.strip())
+                questions.append(question)
+                yield dict(question) # The caller may edit it, the cached copy must not change
+                if len(questions) >= GEMINI_MAX_QUESTIONS:
+                    break
+            if len(questions) >= GEMINI_MAX_QUESTIONS:
+                break
+    finally:
+        chunks.close() # Stopping early also stops the generation we would discard anyway
+
+    if not questions and raw_text:
+        # Not a JSON array of strings, nothing could be streamed: parse the whole text instead
+        questions = _format_gemini_questions("".join(raw_text))
+        yield from (dict(question) for question in questions)
+    logger.info("✅ Gemini streamed %d questions.", len(questions))
+    if questions: # Only reached when the stream was consumed without errors
+        question_cache.put(key, questions)
+
+
 # ---------- Unified Wrapper ----------
-def generate_questions(context, use_gemini=False):
+def generation_key(context, use_gemini):
+    """Identifies a generation request: same key, same questions (the question cache and job dedup key)."""
+    if use_gemini:
+        return question_cache_key(context, "gemini", GEMINI_MODEL, GEMINI_PROMPT_VERSION)
+    return question_cache_key(context, f"t5-{QG_T5_BACKEND}", T5_MODEL_NAME, T5_PROMPT_VERSION)
+
+
+def generate_questions(context, use_gemini=False, force_refresh=False):
     """
-    Generates structured questions.
+    Generates structured questions, served from the question cache when the same content was
+    already generated with the same backend, model and prompt version.
     :param context: string, course content
     :param use_gemini: bool, if True uses Gemini, else T5
+    :param force_refresh: bool, if True skips the cache lookup (the new result is still cached)
     :return: list of questions [{ type, question, options, answer }]
     """
-    if use_gemini:
-        return generate_questions_gemini(context)
-    else:
-        return generate_questions_t5(context)
+    key = generation_key(context, use_gemini)
+    if not force_refresh:
+        cached = question_cache.get(key)
+        if cached is not None:
+            logger.debug("⚡ Serving %d cached questions.", len(cached))
+            return cached
+
+    started = time.perf_counter()
+    questions = generate_questions_gemini(context) if use_gemini else generate_questions_t5(context)
+    QUESTION_GENERATION_SECONDS.observe(time.perf_counter() - started, backend="gemini" if use_gemini else f"t5-{QG_T5_BACKEND}",
+                                        outcome="ok" if questions else "failed")
+    if questions: # Failures come back as [], never cache them
+        question_cache.put(key, questions)
+    return questions
+
+
+if QG_PRELOAD_T5:
+    load_t5_model()
@@ -0,0 +1,237 @@
+"""
+In-process job queue for question generation, no external broker needed.
+
+POST /generate?async=1 submits a job and returns immediately; GET /jobs/<id> reports its
+status and, once done, the questions. Gemini jobs run on a small thread pool (the work is
+waiting on the network). T5 jobs run in one dedicated worker process, so the CPU-bound
+generation neither holds the GIL of the serving process nor loads the model into it. The
+worker is the t5_worker program, started with the first T5 job; it does not run the main
+script, so under `python app.py` it does not load the recommendation models and background
+threads of the whole service.
+
+Identical requests share one job (same content, backend, model and prompt version, see
+generator.generation_key). Finished jobs are forgotten after QG_JOB_TTL seconds.
+"""
+import itertools
+import os
+import pickle
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+
+QG_JOB_THREADS = int(os.getenv("QG_JOB_THREADS", 4)) # concurrent Gemini jobs
+QG_JOB_MAX_PENDING = int(os.getenv("QG_JOB_MAX_PENDING", 100)) # queued + running jobs before new ones are refused
+QG_JOB_TTL = float(os.getenv("QG_JOB_TTL", 600)) # seconds a finished job stays retrievable
+
+JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED = "queued", "running", "done", "failed"
+
+ML_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class T5WorkerExited(Exception):
+    pass
+
+
+def _run_gemini_job(content, force_refresh):
+    from question_generator.generator import generate_questions
+
+    return generate_questions(content, use_gemini=True, force_refresh=force_refresh)
+
+
+class _T5Worker:
+    """
+    One t5_worker process. submit() hands a job over and returns a Future; a reader thread
+    resolves the futures from the worker's replies. If the process dies (e.g. out of memory)
+    its unanswered jobs fail and `alive` turns False.
+    """
+
+    def __init__(self):
+        self._process = subprocess.Popen([sys.executable, "-m", "question_generator.t5_worker"],
+                                         cwd=ML_SERVICE_DIR, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._futures = {} # request_id -> Future of the jobs the worker has not answered yet
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self.alive = True
+        threading.Thread(target=self._read_replies, name="t5-worker-replies", daemon=True).start()
+
+    def submit(self, content, force_refresh):
+        future = Future()
+        with self._lock:
+            if not self.alive:
+                raise T5WorkerExited("T5 worker process exited")
+            request_id = next(self._request_ids)
+            self._futures[request_id] = future
+            try:
+                pickle.dump((request_id, content, force_refresh), self._process.stdin)
+                self._process.stdin.flush()
+            except OSError as e: # Broken pipe, the reader thread fails the other jobs
+                del self._futures[request_id]
+                raise T5WorkerExited("T5 worker process exited") from e
+        return future
+
+    def _read_replies(self):
+        while True:
+            try:
+                request_id, questions, error = pickle.load(self._process.stdout)
+            except (EOFError, OSError, pickle.UnpicklingError):
+                break
+            with self._lock:
+                future = self._futures.pop(request_id, None)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+            else:
+                future.set_result(questions)
+
+        # The worker exited: its unanswered jobs will never finish
+        with self._lock:
+            self.alive = False
+            unanswered, self._futures = list(self._futures.values()), {}
+        print(f"⚠️ T5 worker process exited with code {self._process.wait()}.")
+        for future in unanswered:
+            future.set_exception(T5WorkerExited("T5 worker process exited"))
+
+
+class QuestionJobQueue:
+    """
+    Args:
+        threads (int): Worker threads for Gemini jobs.
+        max_pending (int): Upper bound on queued + running jobs.
+        ttl_seconds (float): How long finished jobs are kept.
+    """
+
+    def __init__(self, threads, max_pending, ttl_seconds):
+        self.threads = threads
+        self.max_pending = max_pending
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._jobs = {} # job_id -> job dict
+        self._by_key = {} # dedup key -> job_id of the newest job for that key
+        self._thread_pool = None
+        self._thread_pool_pid = None
+        self._t5_worker = None
+        self._t5_worker_pid = None
+
+    def _gemini_pool(self):
+        """The thread pool is created on first use, in the process that uses it (after any fork)."""
+        with self._lock:
+            if self._thread_pool_pid != os.getpid():
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="question-job")
+                self._thread_pool_pid = os.getpid()
+            return self._thread_pool
+
+    def _t5(self, replace=None):
+        """The T5 worker, started on the first T5 job, in the process that uses it (after any fork)."""
+        with self._lock:
+            if self._t5_worker_pid != os.getpid() or self._t5_worker is replace or not self._t5_worker.alive:
+                self._t5_worker = _T5Worker()
+                self._t5_worker_pid = os.getpid()
+            return self._t5_worker
+
+    def _submit_t5(self, content, force_refresh):
+        t5_worker = self._t5()
+        try:
+            return t5_worker.submit(content, force_refresh)
+        except T5WorkerExited:
+            # The worker process died (e.g. out of memory); start a new one for this and later jobs
+            print("⚠️ T5 worker process died, starting a new one.")
+            return self._t5(replace=t5_worker).submit(content, force_refresh)
+
+    def _purge_expired(self, now):
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job["finished_at"] is not None and now - job["finished_at"] > self.ttl_seconds]
+        for job_id in expired:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get(job["key"]) == job_id:
+                del self._by_key[job["key"]]
+
+    def submit(self, key, content, backend, force_refresh=False):
+        """
+        Queues a generation job, or returns the existing job for the same key: a queued or
+        running one always, a finished one unless `force_refresh` (or it failed).
+
+        Returns:
+            (job_id, created): created is False when an existing job was reused.
+
+        Raises:
+            JobQueueFull: Too many jobs are already queued or running.
+        """
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            existing = self._jobs.get(self._by_key.get(key))
+            if existing is not None:
+                in_progress = existing["status"] in (JOB_QUEUED, JOB_RUNNING)
+                if in_progress or (existing["status"] == JOB_DONE and not force_refresh):
+                    return existing["id"], False
+
+            pending = sum(job["status"] in (JOB_QUEUED, JOB_RUNNING) for job in self._jobs.values())
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"{pending} question jobs are already pending")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id, "key": key, "backend": backend, "status": JOB_QUEUED,
+                "created_at": now, "started_at": None, "finished_at": None, "result": None, "error": None,
+            }
+            self._by_key[key] = job_id
+
+        try:
+            if backend == "t5":
+                # The worker process cannot report back when it starts, so T5 jobs count as running once handed over
+                self._set(job_id, status=JOB_RUNNING, started_at=time.time())
+                future = self._submit_t5(content, force_refresh)
+            else:
+                future = self._gemini_pool().submit(self._run, job_id, _run_gemini_job, content, force_refresh)
+        except Exception as e:
+            print(f"❌ Could not start question job {job_id}: {e}")
+            self._set(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
+            return job_id, True
+        future.add_done_callback(lambda f: self._finish(job_id, f))
+        return job_id, True
+
+    def _run(self, job_id, work, content, force_refresh):
+        self._set(job_id, status=JOB_RUNNING, started_at=time.time())
+        return work(content, force_refresh)
+
+    def _set(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(fields)
+
+    def _finish(self, job_id, future):
+        error = future.exception()
+        if error is not None:
+            print(f"❌ Question job {job_id} failed: {error}")
+            self._set(job_id, status=JOB_FAILED, error=str(error), finished_at=time.time())
+        elif not future.result():
+            # The generators report failures by returning no questions
+            self._set(job_id, status=JOB_FAILED, error="No questions were generated.", finished_at=time.time())
+        else:
+            self._set(job_id, status=JOB_DONE, result=future.result(), finished_at=time.time())
+
+    def get(self, job_id):
+        """A snapshot of the job, or None if it is unknown or expired."""
+        with self._lock:
+            self._purge_expired(time.time())
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+        return counts
+
+
+question_jobs = QuestionJobQueue(QG_JOB_THREADS, QG_JOB_MAX_PENDING, QG_JOB_TTL)
@@ -0,0 +1,152 @@
+"""
+Content-addressed cache of generated question sets.
+
+The key is a hash of the normalized course content together with the backend, model and
+prompt version that produced the questions. Regenerating questions for unchanged content is
+therefore free, and changing the prompt or model simply stops matching old entries.
+
+Two tiers:
+  - in-process LRU of QG_CACHE_SIZE entries;
+  - a directory of JSON files (QG_CACHE_DIR) bounded to QG_CACHE_MAX_MB. It survives
+    restarts and is shared by all workers on the host. The least recently used files are
+    deleted when the bound is exceeded.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+ML_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QG_CACHE_SIZE = int(os.getenv("QG_CACHE_SIZE", 256)) # in-memory entries (0 disables the memory tier)
+QG_CACHE_DIR = os.getenv("QG_CACHE_DIR", os.path.join(ML_SERVICE_DIR, "models", "question_cache")) # "" disables the disk tier
+QG_CACHE_MAX_MB = float(os.getenv("QG_CACHE_MAX_MB", 100))
+
+
+def question_cache_key(content, backend, model_name, prompt_version):
+    """Stable key for a question set; whitespace differences in the content do not matter."""
+    normalized = re.sub(r"\s+", " ", content).strip()
+    payload = json.dumps([backend, model_name, prompt_version, normalized], separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class QuestionCache:
+    """
+    Args:
+        max_entries (int): Entries kept in memory.
+        cache_dir (str): Directory of the disk tier, or None to disable it.
+        max_bytes (int): Size bound of the disk tier.
+    """
+
+    def __init__(self, max_entries, cache_dir, max_bytes):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict() # key -> serialized question set, LRU order
+        self._lock = threading.Lock()
+        self._disk_bytes = None # estimate, recomputed by every pruning scan
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "writes": 0, "memory_evictions": 0, "disk_evictions": 0}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".json")
+
+    def _remember(self, key, serialized):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._memory[key] = serialized
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                self._stats["memory_evictions"] += 1
+
+    def get(self, key):
+        """Cached question set for `key` (a fresh copy), or None."""
+        with self._lock:
+            serialized = self._memory.get(key)
+            if serialized is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return json.loads(serialized)
+
+        if self.cache_dir:
+            path = self._path(key)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    serialized = f.read()
+                questions = json.loads(serialized)
+                os.utime(path) # The mtime doubles as the LRU timestamp of the disk tier
+            except (OSError, ValueError):
+                pass # Missing, or deleted/half-visible while another worker pruned
+            else:
+                self._remember(key, serialized)
+                with self._lock:
+                    self._stats["disk_hits"] += 1
+                return questions
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key, questions):
+        serialized = json.dumps(questions)
+        self._remember(key, serialized)
+        with self._lock:
+            self._stats["writes"] += 1
+        if not self.cache_dir:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(serialized)
+            os.replace(tmp_path, path) # Readers see the old file or the new one, never half of it
+        except OSError as e:
+            print(f"⚠️ Could not write question cache entry: {e}")
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(serialized.encode("utf-8"))
+            needs_prune = self._disk_bytes is None or self._disk_bytes > self.max_bytes
+        if needs_prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Deletes the least recently used files until the disk tier fits in max_bytes."""
+        entries = []
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith(".json"):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._disk_bytes = total
+            self._stats["disk_evictions"] += evicted
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        stats["disk_bytes"] = self._disk_bytes
+        return stats
+
+
+question_cache = QuestionCache(QG_CACHE_SIZE, QG_CACHE_DIR or None, int(QG_CACHE_MAX_MB * 1024 * 1024))
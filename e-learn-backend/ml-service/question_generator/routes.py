@@ -1,43 +1,165 @@
-from flask import Blueprint, request, jsonify
-from .generator import generate_questions_gemini
+import copy
+import json
+import time
+
+from flask import Blueprint, Response, request, jsonify, stream_with_context, url_for
+from .generator import generate_questions, generation_key, stream_questions_gemini
+from .jobs import JOB_DONE, JobQueueFull, question_jobs
+from .streaming import stream_metrics
+from metrics import rate_limited_logger
 
 question_gen_bp = Blueprint("question_gen_bp", __name__)
+logger = rate_limited_logger(__name__)
+
+
+def _force_refresh(data):
+    # Instructors regenerating unchanged content get the cached set unless they ask for a new one
+    return bool(data.get("force_refresh")) or request.args.get("force_refresh") in ("1", "true")
+
+
+def _normalize_question(i, q):
+    """Shapes one generated question for the frontend, None for unexpected formats."""
+    # If Gemini returned a dict, extract and clean the "question"
+    if isinstance(q, dict):
+        question_text = q.get("question", "").replace('in English', '').strip()
+        q["question"] = question_text
+        if "type" not in q:
+            q["type"] = "mcq" if i % 2 == 0 else "descriptive"
+        if "options" not in q:
+            q["options"] = [question_text, "Option B", "Option C", "Option D"] if q["type"] == "mcq" else []
+        if "answer" not in q:
+            q["answer"] = question_text
+        return q
+
+    # If Gemini returned a plain string, wrap it into a question object
+    elif isinstance(q, str):
+        q_clean = q.replace('in English', '').strip()
+        return {
+            "question": q_clean,
+            "type": "mcq" if i % 2 == 0 else "descriptive",
+            "options": [q_clean, "Option B", "Option C", "Option D"] if i % 2 == 0 else [],
+            "answer": q_clean
+        }
+
+    logger.warning("Unexpected question format: %s", q)
+    return None
+
+
+def _normalize_questions(raw_questions):
+    formatted_questions = []
+    for i, q in enumerate(raw_questions):
+        question = _normalize_question(i, q)
+        if question is not None:
+            formatted_questions.append(question)
+    return formatted_questions
+
 
 @question_gen_bp.route("/generate", methods=["POST"])
 def generate_quiz_questions():
+    """
+    Generates questions for 'course_content' with 'backend' "gemini" (default) or "t5".
+    With ?async=1 the work is queued and the response is 202 with a job ID to poll at /jobs/<id>.
+    The "t5" backend is only available with ?async=1, so its CPU-bound generation never runs in
+    the serving process.
+    """
     data = request.get_json()
     course_content = data.get("course_content", "")
 
     if not course_content:
         return jsonify({"error": "Course content is required"}), 400
 
-    raw_questions = generate_questions_gemini(course_content)
-    
-    formatted_questions = []
-    for i, q in enumerate(raw_questions):
-        # If Gemini returned a dict, extract and clean the "question"
-        if isinstance(q, dict):
-            question_text = q.get("question", "").replace('in English', '').strip()
-            q["question"] = question_text
-            if "type" not in q:
-                q["type"] = "mcq" if i % 2 == 0 else "descriptive"
-            if "options" not in q:
-                q["options"] = [question_text, "Option B", "Option C", "Option D"] if q["type"] == "mcq" else []
-            if "answer" not in q:
-                q["answer"] = question_text
-            formatted_questions.append(q)
-
-        # If Gemini returned a plain string, wrap it into a question object
-        elif isinstance(q, str):
-            q_clean = q.replace('in English', '').strip()
-            formatted_questions.append({
-                "question": q_clean,
-                "type": "mcq" if i % 2 == 0 else "descriptive",
-                "options": [q_clean, "Option B", "Option C", "Option D"] if i % 2 == 0 else [],
-                "answer": q_clean
-            })
-
-        else:
-            print(f"Unexpected question format: {q}")  # Optional: log unexpected types
-
-    return jsonify({"questions": formatted_questions})
+    backend = data.get("backend", "gemini")
+    if backend not in ("gemini", "t5"):
+        return jsonify({"error": "backend must be 'gemini' or 't5'"}), 400
+    use_gemini = backend == "gemini"
+    run_async = request.args.get("async") in ("1", "true")
+    if not use_gemini and not run_async:
+        return jsonify({"error": "backend 't5' requires ?async=1"}), 400
+
+    if run_async:
+        try:
+            job_id, created = question_jobs.submit(generation_key(course_content, use_gemini), course_content,
+                                                   backend, force_refresh=_force_refresh(data))
+        except JobQueueFull as e:
+            logger.warning("⚠️ Refusing question job: %s", e)
+            return jsonify({"error": "Too many question generation jobs in progress, try again later."}), 503
+        job = question_jobs.get(job_id)
+        return jsonify({"job_id": job_id, "status": job["status"], "deduplicated": not created,
+                        "status_url": url_for(".get_question_job", job_id=job_id)}), 202
+
+    raw_questions = generate_questions(course_content, use_gemini=use_gemini, force_refresh=_force_refresh(data))
+    return jsonify({"questions": _normalize_questions(raw_questions)})
+
+
+@question_gen_bp.route("/jobs/<job_id>", methods=["GET"])
+def get_question_job(job_id):
+    """Status of a question generation job; 'questions' is included once it is done."""
+    job = question_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    body = {key: job[key] for key in ("id", "backend", "status", "created_at", "started_at", "finished_at", "error")}
+    if job["status"] == JOB_DONE:
+        body["questions"] = _normalize_questions(copy.deepcopy(job["result"]))
+    return jsonify(body)
+
+
+@question_gen_bp.route("/generate/stream", methods=["POST"])
+def stream_quiz_questions():
+    """
+    Streaming form of /generate: every question is sent as soon as Gemini has produced it.
+
+    Responds with newline-delimited JSON by default, or server-sent events when the client
+    sends 'Accept: text/event-stream' (or ?format=sse). Events: {"type": "question", "index",
+    "question"} per question, then {"type": "done", "count", "time_to_first_question_ms",
+    "total_ms"}, or {"type": "error", "message"} if generation fails midway.
+    """
+    data = request.get_json(silent=True) or {}
+    course_content = data.get("course_content", "")
+
+    if not course_content:
+        return jsonify({"error": "Course content is required"}), 400
+
+    use_sse = request.args.get("format") == "sse" or "text/event-stream" in request.headers.get("Accept", "")
+    force_refresh = _force_refresh(data)
+
+    def encode(event):
+        payload = json.dumps(event)
+        return f"event: {event['type']}\ndata: {payload}\n\n" if use_sse else payload + "\n"
+
+    def events():
+        started = time.perf_counter()
+        first_question_ms = None
+        count = 0
+        try:
+            for i, q in enumerate(stream_questions_gemini(course_content, force_refresh=force_refresh)):
+                question = _normalize_question(i, q)
+                if question is None:
+                    continue
+                if first_question_ms is None:
+                    first_question_ms = (time.perf_counter() - started) * 1000
+                yield encode({"type": "question", "index": count, "question": question})
+                count += 1
+        except Exception as e:
+            logger.error("❌ Question stream failed after %d questions: %s", count, e)
+            stream_metrics.record(first_question_ms, (time.perf_counter() - started) * 1000)
+            yield encode({"type": "error", "message": "Question generation failed."})
+            return
+        total_ms = (time.perf_counter() - started) * 1000
+        stream_metrics.record(first_question_ms, total_ms)
+        logger.info("📨 Streamed %d questions, first after %.0f ms, total %.0f ms.", count, first_question_ms or 0, total_ms)
+        yield encode({
+            "type": "done",
+            "count": count,
+            "time_to_first_question_ms": round(first_question_ms, 1) if first_question_ms is not None else None,
+            "total_ms": round(total_ms, 1),
+        })
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Proxies must not buffer the stream
+    mimetype = "text/event-stream" if use_sse else "application/x-ndjson"
+    return Response(stream_with_context(events()), mimetype=mimetype, headers=headers)
+
+
+@question_gen_bp.route("/generate/stream/stats", methods=["GET"])
+def stream_stats():
+    """Rolling time-to-first-question and total stream time of this worker."""
+    return jsonify(stream_metrics.summary())
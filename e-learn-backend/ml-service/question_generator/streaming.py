@@ -0,0 +1,91 @@
+"""
+Helpers for streaming generated questions to the client as they are produced.
+
+QuestionStreamParser pulls complete questions out of model text that arrives in arbitrary
+chunks. StreamMetrics keeps rolling statistics of time-to-first-question, the latency users
+actually notice.
+"""
+import json
+import threading
+from collections import deque
+
+from metrics import QUESTION_STREAM_FIRST_QUESTION_SECONDS
+
+
+class QuestionStreamParser:
+    """
+    Incremental parser for a JSON array of strings (optionally wrapped in a ```json fence).
+
+    feed() returns every string literal completed by the new text, so a question is
+    available as soon as its closing quote arrives, however the text was chunked. Text
+    outside string literals (brackets, commas, fences) is ignored.
+    """
+
+    def __init__(self):
+        self._in_string = False
+        self._escaped = False
+        self._literal = []
+
+    def feed(self, text):
+        completed = []
+        for char in text:
+            if not self._in_string:
+                if char == '"':
+                    self._in_string = True
+                    self._literal = ['"']
+                continue
+            self._literal.append(char)
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == '"':
+                self._in_string = False
+                try:
+                    completed.append(json.loads("".join(self._literal)))
+                except ValueError: # e.g. a raw newline inside the literal, take it verbatim
+                    completed.append("".join(self._literal[1:-1]))
+        return completed
+
+
+class StreamMetrics:
+    """Rolling time-to-first-question and total stream time over the last `window` streams."""
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._first_question_ms = deque(maxlen=window)
+        self._total_ms = deque(maxlen=window)
+        self.streams = 0
+        self.empty_streams = 0
+
+    def record(self, first_question_ms, total_ms):
+        if first_question_ms is not None:
+            QUESTION_STREAM_FIRST_QUESTION_SECONDS.observe(first_question_ms / 1000)
+        with self._lock:
+            self.streams += 1
+            if first_question_ms is None:
+                self.empty_streams += 1
+            else:
+                self._first_question_ms.append(first_question_ms)
+            self._total_ms.append(total_ms)
+
+    @staticmethod
+    def _percentile(values, q):
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))], 1)
+
+    def summary(self):
+        with self._lock:
+            first, total = list(self._first_question_ms), list(self._total_ms)
+            streams, empty = self.streams, self.empty_streams
+        return {
+            "streams": streams,
+            "empty_streams": empty,
+            "time_to_first_question_ms": {"p50": self._percentile(first, 50), "p95": self._percentile(first, 95)},
+            "total_ms": {"p50": self._percentile(total, 50), "p95": self._percentile(total, 95)},
+        }
+
+
+stream_metrics = StreamMetrics()
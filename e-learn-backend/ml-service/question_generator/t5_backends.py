@@ -0,0 +1,201 @@
+"""
+Runtime backends for the T5 question model.
+
+  - "torch": the full-precision Hugging Face model (the original behaviour).
+  - "int8":  the same model with every nn.Linear dynamically quantized to int8 (weights
+             stored as int8, activations quantized on the fly). On CPU this roughly
+             quarters the weight memory and speeds up the matrix products that dominate
+             generation. The quantized weights are converted once and cached on disk, so
+             workers load them directly instead of loading fp32 weights and converting.
+
+One-time conversion (also run automatically on first use when the artifact is missing),
+followed by a parity check against the original model:
+    python -m question_generator.t5_backends convert [--force]
+    python -m question_generator.t5_backends check
+"""
+import argparse
+import difflib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+T5_BACKENDS = ("torch", "int8")
+ML_SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Cached int8 artifact (weights, config and tokenizer)
+QG_T5_INT8_DIR = os.getenv("QG_T5_INT8_DIR", os.path.join(ML_SERVICE_DIR, "models", "t5_int8"))
+INT8_WEIGHTS_FILE = "model_int8.pt"
+INT8_META_FILE = "meta.json"
+INT8_LOCK_FILE = ".lock"
+
+# Contexts used by the parity check and the backend benchmark
+PARITY_CONTEXTS = [
+    "Python lists are ordered, mutable sequences. They can hold items of any type and grow as items are appended.",
+    "A <hl> binary search <hl> repeatedly halves a sorted array to find a target value in logarithmic time.",
+    "Photosynthesis converts light energy into chemical energy. Plants use carbon dioxide and water to produce "
+    "glucose and oxygen inside their chloroplasts, which contain the green pigment chlorophyll.",
+    "HTTP is a stateless protocol: every request carries all the information the server needs. Cookies and "
+    "tokens are used to build sessions on top of it.",
+    "The French Revolution began in 1789 and abolished the monarchy, leading to the rise of Napoleon Bonaparte.",
+]
+
+
+def _quantize(model):
+    import torch
+
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _read_meta(output_dir):
+    try:
+        with open(os.path.join(output_dir, INT8_META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def convert_to_int8(model_name, output_dir=QG_T5_INT8_DIR, force=False):
+    """
+    Quantizes `model_name` and caches it in `output_dir`. Skipped when an artifact for the
+    same source model already exists, unless `force`.
+
+    Safe when several processes (gunicorn workers, the T5 job process) find the artifact
+    missing at once: conversion holds an exclusive lock on `output_dir`/.lock, and a process
+    that waited for it re-checks the meta and reuses the artifact the other one wrote.
+    """
+    import fcntl
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, INT8_LOCK_FILE), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX) # Released when the file is closed
+        meta = _read_meta(output_dir)
+        if meta and meta.get("source_model") == model_name and not force:
+            print(f"✅ int8 T5 artifact for {model_name} already exists in {output_dir}.")
+            return output_dir
+        _write_int8_artifact(model_name, output_dir)
+    return output_dir
+
+
+def _write_int8_artifact(model_name, output_dir):
+    """Converts and writes the artifact; the caller holds the conversion lock."""
+    import torch
+    import transformers
+    from transformers import T5ForConditionalGeneration, T5Tokenizer
+
+    print(f"🔧 Converting {model_name} to dynamic int8...")
+    started = time.perf_counter()
+    model = T5ForConditionalGeneration.from_pretrained(model_name).eval()
+    quantized = _quantize(model)
+
+    meta_path = os.path.join(output_dir, INT8_META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path) # The artifact is incomplete until the new meta is in place
+    model.config.save_pretrained(output_dir)
+    T5Tokenizer.from_pretrained(model_name).save_pretrained(output_dir)
+    # Temporary names are per process, a file is only ever visible under its final name complete
+    weights_tmp = os.path.join(output_dir, f"{INT8_WEIGHTS_FILE}.{os.getpid()}.tmp")
+    torch.save(quantized.state_dict(), weights_tmp)
+    os.replace(weights_tmp, os.path.join(output_dir, INT8_WEIGHTS_FILE))
+    meta_tmp = f"{meta_path}.{os.getpid()}.tmp"
+    with open(meta_tmp, "w") as f: # Written last, marks the artifact complete
+        json.dump({
+            "source_model": model_name,
+            "torch_version": torch.__version__,
+            "transformers_version": transformers.__version__,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }, f, indent=2)
+    os.replace(meta_tmp, meta_path)
+    print(f"✅ int8 T5 artifact written to {output_dir} in {time.perf_counter() - started:.1f}s.")
+
+
+def load_t5_backend(backend, model_name):
+    """
+    Loads the T5 tokenizer and model for `backend`.
+
+    Returns:
+        (tokenizer, model, device)
+    """
+    import torch
+    from transformers import T5Config, T5ForConditionalGeneration, T5Tokenizer
+
+    if backend not in T5_BACKENDS:
+        raise ValueError(f"Unknown T5 backend '{backend}', expected one of {T5_BACKENDS}")
+
+    if backend == "torch":
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        return T5Tokenizer.from_pretrained(model_name), T5ForConditionalGeneration.from_pretrained(model_name).to(device), device
+
+    # int8: quantized kernels are CPU-only
+    meta = _read_meta(QG_T5_INT8_DIR)
+    if not meta or meta.get("source_model") != model_name:
+        print(f"⚠️ No int8 T5 artifact for {model_name} in {QG_T5_INT8_DIR}, converting now (one-time).")
+        convert_to_int8(model_name, QG_T5_INT8_DIR) # Re-checks under the lock, another process may have converted meanwhile
+    # Build the quantized module structure from the config alone, then fill in the cached
+    # int8 weights: the fp32 weights are never loaded.
+    model = _quantize(T5ForConditionalGeneration(T5Config.from_pretrained(QG_T5_INT8_DIR)).eval())
+    # weights_only: no code runs while unpickling. The state dict only holds (quantized) tensors,
+    # their dtypes and qschemes, and (weight, bias) tuples, all allowed by the restricted unpickler.
+    state_dict = torch.load(os.path.join(QG_T5_INT8_DIR, INT8_WEIGHTS_FILE), map_location="cpu", weights_only=True)
+    model.load_state_dict(state_dict)
+    return T5Tokenizer.from_pretrained(QG_T5_INT8_DIR), model, torch.device("cpu")
+
+
+def greedy_questions(tokenizer, model, device, contexts, max_length=64):
+    """Deterministic (greedy) questions per context, used to compare backends."""
+    import torch
+
+    encoding = tokenizer(["generate questions: " + c for c in contexts], return_tensors="pt",
+                         padding="longest", truncation=True, max_length=512).to(device)
+    with torch.inference_mode():
+        output = model.generate(input_ids=encoding["input_ids"], attention_mask=encoding["attention_mask"],
+                                max_length=max_length, do_sample=False, num_beams=1)
+    return tokenizer.batch_decode(output, skip_special_tokens=True)
+
+
+def compare_outputs(reference, candidate):
+    """Exact-match rate and mean character similarity of two lists of generated questions."""
+    exact = sum(a.strip() == b.strip() for a, b in zip(reference, candidate))
+    similarity = [difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(reference, candidate)]
+    return {
+        "exact_match_rate": exact / len(reference),
+        "mean_similarity": sum(similarity) / len(similarity),
+    }
+
+
+def check_parity(model_name, contexts=PARITY_CONTEXTS):
+    """Greedy outputs of the int8 backend against the original model on the same contexts."""
+    reference = greedy_questions(*load_t5_backend("torch", model_name), contexts)
+    candidate = greedy_questions(*load_t5_backend("int8", model_name), contexts)
+    for context, a, b in zip(contexts, reference, candidate):
+        marker = "=" if a.strip() == b.strip() else "≠"
+        print(f"{marker} {context[:50]!r}\n    torch: {a}\n    int8:  {b}")
+    return compare_outputs(reference, candidate)
+
+
+def main():
+    from question_generator.generator import T5_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Convert the T5 question model to int8 and check parity.")
+    parser.add_argument("command", choices=["convert", "check"])
+    parser.add_argument("--force", action="store_true", help="Reconvert even if the artifact exists")
+    parser.add_argument("--skip-check", action="store_true", help="Do not run the parity check after converting")
+    parser.add_argument("--min-similarity", type=float, default=0.8,
+                        help="Fail when the mean similarity to the original model is lower")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        convert_to_int8(T5_MODEL_NAME, QG_T5_INT8_DIR, force=args.force)
+        if args.skip_check:
+            return 0
+    result = check_parity(T5_MODEL_NAME)
+    print(f"📊 Parity: exact match {result['exact_match_rate']:.0%}, mean similarity {result['mean_similarity']:.3f}")
+    if result["mean_similarity"] < args.min_similarity:
+        print(f"❌ int8 outputs diverge from the original model (similarity below {args.min_similarity}).")
+        return 1
+    print("✅ int8 backend matches the original model within tolerance.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
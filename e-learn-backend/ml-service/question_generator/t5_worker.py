@@ -0,0 +1,51 @@
+"""
+Worker program for T5 question jobs (see jobs.py), run as `python -m question_generator.t5_worker`.
+
+It is started as a program of its own instead of through multiprocessing: a multiprocessing
+child first runs the parent's main script again, which under `python app.py` would load the
+recommendation models and start the background threads of the whole service. Importing
+this module has no side effects.
+
+Protocol: the parent writes pickled (request_id, content, force_refresh) tuples to stdin;
+the worker answers each with a pickled (request_id, questions, error) tuple on stdout, in
+order. The worker exits when stdin is closed, i.e. when the parent exits.
+"""
+import pickle
+import queue
+import sys
+import threading
+
+
+def _read_requests(stream, requests):
+    """Drains stdin while a job runs, so the parent never blocks writing a request."""
+    while True:
+        try:
+            requests.put(pickle.load(stream))
+        except (EOFError, OSError, pickle.UnpicklingError):
+            requests.put(None)
+            return
+
+
+def main():
+    replies = sys.stdout.buffer
+    sys.stdout = sys.stderr # The generator's prints must not end up in the reply stream
+    requests = queue.Queue()
+    threading.Thread(target=_read_requests, args=(sys.stdin.buffer, requests), daemon=True).start()
+
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        request_id, content, force_refresh = request
+        try:
+            from question_generator.generator import generate_questions
+
+            reply = (request_id, generate_questions(content, use_gemini=False, force_refresh=force_refresh), None)
+        except Exception as e:
+            reply = (request_id, None, str(e))
+        pickle.dump(reply, replies)
+        replies.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+Memory-mapped model artifact format.
+
+A model directory holds one raw binary file per numeric array plus a small
+`manifest.json` that records each array's dtype and shape, the ID maps and any
+scalar metadata (e.g. the CF rating scale). Arrays are opened with np.memmap, so
+every worker process on a host shares one page-cache copy of the model and
+startup time does not grow with the model size.
+
+ID maps (UserIDs, CourseIDs) are stored as fixed-width byte arrays together with
+their sort order, so lookups are a binary search on the mapped arrays instead of
+a dict that every worker would have to build at startup.
+
+Convert models trained before this format with:
+    python -m recommendation.artifacts convert [models_dir]
+"""
+import argparse
+import json
+import os
+import shutil
+from pickle import load
+
+import numpy as np
+
+MANIFEST_FILE = "manifest.json"
+FORMAT_VERSION = 1
+
+
+class IdIndex:
+    """
+    Read-only ID -> position map backed by (possibly memory-mapped) arrays.
+    Behaves like the {ID: position} dicts used for pickled models.
+    """
+
+    def __init__(self, ids, order):
+        self._ids = ids # fixed-width bytes, position order
+        self._order = order # positions sorted by ID, for binary search
+
+    def __len__(self):
+        return self._ids.shape[0]
+
+    def __getitem__(self, item_id):
+        position = self.get(item_id)
+        if position is None:
+            raise KeyError(item_id)
+        return position
+
+    def __iter__(self):
+        return (self.id_at(i) for i in range(len(self)))
+
+    def id_at(self, position):
+        """ID stored at `position`."""
+        return self._ids[position].decode("utf-8")
+
+    def __contains__(self, item_id):
+        return self.get(item_id) is not None
+
+    def get(self, item_id, default=None):
+        """Position of `item_id`, or `default` if it is not in the map."""
+        key = str(item_id).encode("utf-8")
+        if len(self) == 0 or len(key) > self._ids.dtype.itemsize:
+            return default
+        i = int(np.searchsorted(self._ids, key, sorter=self._order))
+        if i < len(self) and self._ids[self._order[i]] == key:
+            return int(self._order[i])
+        return default
+
+    def tolist(self):
+        return [i.decode("utf-8") for i in self._ids]
+
+
+def _encode_ids(ids):
+    """Fixed-width bytes array and sort order for a list of IDs."""
+    encoded = [str(i).encode("utf-8") for i in ids]
+    width = max([len(e) for e in encoded], default=1)
+    id_array = np.array(encoded, dtype=f"S{width}")
+    return id_array, np.argsort(id_array, kind="stable").astype(np.int64)
+
+
+def save_artifacts(target_dir, arrays, id_maps=None, metadata=None):
+    """
+    Writes numeric arrays as raw files plus the manifest.
+
+    Args:
+        target_dir (str): Directory to write to (created if missing).
+        arrays (dict[str, np.ndarray]): Name -> array. Written C-contiguous in native byte order.
+        id_maps (dict[str, list], optional): Name -> list of IDs in position order.
+        metadata (dict, optional): JSON-serializable values stored as-is in the manifest.
+    """
+    os.makedirs(target_dir, exist_ok=True)
+    manifest = {"format_version": FORMAT_VERSION, "arrays": {}, "id_maps": {}, "metadata": metadata or {}}
+
+    all_arrays = dict(arrays)
+    for name, ids in (id_maps or {}).items():
+        all_arrays[f"{name}_ids"], all_arrays[f"{name}_order"] = _encode_ids(ids)
+        manifest["id_maps"][name] = {"ids": f"{name}_ids", "order": f"{name}_order"}
+
+    for name, array in all_arrays.items():
+        array = np.ascontiguousarray(array)
+        file_name = f"{name}.bin"
+        array.tofile(os.path.join(target_dir, file_name))
+        manifest["arrays"][name] = {"file": file_name, "dtype": array.dtype.str, "shape": list(array.shape)}
+
+    # The manifest goes last and is swapped in atomically, so a reader never sees a half-written model
+    tmp_path = os.path.join(target_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(target_dir, MANIFEST_FILE))
+
+
+def has_artifacts(source_dir):
+    return os.path.exists(os.path.join(source_dir, MANIFEST_FILE))
+
+
+def load_artifacts(source_dir):
+    """
+    Opens a model directory written by save_artifacts.
+
+    Returns:
+        (arrays, id_maps, metadata): arrays are read-only np.memmap objects (or empty
+        arrays for zero-sized entries), id_maps are IdIndex objects.
+    """
+    with open(os.path.join(source_dir, MANIFEST_FILE)) as f:
+        manifest = json.load(f)
+    if manifest.get("format_version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported model artifact format: {manifest.get('format_version')}")
+
+    arrays = {}
+    for name, spec in manifest["arrays"].items():
+        dtype, shape = np.dtype(spec["dtype"]), tuple(spec["shape"])
+        if int(np.prod(shape)) == 0:
+            arrays[name] = np.empty(shape, dtype=dtype) # np.memmap cannot map an empty file
+        else:
+            arrays[name] = np.memmap(os.path.join(source_dir, spec["file"]), dtype=dtype, mode="r", shape=shape)
+
+    id_maps = {name: IdIndex(arrays.pop(spec["ids"]), arrays.pop(spec["order"])) for name, spec in manifest["id_maps"].items()}
+    return arrays, id_maps, manifest["metadata"]
+
+
+def convert_legacy_pickles(models_dir, target_dir=None):
+    """
+    Converts the pickled models (content_course_map.pkl, content_neighbors.pkl or
+    content_similarity.pkl, CF factors or cf_predictions_df.pkl) into the artifact format.
+    Models that only have the dense CF predictions keep them as a dense array.
+    """
+    from recommendation.neighbors import topk_neighbors_from_similarity
+
+    target_dir = target_dir or models_dir
+
+    def pickled(name):
+        with open(os.path.join(models_dir, name), "rb") as f:
+            return load(f)
+
+    arrays, id_maps, metadata = {}, {}, {}
+
+    content_course_map = pickled("content_course_map.pkl")
+    id_maps["content_courses"] = [str(c) for c in content_course_map.index]
+    if os.path.exists(os.path.join(models_dir, "content_neighbors.pkl")):
+        neighbors = pickled("content_neighbors.pkl")
+        arrays["content_neighbor_indices"], arrays["content_neighbor_scores"] = neighbors["indices"], neighbors["scores"]
+    else:
+        arrays["content_neighbor_indices"], arrays["content_neighbor_scores"] = topk_neighbors_from_similarity(pickled("content_similarity.pkl"))
+
+    if os.path.exists(os.path.join(models_dir, "cf_user_factors.pkl")):
+        arrays["cf_user_factors"] = pickled("cf_user_factors.pkl")
+        arrays["cf_item_factors"] = pickled("cf_item_factors.pkl")
+        metadata["cf_rating_scale"] = pickled("cf_rating_scale.pkl")
+        id_maps["cf_users"] = [str(u) for u in pickled("cf_user_index.pkl")]
+        id_maps["cf_courses"] = [str(c) for c in pickled("cf_course_columns.pkl")]
+    else:
+        cf_predictions_df = pickled("cf_predictions_df.pkl")
+        arrays["cf_predictions"] = cf_predictions_df.to_numpy(dtype=np.float32)
+        id_maps["cf_users"] = [str(u) for u in cf_predictions_df.index]
+        id_maps["cf_courses"] = [str(c) for c in cf_predictions_df.columns]
+
+    # The course texts and the vectorizer stay pickles (text search and added courses use them)
+    if os.path.abspath(target_dir) != os.path.abspath(models_dir):
+        os.makedirs(target_dir, exist_ok=True)
+        for name in ("content_course_map.pkl", "tfidf_vectorizer.pkl"):
+            if os.path.exists(os.path.join(models_dir, name)):
+                shutil.copy2(os.path.join(models_dir, name), os.path.join(target_dir, name))
+
+    save_artifacts(target_dir, arrays, id_maps=id_maps, metadata=metadata)
+    print(f"✅ Converted pickled models in {models_dir} to memory-mapped artifacts in {target_dir}.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommendation model artifact tools.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    convert = subparsers.add_parser("convert", help="Convert pickled models to the memory-mapped format.")
+    convert.add_argument("models_dir", nargs="?", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models"))
+    convert.add_argument("--target-dir", default=None, help="Defaults to models_dir.")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        convert_legacy_pickles(args.models_dir, args.target_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Collaborative filtering training backends that work on a sparse (users x courses)
+rating matrix end to end.
+
+* "als": weighted ALS for implicit feedback. Every enrollment is a positive preference
+  with confidence 1 + alpha x rating; courses a user never enrolled in are weak negatives
+  instead of ratings of zero. User and course solves are independent: rows are grouped,
+  each group's k x k systems are built with batched products and solved by one stacked
+  np.linalg.solve, and the groups are spread over a thread pool. The Python work per group
+  is constant, so the threads spend their time in BLAS/LAPACK, which runs without the GIL.
+* "svd": the min-max scaled truncated SVD the service used before, computed through a
+  LinearOperator so the scaled matrix is never materialized.
+
+Both return factors in the layout the predictor scores: user factors (users x k) and
+item factors (k x courses), float32.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.linalg import LinearOperator, svds
+
+CF_BACKENDS = ("als", "svd")
+DEFAULT_ALS_FACTORS = 64
+DEFAULT_ALS_REGULARIZATION = 0.1
+DEFAULT_ALS_ALPHA = 10.0
+DEFAULT_ALS_ITERATIONS = 15
+ALS_ROWS_PER_TASK = 512 # Rows solved together in one thread pool task
+ALS_MAX_PADDED_INTERACTIONS = 1 << 16 # Bound on rows x longest row per task, caps the padded (rows x L x k) block
+
+
+def _row_groups(lengths):
+    """
+    Splits the rows, ordered by interaction count, into groups of at most ALS_ROWS_PER_TASK
+    rows whose padded size (rows x longest row) stays within ALS_MAX_PADDED_INTERACTIONS.
+    Rows of similar length share a group, so little of the padding is wasted.
+    """
+    order = np.argsort(lengths, kind="stable")
+    sorted_lengths = lengths[order]
+    groups, start, n = [], 0, lengths.size
+    while start < n:
+        ends = np.arange(start + 1, min(start + ALS_ROWS_PER_TASK, n) + 1)
+        padded = (ends - start) * sorted_lengths[ends - 1]
+        end = ends[max(0, np.searchsorted(padded, ALS_MAX_PADDED_INTERACTIONS, side="right") - 1)]
+        groups.append(order[start:end])
+        start = end
+    return groups
+
+
+def _solve_rows(ratings, fixed_rows, fixed_gram, target, rows, regularization, alpha):
+    """
+    ALS solves (see factors.als_fold_in) for `rows` of `ratings` (CSR) against the fixed
+    factors, written into `target`. The interactions are padded to the longest row with
+    zero weight, so every row's system comes out of the same stacked products:
+    A_r = YᵀY + Y_rᵀ (C_r - I) Y_r + λI and b_r = Y_rᵀ C_r p_r, solved in one call.
+    """
+    starts, lengths = ratings.indptr[rows], ratings.indptr[rows + 1] - ratings.indptr[rows]
+    longest = int(lengths.max())
+    if longest == 0:
+        target[rows] = 0.0
+        return
+    offsets = np.arange(longest)
+    present = offsets < lengths[:, np.newaxis]
+    entries = np.where(present, starts[:, np.newaxis] + offsets, 0) # (rows x L) positions in the CSR arrays
+    confidences = np.where(present, 1 + alpha * ratings.data[entries], 0.0)
+    interacted = fixed_rows[ratings.indices[entries]] # (rows x L x k), padding rows get zero weight below
+    weighted = interacted * (confidences - present)[:, :, np.newaxis] # (C - I) Y, zero on padding
+    k = fixed_gram.shape[0]
+    systems = fixed_gram + regularization * np.eye(k) + np.matmul(weighted.transpose(0, 2, 1), interacted)
+    rhs = np.matmul(confidences[:, np.newaxis, :], interacted)[:, 0, :] # C·p summed over interactions
+    target[rows] = np.linalg.solve(systems, rhs[:, :, np.newaxis])[:, :, 0]
+
+
+def _solve_side(pool, ratings, fixed, target, regularization, alpha):
+    """Recomputes every row of `target` (n x k) from `fixed` (k x m), in parallel."""
+    fixed_gram = fixed @ fixed.T
+    fixed_rows = np.ascontiguousarray(fixed.T) # (m x k), gathered row-wise per interaction
+    tasks = [
+        pool.submit(_solve_rows, ratings, fixed_rows, fixed_gram, target, rows, regularization, alpha)
+        for rows in _row_groups(np.diff(ratings.indptr))
+    ]
+    for task in tasks:
+        task.result() # Re-raises errors from the workers
+
+
+def fit_implicit_als(ratings, factors=DEFAULT_ALS_FACTORS, regularization=DEFAULT_ALS_REGULARIZATION, alpha=DEFAULT_ALS_ALPHA,
+                     iterations=DEFAULT_ALS_ITERATIONS, threads=None, random_state=0):
+    """
+    Weighted ALS for implicit feedback on a sparse rating matrix.
+
+    Args:
+        ratings: scipy.sparse (users x courses) matrix, 0 = no interaction.
+        factors (int): Latent dimensions k.
+        regularization (float): L2 regularization λ.
+        alpha (float): Confidence scaling, confidence = 1 + alpha x rating.
+        iterations (int): Full user + course sweeps.
+        threads (int, optional): Worker threads (defaults to the CPU count).
+        random_state (int): Seed for the initial factors.
+
+    Returns:
+        (user_factors, item_factors): float32 arrays of shape (users x k) and (k x courses).
+    """
+    by_user = sparse.csr_matrix(ratings, dtype=np.float64)
+    by_item = by_user.T.tocsr()
+    n_users, n_items = by_user.shape
+    rng = np.random.default_rng(random_state)
+    user_factors = np.zeros((n_users, factors))
+    item_factors = rng.normal(scale=0.01, size=(n_items, factors))
+
+    threads = threads or os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="als") as pool:
+        for iteration in range(iterations):
+            started = time.perf_counter()
+            _solve_side(pool, by_user, item_factors.T, user_factors, regularization, alpha)
+            users_done = time.perf_counter()
+            _solve_side(pool, by_item, user_factors.T, item_factors, regularization, alpha)
+            print(f"ALS iteration {iteration + 1}/{iterations}: users {users_done - started:.2f}s, "
+                  f"courses {time.perf_counter() - users_done:.2f}s ({threads} threads)")
+    return user_factors.astype(np.float32), item_factors.T.astype(np.float32)
+
+
+def scaled_rating_operator(ratings, min_val, max_val):
+    """
+    The min-max scaled rating matrix (ratings - min) / (max - min), unrated cells included,
+    as a LinearOperator: only the sparse ratings are stored, the constant shift of the
+    unrated cells is applied as a rank-one correction.
+    """
+    by_user = sparse.csr_matrix(ratings, dtype=np.float64)
+    by_item = by_user.T.tocsr()
+    scale = max_val - min_val
+
+    def matmat(x):
+        return (by_user @ x - min_val * x.sum(axis=0)) / scale
+
+    def rmatmat(y):
+        return (by_item @ y - min_val * y.sum(axis=0)) / scale
+
+    return LinearOperator(by_user.shape, matvec=matmat, rmatvec=rmatmat, matmat=matmat, rmatmat=rmatmat, dtype=np.float64)
+
+
+def fit_scaled_svd(ratings, k, min_val, max_val):
+    """
+    Truncated SVD of the min-max scaled rating matrix.
+
+    Returns:
+        (user_factors, item_factors): U·Σ (users x k) and Vt (k x courses), float32.
+    """
+    started = time.perf_counter()
+    U, sigma, Vt = svds(scaled_rating_operator(ratings, min_val, max_val), k=k)
+    print(f"SVD (k={k}) computed in {time.perf_counter() - started:.2f}s.")
+    return (U * sigma).astype(np.float32), Vt.astype(np.float32)
@@ -0,0 +1,63 @@
+import numpy as np
+
+
+def gram_inverse(factors):
+    """
+    Inverse of factors @ factors.T for (k x n) factors, used by project_scaled_ratings.
+    For fresh SVD item factors (orthonormal rows) this is the identity.
+    """
+    factors = np.asarray(factors, dtype=np.float64)
+    return np.linalg.pinv(factors @ factors.T)
+
+
+def project_scaled_ratings(factors, factor_sums, factors_gram_inverse, positions, values, unrated_value):
+    """
+    Least-squares projection of one scaled rating vector onto fixed factors (folding-in).
+
+    The CF model factorizes the min-max scaled rating matrix with unrated cells included, so
+    a rating vector is `unrated_value` everywhere except at `positions`. Every unrated cell
+    contributes the same amount, so only the rated positions need to be touched:
+    O(k x rated) instead of O(k x n).
+
+    Args:
+        factors (np.ndarray): (k x n) float64 factors of the other side (Vt to fold in a user,
+            the transposed user factors to fold in a course).
+        factor_sums (np.ndarray): (k,) factors summed over all n columns.
+        factors_gram_inverse (np.ndarray): (k x k) gram_inverse(factors).
+        positions (list[int]): Columns of `factors` that carry a rating.
+        values (np.ndarray): Scaled ratings at `positions`.
+        unrated_value (float): Scaled value of an unrated cell.
+
+    Returns:
+        (k,) float64 vector.
+    """
+    correlation = unrated_value * factor_sums
+    if len(positions):
+        correlation = correlation + factors[:, list(positions)] @ (np.asarray(values, dtype=np.float64) - unrated_value)
+    return correlation @ factors_gram_inverse
+
+
+def als_fold_in(factors, factors_gram, positions, confidences, regularization):
+    """
+    Implicit-feedback ALS solve for one row against fixed factors of the other side
+    (Hu, Koren & Volinsky): x = (YᵀY + Yᵀ(C - I)Y + λI)⁻¹ YᵀC·p, where p is 1 for every
+    interacted column and C holds the confidences. YᵀY is shared by all rows, so the cost
+    is O(k² x interactions + k³) per row.
+
+    Args:
+        factors (np.ndarray): (k x n) float64 factors of the other side.
+        factors_gram (np.ndarray): (k x k) factors @ factors.T.
+        positions (list[int]): Columns of `factors` the row interacted with.
+        confidences (np.ndarray): Confidence of each interaction (1 + alpha x rating).
+        regularization (float): L2 regularization λ.
+
+    Returns:
+        (k,) float64 vector (zeros for a row without interactions).
+    """
+    k = factors_gram.shape[0]
+    if not len(positions):
+        return np.zeros(k)
+    interacted = factors[:, np.asarray(positions, dtype=np.int64)]
+    confidences = np.asarray(confidences, dtype=np.float64)
+    system = factors_gram + (interacted * (confidences - 1)) @ interacted.T + regularization * np.eye(k)
+    return np.linalg.solve(system, interacted @ confidences)
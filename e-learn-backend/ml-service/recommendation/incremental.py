@@ -0,0 +1,275 @@
+"""
+Incremental retraining driven by a changed-since watermark.
+
+Besides the serving artifacts, a training run stores the state needed to update the model
+later: the TF-IDF matrix (content_tfidf.npz), the raw user x course rating matrix
+(cf_interactions.npz) and a watermark (the time the run started fetching) in the manifest
+metadata. An incremental run (`python train_recommendation.py --incremental`) then:
+
+1. fetches only the courses, and their enrollments, updated since the watermark,
+2. re-vectorizes those courses with the existing TF-IDF vocabulary and updates their rows,
+   and only the rows affected by them, in the neighbor index,
+3. folds the changed courses and the users who (un)enrolled in them into the previous CF
+   factors instead of refactorizing,
+4. writes and publishes a new model version.
+
+The cost follows the size of the change, not the size of the data. The vocabulary, the IDF
+weights and the factorization itself are only refreshed by a full run. A full run is done
+instead when courses were deleted, when there is no usable previous state or when more than
+INCREMENTAL_MAX_CHANGED_FRACTION of the courses changed.
+"""
+import os
+import pickle
+import shutil
+import time
+from datetime import datetime
+
+import numpy as np
+from scipy import sparse
+
+from database_utils import fetch_all_courses_for_content_based_training, fetch_user_ratings_and_enrollments, fetch_course_ids
+from recommendation.artifacts import has_artifacts, load_artifacts, save_artifacts
+from recommendation.factors import gram_inverse, project_scaled_ratings, als_fold_in
+from recommendation.neighbors import update_topk_neighbors
+from recommendation.registry import create_version_dir, publish_version, prune_versions, read_current_version, version_dir
+
+CONTENT_TFIDF_FILE = "content_tfidf.npz"
+CF_INTERACTIONS_FILE = "cf_interactions.npz"
+# Above this share of changed courses a full retrain is cheaper and refreshes vocabulary and factors
+INCREMENTAL_MAX_CHANGED_FRACTION = float(os.getenv("INCREMENTAL_MAX_CHANGED_FRACTION", 0.2))
+
+
+def save_training_state(target_dir, content_tfidf=None, cf_interactions=None):
+    """Stores the matrices an incremental run starts from, next to the model artifacts."""
+    if content_tfidf is not None:
+        sparse.save_npz(os.path.join(target_dir, CONTENT_TFIDF_FILE), sparse.csr_matrix(content_tfidf))
+    if cf_interactions is not None:
+        sparse.save_npz(os.path.join(target_dir, CF_INTERACTIONS_FILE), sparse.csr_matrix(cf_interactions))
+
+
+def load_training_state(models_dir):
+    """
+    Loads the published version together with its training state.
+    Returns None (with the reason printed) if it cannot be updated incrementally.
+    """
+    version = read_current_version(models_dir)
+    path = version_dir(models_dir, version)
+    required = ["tfidf_vectorizer.pkl", "content_course_map.pkl", CONTENT_TFIDF_FILE, CF_INTERACTIONS_FILE]
+    missing = [name for name in required if not os.path.exists(os.path.join(path, name))]
+    if not has_artifacts(path) or missing:
+        print(f"⚠️ Version {version} has no incremental training state (missing: {missing or ['manifest.json']}).")
+        return None
+
+    arrays, id_maps, metadata = load_artifacts(path)
+    if "watermark" not in metadata or "cf_user_factors" not in arrays or "content_courses" not in id_maps:
+        print(f"⚠️ Version {version} lacks a watermark, CF factors or content neighbors.")
+        return None
+
+    with open(os.path.join(path, "tfidf_vectorizer.pkl"), "rb") as f:
+        vectorizer = pickle.load(f)
+    with open(os.path.join(path, "content_course_map.pkl"), "rb") as f:
+        content_course_map = pickle.load(f)
+    return {
+        "version": version,
+        "path": path,
+        "watermark": datetime.fromisoformat(metadata["watermark"]),
+        "vectorizer": vectorizer,
+        "content_course_map": content_course_map,
+        "content_tfidf": sparse.load_npz(os.path.join(path, CONTENT_TFIDF_FILE)).tocsr(),
+        "content_courses": id_maps["content_courses"].tolist(),
+        "content_neighbor_indices": arrays["content_neighbor_indices"],
+        "content_neighbor_scores": arrays["content_neighbor_scores"],
+        "cf_interactions": sparse.load_npz(os.path.join(path, CF_INTERACTIONS_FILE)).tocsr(),
+        "cf_users": id_maps["cf_users"].tolist(),
+        "cf_courses": id_maps["cf_courses"].tolist(),
+        "cf_user_factors": np.array(arrays["cf_user_factors"], dtype=np.float64),
+        "cf_item_factors": np.array(arrays["cf_item_factors"], dtype=np.float64),
+        "cf_rating_scale": metadata["cf_rating_scale"],
+        "cf_model": metadata.get("cf_model", {"type": "svd"}),
+        "content_neighbors": metadata.get("content_neighbors", {"method": "exact"}),
+    }
+
+
+def update_content_model(state, changed_courses, k, block_size):
+    """
+    Re-vectorizes the changed courses with the existing vocabulary, appends new courses and
+    updates the neighbor index. Returns (course_ids, tfidf, neighbor_indices, neighbor_scores,
+    content_course_map).
+    """
+    course_ids = list(state["content_courses"])
+    positions = {course_id: i for i, course_id in enumerate(course_ids)}
+    changed_ids = changed_courses['CourseID'].astype(str).tolist()
+    for course_id in changed_ids:
+        if course_id not in positions:
+            positions[course_id] = len(course_ids)
+            course_ids.append(course_id)
+    changed_positions = np.array([positions[c] for c in changed_ids], dtype=np.int64)
+
+    # Changed rows replace their old rows, new courses are appended at the end
+    old_tfidf = state["content_tfidf"]
+    stacked = sparse.vstack([old_tfidf, state["vectorizer"].transform(changed_courses['combined_features'])]).tocsr()
+    selector = np.arange(len(course_ids))
+    selector[changed_positions] = old_tfidf.shape[0] + np.arange(len(changed_ids))
+    tfidf = stacked[selector]
+
+    neighbor_indices, neighbor_scores = update_topk_neighbors(
+        tfidf, state["content_neighbor_indices"], state["content_neighbor_scores"], changed_positions, k=k, block_size=block_size)
+
+    content_course_map = state["content_course_map"].copy()
+    for course_id, features in zip(changed_ids, changed_courses['combined_features']):
+        content_course_map.loc[course_id, ['index', 'combined_features']] = [positions[course_id], features]
+    content_course_map['index'] = content_course_map['index'].astype(int)
+    return course_ids, tfidf, neighbor_indices, neighbor_scores, content_course_map
+
+
+def _fold_in_terms(cf_model, factors):
+    """Terms shared by every fold-in against the same (k x n) factors."""
+    if cf_model["type"] == "als":
+        return factors @ factors.T, None
+    return gram_inverse(factors), factors.sum(axis=1)
+
+
+def _fold_in_row(cf_model, rating_scale, factors, terms, positions, ratings):
+    """Fits one row (raw ratings at `positions`) against fixed (k x n) factors of the other side."""
+    gram, sums = terms
+    if cf_model["type"] == "als":
+        return als_fold_in(factors, gram, positions, 1 + cf_model["alpha"] * ratings, cf_model["regularization"])
+    min_val, max_val = rating_scale["min_val"], rating_scale["max_val"]
+    # Unrated cells are 0 before scaling, i.e. -min / (max - min) after it
+    return project_scaled_ratings(factors, sums, gram, positions, (ratings - min_val) / (max_val - min_val), -min_val / (max_val - min_val))
+
+
+def update_cf_model(state, changed_course_ids, interactions):
+    """
+    Replaces the ratings of the changed courses and folds them into the previous factors.
+
+    The changed (and new) courses are projected onto the existing user factors, then every
+    user whose ratings changed is projected onto the updated course factors, using the same
+    fold-in the predictor applies to unknown users (least-squares for SVD models, an ALS
+    solve for implicit ALS models). Returns (user_ids, course_ids, rating_matrix,
+    user_factors, item_factors).
+    """
+    user_ids, course_ids = list(state["cf_users"]), list(state["cf_courses"])
+    user_positions = {user_id: i for i, user_id in enumerate(user_ids)}
+    course_positions = {course_id: i for i, course_id in enumerate(course_ids)}
+    for course_id in changed_course_ids:
+        if course_id not in course_positions:
+            course_positions[course_id] = len(course_ids)
+            course_ids.append(course_id)
+
+    new_rows, new_cols, new_ratings = [], [], []
+    if not interactions.empty:
+        for user_id, course_id, rating in zip(interactions['UserID'].astype(str), interactions['CourseID'].astype(str), interactions['Rating']):
+            if user_id not in user_positions:
+                user_positions[user_id] = len(user_ids)
+                user_ids.append(user_id)
+            new_rows.append(user_positions[user_id])
+            new_cols.append(course_positions[course_id])
+            new_ratings.append(rating)
+
+    # Drop every stored rating of the changed courses, then add their current enrollments
+    changed_cols = np.array([course_positions[c] for c in changed_course_ids], dtype=np.int64)
+    old = state["cf_interactions"].tocoo()
+    is_replaced = np.isin(old.col, changed_cols)
+    ratings = sparse.csr_matrix(
+        (np.concatenate([old.data[~is_replaced], new_ratings]),
+         (np.concatenate([old.row[~is_replaced], new_rows]).astype(np.int64), np.concatenate([old.col[~is_replaced], new_cols]).astype(np.int64))),
+        shape=(len(user_ids), len(course_ids)),
+    )
+    ratings.sum_duplicates()
+
+    cf_model, rating_scale = state["cf_model"], state["cf_rating_scale"]
+    n_known_users, k = state["cf_user_factors"].shape
+
+    # 1. Changed courses onto the existing user factors (users new in this run have none yet)
+    item_factors = np.hstack([state["cf_item_factors"], np.zeros((k, len(course_ids) - state["cf_item_factors"].shape[1]))])
+    user_side = state["cf_user_factors"].T
+    terms = _fold_in_terms(cf_model, user_side)
+    by_course = ratings.tocsc()
+    for col in changed_cols:
+        raters = by_course.indices[by_course.indptr[col]:by_course.indptr[col + 1]]
+        values = by_course.data[by_course.indptr[col]:by_course.indptr[col + 1]]
+        known = raters < n_known_users
+        item_factors[:, col] = _fold_in_row(cf_model, rating_scale, user_side, terms, raters[known], values[known])
+
+    # 2. Users whose ratings changed onto the updated course factors
+    user_factors = np.vstack([state["cf_user_factors"], np.zeros((len(user_ids) - n_known_users, k))])
+    terms = _fold_in_terms(cf_model, item_factors)
+    touched_users = np.union1d(old.row[is_replaced], np.array(new_rows, dtype=np.int64))
+    for row in touched_users:
+        rated = ratings.indices[ratings.indptr[row]:ratings.indptr[row + 1]]
+        values = ratings.data[ratings.indptr[row]:ratings.indptr[row + 1]]
+        user_factors[row] = _fold_in_row(cf_model, rating_scale, item_factors, terms, rated, values)
+
+    print(f"CF fold-in: {len(changed_cols)} courses and {len(touched_users)} users updated "
+          f"({len(user_ids) - n_known_users} new users, {len(course_ids) - state['cf_item_factors'].shape[1]} new courses).")
+    return user_ids, course_ids, ratings, user_factors.astype(np.float32), item_factors.astype(np.float32)
+
+
+def train_incremental(models_dir, until, k, block_size, versions_to_keep):
+    """
+    Runs one incremental training pass and publishes the result.
+
+    Args:
+        models_dir (str): Root models directory (CURRENT + versions/).
+        until (datetime): Upper bound of the change window, becomes the new watermark.
+        k (int): Content neighbors kept per course.
+        block_size (int): Rows scored at once while updating neighbors.
+        versions_to_keep (int): Model versions kept after publishing.
+
+    Returns:
+        True if the published model is up to date, False if a full training run is needed.
+    """
+    started = time.perf_counter()
+    state = load_training_state(models_dir)
+    if state is None:
+        return False
+    if state["cf_model"]["type"] == "svd" and state["cf_rating_scale"]["max_val"] - state["cf_rating_scale"]["min_val"] <= 0:
+        print("⚠️ Previous CF model has a degenerate rating scale.")
+        return False
+
+    since = state["watermark"]
+    print(f"\n--- Incremental training from version {state['version']}, changes since {since.isoformat()} ---")
+    deleted = set(state["content_courses"]) - set(fetch_course_ids())
+    if deleted:
+        print(f"⚠️ {len(deleted)} courses were deleted since the last training run.")
+        return False
+
+    changed_courses = fetch_all_courses_for_content_based_training(since=since, until=until)
+    if changed_courses.empty:
+        print(f"✅ No courses changed since {since.isoformat()}. Version {state['version']} is up to date.")
+        return True
+    if len(changed_courses) > INCREMENTAL_MAX_CHANGED_FRACTION * len(state["content_courses"]):
+        print(f"⚠️ {len(changed_courses)} of {len(state['content_courses'])} courses changed (limit {INCREMENTAL_MAX_CHANGED_FRACTION:.0%}).")
+        return False
+    interactions = fetch_user_ratings_and_enrollments(since=since, until=until)
+    print(f"✅ Loaded {len(changed_courses)} changed courses and {len(interactions)} of their enrollments.")
+
+    content_ids, tfidf, neighbor_indices, neighbor_scores, content_course_map = update_content_model(state, changed_courses, k, block_size)
+    print(f"✅ Content neighbors updated ({len(content_ids)} courses).")
+    cf_users, cf_courses, cf_ratings, user_factors, item_factors = update_cf_model(
+        state, changed_courses['CourseID'].astype(str).tolist(), interactions)
+    print("✅ Collaborative filtering factors updated.")
+
+    version, path = create_version_dir(models_dir)
+    shutil.copy2(os.path.join(state["path"], "tfidf_vectorizer.pkl"), os.path.join(path, "tfidf_vectorizer.pkl"))
+    with open(os.path.join(path, "content_course_map.pkl"), "wb") as f:
+        pickle.dump(content_course_map, f)
+    save_training_state(path, content_tfidf=tfidf, cf_interactions=cf_ratings)
+    save_artifacts(
+        path,
+        {
+            "content_neighbor_indices": neighbor_indices,
+            "content_neighbor_scores": neighbor_scores,
+            "cf_user_factors": user_factors,
+            "cf_item_factors": item_factors,
+        },
+        id_maps={"content_courses": content_ids, "cf_users": cf_users, "cf_courses": cf_courses},
+        metadata={"cf_rating_scale": state["cf_rating_scale"], "cf_model": state["cf_model"], "watermark": until.isoformat(), "base_version": state["version"],
+                  # Rows of changed courses are now exact, the others keep how the base version built them
+                  "content_neighbors": state["content_neighbors"]},
+    )
+    publish_version(models_dir, version)
+    prune_versions(models_dir, keep=versions_to_keep)
+    print(f"✅ Published model version {version} (incremental, {time.perf_counter() - started:.2f}s).")
+    return True
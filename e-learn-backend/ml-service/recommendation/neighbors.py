@@ -0,0 +1,151 @@
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+from recommendation.ranking import top_k_indices
+
+DEFAULT_NEIGHBORS_K = 50
+DEFAULT_BLOCK_SIZE = 1024
+
+
+def _select_block(block_similarity, row_positions, k):
+    """Top-k neighbors (excluding the course itself) for one block of similarity rows of the courses at `row_positions`."""
+    n_rows = block_similarity.shape[0]
+    indices = np.empty((n_rows, k), dtype=np.int32)
+    scores = np.empty((n_rows, k), dtype=np.float32)
+    for i in range(n_rows):
+        row = np.array(block_similarity[i], dtype=np.float32)
+        row[row_positions[i]] = -np.inf # A course is never its own neighbor
+        top = top_k_indices(row, k)
+        indices[i] = top
+        scores[i] = row[top]
+    return indices, scores
+
+
+def build_topk_neighbors(vectors, k=DEFAULT_NEIGHBORS_K, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Builds a top-K cosine neighbor index from course vectors (e.g. the TF-IDF matrix).
+
+    Similarities are computed `block_size` rows at a time, so peak memory is
+    block_size x N instead of the full N x N matrix.
+
+    Args:
+        vectors: (N x features) dense array or scipy.sparse matrix, one row per course.
+        k (int): Neighbors kept per course (clipped to N - 1).
+        block_size (int): Number of rows scored per block.
+
+    Returns:
+        (indices, scores): int32 and float32 arrays of shape (N, k). Row i holds the
+        positions of course i's neighbors, most similar first, and their similarity.
+    """
+    n = vectors.shape[0]
+    k = max(0, min(int(k), n - 1))
+    indices = np.empty((n, k), dtype=np.int32)
+    scores = np.empty((n, k), dtype=np.float32)
+    if k == 0:
+        return indices, scores
+
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block_similarity = cosine_similarity(vectors[start:end], vectors)
+        indices[start:end], scores[start:end] = _select_block(block_similarity, np.arange(start, end), k)
+    return indices, scores
+
+
+def exact_neighbors_of(vectors, positions, k=DEFAULT_NEIGHBORS_K, block_size=DEFAULT_BLOCK_SIZE):
+    """Rows `positions` of the index build_topk_neighbors(vectors, k) would return, without building the rest."""
+    positions = np.asarray(positions, dtype=np.int64)
+    n = vectors.shape[0]
+    k = max(0, min(int(k), n - 1))
+    indices = np.empty((positions.size, k), dtype=np.int32)
+    scores = np.empty((positions.size, k), dtype=np.float32)
+    if k == 0:
+        return indices, scores
+    for start in range(0, positions.size, block_size):
+        block = positions[start:start + block_size]
+        indices[start:start + block.size], scores[start:start + block.size] = _select_block(cosine_similarity(vectors[block], vectors), block, k)
+    return indices, scores
+
+
+def topk_neighbors_from_similarity(similarity, k=DEFAULT_NEIGHBORS_K):
+    """Same output as build_topk_neighbors, from an already computed N x N similarity matrix."""
+    n = similarity.shape[0]
+    k = max(0, min(int(k), n - 1))
+    if k == 0:
+        return np.empty((n, 0), dtype=np.int32), np.empty((n, 0), dtype=np.float32)
+    return _select_block(similarity, np.arange(n), k)
+
+
+def _sort_rows(indices, scores, k):
+    """Keeps the k best (score desc, position asc) entries of every row."""
+    order = np.lexsort((indices, -scores), axis=-1)[:, :k]
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+def update_topk_neighbors(vectors, indices, scores, changed_positions, k=DEFAULT_NEIGHBORS_K, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Updates a neighbor index built by build_topk_neighbors after some courses changed.
+
+    `vectors` holds the current vectors of all N courses. The previous index covers the first
+    indices.shape[0] of them; courses beyond that are new and treated as changed. The result
+    is the index build_topk_neighbors(vectors, k) would return, but only the changed courses
+    are scored against the collection (O(changed x N) instead of O(N x N)):
+
+    * rows of changed courses are recomputed,
+    * every other row drops neighbors that changed (their similarity is stale) and merges in
+      its fresh similarities to the changed courses,
+    * a row that lost a neighbor and whose merged k-th score is not above its previous k-th
+      score may now need a course that was outside its old list, so it is recomputed.
+
+    Args:
+        vectors: (N x features) dense array or scipy.sparse matrix, one row per course.
+        indices, scores: The previous index (arrays or memory-mapped arrays).
+        changed_positions: Positions (in `vectors`) of courses whose vectors changed.
+        k (int): Neighbors kept per course (clipped to N - 1).
+        block_size (int): Number of rows scored per block.
+    """
+    n = vectors.shape[0]
+    n_old = indices.shape[0]
+    k = max(0, min(int(k), n - 1))
+    if k == 0 or k != indices.shape[1]:
+        return build_topk_neighbors(vectors, k=k, block_size=block_size)
+
+    changed = np.union1d(np.asarray(changed_positions, dtype=np.int64), np.arange(n_old, n))
+    new_indices = np.empty((n, k), dtype=np.int32)
+    new_scores = np.empty((n, k), dtype=np.float32)
+    new_indices[:n_old] = indices
+    new_scores[:n_old] = scores
+    if changed.size == 0:
+        return new_indices, new_scores
+
+    is_changed = np.zeros(n, dtype=bool)
+    is_changed[changed] = True
+    unchanged = np.flatnonzero(~is_changed)
+
+    # Drop neighbors that point at changed courses, they come back with fresh scores below
+    kept_indices, kept_scores = new_indices[unchanged], new_scores[unchanged]
+    previous_kth = kept_scores[:, -1].copy()
+    stale = is_changed[kept_indices]
+    had_stale = stale.any(axis=1)
+    kept_scores[stale] = -np.inf
+    kept_indices, kept_scores = _sort_rows(kept_indices, kept_scores, k)
+
+    for start in range(0, changed.size, block_size):
+        block = changed[start:start + block_size]
+        block_similarity = cosine_similarity(vectors[block], vectors)
+        new_indices[block], new_scores[block] = _select_block(block_similarity, block, k)
+
+        # Similarity is symmetric: column j of this block is what unchanged course j sees
+        candidates = np.asarray(block_similarity[:, unchanged].T, dtype=np.float32)
+        rows = np.flatnonzero((candidates >= kept_scores[:, -1:]).any(axis=1))
+        if rows.size:
+            merged_indices = np.hstack([kept_indices[rows], np.broadcast_to(block.astype(np.int32), (rows.size, block.size))])
+            merged_scores = np.hstack([kept_scores[rows], candidates[rows]])
+            kept_indices[rows], kept_scores[rows] = _sort_rows(merged_indices, merged_scores, k)
+
+    new_indices[unchanged], new_scores[unchanged] = kept_indices, kept_scores
+
+    recompute = unchanged[had_stale & (kept_scores[:, -1] <= previous_kth)]
+    for start in range(0, recompute.size, block_size):
+        block = recompute[start:start + block_size]
+        new_indices[block], new_scores[block] = _select_block(cosine_similarity(vectors[block], vectors), block, k)
+    return new_indices, new_scores
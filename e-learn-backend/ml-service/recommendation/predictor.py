@@ -1,285 +1,923 @@
 from pickle import load
 import os
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from datetime import datetime, timezone
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.feature_extraction.text import TfidfVectorizer # Needed if re-vectorizing new course inputs
 
+from recommendation.ranking import top_k_indices
+from recommendation.neighbors import topk_neighbors_from_similarity
+from recommendation.artifacts import has_artifacts, load_artifacts
+from recommendation.registry import ModelRegistry
+from recommendation.factors import gram_inverse, project_scaled_ratings, als_fold_in
+from recommendation.result_cache import RecommendationCache, MemoryCacheBackend, SqliteCacheBackend, cache_key
+from recommendation.text_index import AddedCourseStore, CourseTextIndex
+from recommendation.incremental import CONTENT_TFIDF_FILE
+from metrics import HYBRID_STAGE_SECONDS, MODEL_LOAD_SECONDS, RECOMMENDATION_REQUEST_SECONDS, rate_limited_logger
+
+# Per-request messages go through a rate-limited logger, model loading keeps printing
+logger = rate_limited_logger(__name__)
+
 # Correct path for models
 MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models') # Assuming 'models' is directly under ml-service
 # If 'models' is at the root of e-learn-backend (one level up from ml-service) then:
 # MODELS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'models')
 
+# Seconds between checks of the CURRENT model pointer (0 disables automatic hot-reload)
+MODEL_RELOAD_INTERVAL = float(os.getenv("MODEL_RELOAD_INTERVAL", 30))
+# Folded-in vectors of users unknown to the CF model kept per model version (0 disables the cache)
+CF_FOLD_IN_CACHE_SIZE = int(os.getenv("CF_FOLD_IN_CACHE_SIZE", 10000))
+# Implicit ratings used for fold-in, as a fraction of the model's rating scale
+FOLD_IN_ENROLLED_LEVEL = 0.5 # enrolled, no progress yet
+FOLD_IN_PROGRESS_LEVEL = 1.0 # has watched content in the course
+# Cached get_hybrid_recommendations responses (0 disables the cache)
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", 10000))
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", 300)) # seconds
+# "memory" (per worker) or "sqlite" (one file shared by all workers on the host)
+RECOMMENDATION_CACHE_BACKEND = os.getenv("RECOMMENDATION_CACHE_BACKEND", "memory")
+RECOMMENDATION_CACHE_PATH = os.getenv("RECOMMENDATION_CACHE_PATH", os.path.join(MODELS_DIR, "recommendation_cache.sqlite3"))
+# Courses added after training (see recommendation/text_index.py), one file shared by all workers on the host
+ADDED_COURSES_PATH = os.getenv("ADDED_COURSES_PATH", os.path.join(MODELS_DIR, "added_courses.sqlite3"))
+ADDED_COURSES_SYNC_INTERVAL = float(os.getenv("ADDED_COURSES_SYNC_INTERVAL", 1.0)) # seconds between checks for courses added by other workers
+
+
+class ModelBundle:
+    """
+    Everything one model version needs to serve recommendations.
 
-# --- Load Models Globally (once on service startup) ---
-tfidf_vectorizer = None
-content_similarity = None
-content_course_map = None # Stores CourseID -> index and combined_features for CBF lookup (DataFrame or Series)
+    A bundle is immutable once loaded; hot-reload builds a new bundle and swaps it in
+    through the ModelRegistry, so a request always works against a single version.
+    """
+
+    def __init__(self, version, model_dir):
+        self.version = version
+        self.model_dir = model_dir
+        self.loaded_at = None # ISO timestamp, set once loading finishes
+        self.load_seconds = 0.0
+
+        self.tfidf_vectorizer = None
+        self.content_neighbor_indices = None # (courses x K) int32, positions of each course's most similar courses
+        self.content_neighbor_scores = None # (courses x K) float32, matching cosine similarities
+        self.content_course_map = None # Stores CourseID -> index (DataFrame indexed by CourseID) for CBF lookup
+        self.course_text_index = None # CourseTextIndex: free-text search and courses added after training
+        self.watermark = None # ISO start time of the training run (artifact models only)
+
+        # Factor-based CF (preferred): scores for one user are cf_user_factors[row] @ cf_item_factors
+        self.cf_user_factors = None # (users x k) float32, U·Σ from the SVD
+        self.cf_item_factors = None # (k x courses) float32, Vt from the SVD
+        self.cf_item_factors_f64 = None # float64 copy of cf_item_factors used for scoring (see cf_scores_from_vectors)
+        self.cf_model = {"type": "svd"} # Training backend and its fold-in parameters, see recommendation/cf_engine.py
+        self.cf_rating_scale = None # {"min_val": ..., "max_val": ...} used to map scores back to the rating range
+        # Dense CF predictions (users x courses), only used when the model has no factors (models trained before factor mode)
+        self.cf_dense_predictions = None
+        self.cf_user_positions = {} # UserID -> row in the CF model; an IdIndex for mapped models
+        self.cf_course_columns = [] # CourseIDs, column order of the CF model
+        self.cf_course_positions = {} # CourseID -> column in the CF model; an IdIndex for mapped models
+        self.cf_item_factor_sums = None # (k,) float64, Vt summed over all courses, see fold_in_user (SVD models)
+        self.cf_item_gram_inverse = None # (k x k) inverse of Vt·Vtᵀ (identity for a fresh SVD), see fold_in_user (SVD models)
+        self.cf_item_gram = None # (k x k) YᵀY of the item factors, see fold_in_user (ALS models)
+        self._fold_in_cache = OrderedDict() # UserID -> (ratings signature, folded vector), LRU order
+        self._fold_in_lock = threading.Lock()
+
+        # Shared course vocabulary for hybrid blending: content courses first (same positions as
+        # content_course_map), then any CF-only courses. Positions also break score ties.
+        self.hybrid_course_ids = []
+        self.hybrid_course_positions = {} # CourseID -> position in hybrid_course_ids
+        self.cf_column_positions = None # np.ndarray, CF column -> position in hybrid_course_ids
+        self._cbf_rank_matrices = {} # depth -> sparse (courses x courses) rank-score matrix, see cbf_rank_matrix
+
+    # --- Loading ---
+
+    @classmethod
+    def load(cls, model_dir, version):
+        """
+        Loads one model version.
+
+        Prefers the memory-mapped artifact format (manifest.json + raw arrays, see
+        recommendation/artifacts.py) and falls back to the pickles written by older trainings.
+        """
+        started = time.perf_counter()
+        bundle = cls(version, model_dir)
+        print(f"Attempting to load recommendation models from: {model_dir}")
+        if has_artifacts(model_dir):
+            bundle._load_artifact_models()
+        else:
+            bundle._load_pickled_models()
+        bundle._build_hybrid_vocabulary()
+        bundle._build_text_index()
+        bundle.load_seconds = time.perf_counter() - started
+        MODEL_LOAD_SECONDS.observe(bundle.load_seconds)
+        bundle.loaded_at = datetime.now(timezone.utc).isoformat()
+        return bundle
+
+    def _load_artifact_models(self):
+        """Opens the numeric models with mmap, so all workers on a host share one page-cache copy."""
+        try:
+            arrays, id_maps, metadata = load_artifacts(self.model_dir)
+        except Exception as e:
+            print(f"❌ Error opening model artifacts in {self.model_dir}: {e}")
+            return
+        self.watermark = metadata.get("watermark")
+
+        vectorizer_path = os.path.join(self.model_dir, "tfidf_vectorizer.pkl")
+        self.tfidf_vectorizer = load(open(vectorizer_path, "rb")) if os.path.exists(vectorizer_path) else None
+
+        if "content_courses" in id_maps:
+            content_course_ids = id_maps["content_courses"].tolist()
+            self.content_course_map = pd.DataFrame({"index": np.arange(len(content_course_ids))}, index=pd.Index(content_course_ids, name="CourseID"))
+            self.content_neighbor_indices = arrays["content_neighbor_indices"]
+            self.content_neighbor_scores = arrays["content_neighbor_scores"]
+            print("✅ Content-based prediction models mapped.")
+        else:
+            print(f"❌ Content-based models not found in {self.model_dir}. Run training first.")
+
+        if "cf_users" not in id_maps:
+            print(f"❌ Collaborative filtering models not found in {self.model_dir}. Run training first.")
+            return
+        self.cf_user_positions = id_maps["cf_users"]
+        self.cf_course_columns = id_maps["cf_courses"].tolist()
+        self.cf_course_positions = id_maps["cf_courses"]
+        if "cf_user_factors" in arrays:
+            self.cf_user_factors = arrays["cf_user_factors"]
+            self.cf_item_factors = arrays["cf_item_factors"]
+            self.cf_rating_scale = metadata["cf_rating_scale"]
+            self.cf_model = metadata.get("cf_model", self.cf_model)
+            self._prepare_fold_in()
+            print(f"✅ Collaborative filtering factors mapped ({self.cf_user_factors.shape[0]} users, {self.cf_item_factors.shape[1]} courses, k={self.cf_item_factors.shape[0]}).")
+        else:
+            self.cf_dense_predictions = arrays["cf_predictions"]
+            print("✅ Collaborative filtering predictions mapped (dense predictions, no factors found).")
+
+    def _load_pickled_models(self):
+        """Loads models from the pickles written before the artifact format."""
+        model_dir = self.model_dir
+        try:
+            self.tfidf_vectorizer = load(open(os.path.join(model_dir, "tfidf_vectorizer.pkl"), "rb"))
+            self.content_course_map = load(open(os.path.join(model_dir, "content_course_map.pkl"), "rb"))
+            if os.path.exists(os.path.join(model_dir, "content_neighbors.pkl")):
+                content_neighbors = load(open(os.path.join(model_dir, "content_neighbors.pkl"), "rb"))
+                self.content_neighbor_indices = content_neighbors["indices"]
+                self.content_neighbor_scores = content_neighbors["scores"]
+            else:
+                # Models trained before the neighbor index: reduce the dense matrix once and drop it
+                content_similarity = load(open(os.path.join(model_dir, "content_similarity.pkl"), "rb"))
+                self.content_neighbor_indices, self.content_neighbor_scores = topk_neighbors_from_similarity(content_similarity)
+            print("✅ Content-based prediction models loaded.")
+        except FileNotFoundError as e:
+            print(f"❌ Content-based models not found in {model_dir}. Run training first. Error: {e}")
+        except Exception as e:
+            print(f"❌ Error loading content-based models: {e}")
+
+        try:
+            if os.path.exists(os.path.join(model_dir, "cf_user_factors.pkl")):
+                cf_user_index = load(open(os.path.join(model_dir, "cf_user_index.pkl"), "rb"))
+                self.cf_course_columns = load(open(os.path.join(model_dir, "cf_course_columns.pkl"), "rb"))
+                self.cf_user_factors = load(open(os.path.join(model_dir, "cf_user_factors.pkl"), "rb"))
+                self.cf_item_factors = load(open(os.path.join(model_dir, "cf_item_factors.pkl"), "rb"))
+                self.cf_rating_scale = load(open(os.path.join(model_dir, "cf_rating_scale.pkl"), "rb"))
+                self._prepare_fold_in()
+                print(f"✅ Collaborative filtering factors loaded ({self.cf_user_factors.shape[0]} users, {self.cf_item_factors.shape[1]} courses, k={self.cf_item_factors.shape[0]}).")
+            else:
+                cf_predictions_df = load(open(os.path.join(model_dir, "cf_predictions_df.pkl"), "rb"))
+                # The user_index and course_columns might already be part of the DataFrame
+                # if cf_predictions_df is a properly constructed Pandas DataFrame
+                if isinstance(cf_predictions_df, pd.DataFrame):
+                    cf_user_index = cf_predictions_df.index.tolist()
+                    self.cf_course_columns = cf_predictions_df.columns.tolist()
+                else:
+                    print("Warning: cf_predictions_df is not a DataFrame. cf_user_index and cf_course_columns might be incorrect.")
+                    cf_user_index = []
+                self.cf_dense_predictions = np.asarray(cf_predictions_df)
+                print("✅ Collaborative filtering prediction models loaded (dense predictions, no factors found).")
+            self.cf_user_positions = {str(u): i for i, u in enumerate(cf_user_index)}
+            self.cf_course_positions = {str(c): i for i, c in enumerate(self.cf_course_columns)}
+        except FileNotFoundError as e:
+            print(f"❌ Collaborative filtering models not found in {model_dir}. Run training first. Error: {e}")
+        except Exception as e:
+            print(f"❌ Error loading collaborative filtering models: {e}")
+
+    def _prepare_fold_in(self):
+        """Precomputes the item-side terms used for scoring and fold-in."""
+        self.cf_item_factors_f64 = self.cf_item_factors.astype(np.float64)
+        if self.cf_model["type"] == "als":
+            self.cf_item_gram = self.cf_item_factors_f64 @ self.cf_item_factors_f64.T
+        else:
+            self.cf_item_factor_sums = self.cf_item_factors_f64.sum(axis=1)
+            self.cf_item_gram_inverse = gram_inverse(self.cf_item_factors_f64)
+
+    def _build_hybrid_vocabulary(self):
+        """Builds the shared course positions used by both the single-user and batch hybrid paths."""
+        self.hybrid_course_ids = [str(c) for c in self.content_course_map.index] if self.content_course_map is not None else []
+        self.hybrid_course_positions = {course_id: i for i, course_id in enumerate(self.hybrid_course_ids)}
+        for course_id in self.cf_course_columns:
+            if str(course_id) not in self.hybrid_course_positions:
+                self.hybrid_course_positions[str(course_id)] = len(self.hybrid_course_ids)
+                self.hybrid_course_ids.append(str(course_id))
+        self.cf_column_positions = np.array([self.hybrid_course_positions[str(c)] for c in self.cf_course_columns], dtype=np.int64)
+
+        # Course formats as a categorical array over the hybrid vocabulary: one integer code per
+        # course instead of a DataFrame .loc per recommended course. Courses without a format
+        # (CF-only courses, or no 'format' column) are "Mixed".
+        formats = np.full(len(self.hybrid_course_ids), "Mixed", dtype=object)
+        if isinstance(self.content_course_map, pd.DataFrame) and 'format' in self.content_course_map.columns:
+            formats[:len(self.content_course_map)] = self.content_course_map['format'].to_numpy(dtype=object)
+        self.hybrid_format_codes, self.hybrid_format_names = pd.factorize(formats, use_na_sentinel=False)
+
+    def _build_text_index(self):
+        """
+        Builds the inverted index of the course TF-IDF vectors. Uses the matrix stored for
+        incremental training, or re-vectorizes the course texts of the content map (older
+        models). Without either, only the neighbor table serves content recommendations.
+        """
+        if self.tfidf_vectorizer is None or self.content_course_map is None:
+            return
+        try:
+            tfidf_path = os.path.join(self.model_dir, CONTENT_TFIDF_FILE)
+            course_map_path = os.path.join(self.model_dir, "content_course_map.pkl")
+            if os.path.exists(tfidf_path):
+                tfidf = sparse.load_npz(tfidf_path)
+            elif 'combined_features' in self.content_course_map.columns:
+                tfidf = self.tfidf_vectorizer.transform(self.content_course_map['combined_features'])
+            elif os.path.exists(course_map_path):
+                tfidf = self.tfidf_vectorizer.transform(load(open(course_map_path, "rb"))['combined_features'])
+            else:
+                print(f"⚠️ No course TF-IDF vectors in {self.model_dir}, text search disabled.")
+                return
+            if tfidf.shape[0] != len(self.content_course_map):
+                print(f"⚠️ Course TF-IDF vectors have {tfidf.shape[0]} rows for {len(self.content_course_map)} courses, text search disabled.")
+                return
+            self.course_text_index = CourseTextIndex(self.tfidf_vectorizer, self.content_course_map.index, tfidf, self.watermark)
+            print(f"✅ Course text index built ({tfidf.shape[0]} courses, {tfidf.shape[1]} terms).")
+        except Exception as e:
+            print(f"❌ Error building the course text index: {e}")
+
+    def validate(self):
+        """Returns a list of problems that make this bundle unfit to serve (empty if it is fine)."""
+        problems = []
+        if not self.cf_model_loaded():
+            problems.append("CF model missing")
+        if not self.content_model_loaded():
+            problems.append("content model missing")
+        if problems:
+            return problems
+
+        n_content = len(self.content_course_map)
+        if self.content_neighbor_indices.shape[0] != n_content:
+            problems.append(f"neighbor index has {self.content_neighbor_indices.shape[0]} rows for {n_content} courses")
+        elif self.content_neighbor_indices.size and (self.content_neighbor_indices.min() < 0 or self.content_neighbor_indices.max() >= n_content):
+            problems.append("neighbor index points outside the course map")
+
+        n_users, n_courses = len(self.cf_user_positions), len(self.cf_course_columns)
+        if self.cf_user_factors is not None:
+            if self.cf_user_factors.shape[0] != n_users or self.cf_item_factors.shape[1] != n_courses:
+                problems.append("CF factor shapes do not match the user/course ID maps")
+            elif self.cf_user_factors.shape[1] != self.cf_item_factors.shape[0]:
+                problems.append("CF user and item factors have different ranks")
+            elif n_users and not np.isfinite(self.cf_user_scores_batch([0])).all():
+                problems.append("CF scores are not finite")
+        elif self.cf_dense_predictions.shape != (n_users, n_courses):
+            problems.append("dense CF predictions do not match the user/course ID maps")
+        return problems
+
+    # --- Model-level helpers ---
+
+    def cf_model_loaded(self):
+        """True if either the factor-based or the legacy dense CF model is available."""
+        return self.cf_user_factors is not None or self.cf_dense_predictions is not None
+
+    def content_model_loaded(self):
+        """True if the content-based neighbor index and course map are available."""
+        return self.content_neighbor_indices is not None and self.content_course_map is not None
+
+    def cf_user_scores_batch(self, cf_rows):
+        """
+        One row of predicted ratings (over cf_course_columns) per entry of `cf_rows`
+        (row positions in the CF model), computed with a single matrix product.
+        """
+        if self.cf_user_factors is not None:
+            return self.cf_scores_from_vectors(self.cf_user_factors[cf_rows])
+        return np.asarray(self.cf_dense_predictions[list(cf_rows)])
+
+    def cf_scores_from_vectors(self, user_vectors):
+        """
+        Predicted ratings for stacked (users x k) user factor vectors, trained or folded-in.
+
+        The product runs in float64 and is rounded to float32, so a user's scores do not
+        depend on how many other users share the BLAS call.
+        """
+        scores = np.asarray(user_vectors, dtype=np.float64) @ self.cf_item_factors_f64
+        min_val, max_val = self.cf_rating_scale["min_val"], self.cf_rating_scale["max_val"]
+        return (scores * (max_val - min_val) + min_val).astype(np.float32)
+
+    def can_fold_in(self):
+        """Fold-in needs the item factors; models with only dense predictions cannot score new users."""
+        return self.cf_item_factors is not None
+
+    def fold_in_user(self, user_id, ratings):
+        """
+        Projects a user who is not part of the CF model onto the item factors.
+
+        For SVD models (min-max scaled matrix with unrated cells included, factorized as U·Σ·Vt)
+        a user's factor row is the least-squares fit of their scaled rating row onto Vt, see
+        project_scaled_ratings. For implicit ALS models it is one ALS user solve against the
+        item factors, see als_fold_in. Both only touch the rated columns.
+
+        Args:
+            user_id (str): Cache key; the cached vector is reused while `ratings` is unchanged.
+            ratings (dict): CourseID -> rating as a fraction of the rating scale (0.0 to 1.0).
+
+        Returns:
+            (k,) float32 factor vector, or None if none of the courses is known to the CF model.
+        """
+        signature = tuple(sorted(ratings.items()))
+        if CF_FOLD_IN_CACHE_SIZE > 0:
+            with self._fold_in_lock:
+                cached = self._fold_in_cache.get(user_id)
+                if cached is not None and cached[0] == signature:
+                    self._fold_in_cache.move_to_end(user_id)
+                    return cached[1]
+
+        columns = [(self.cf_course_positions.get(course_id), level) for course_id, level in signature]
+        columns = [(column, level) for column, level in columns if column is not None]
+        if not columns:
+            return None
+
+        min_val, max_val = self.cf_rating_scale["min_val"], self.cf_rating_scale["max_val"]
+        if self.cf_model["type"] == "als":
+            column_indices, levels = zip(*columns)
+            # Same confidence as training: 1 + alpha x rating, with the level mapped onto the training ratings
+            confidences = 1 + self.cf_model["alpha"] * np.array(levels) * self.cf_model["max_rating"]
+            vector = als_fold_in(self.cf_item_factors_f64, self.cf_item_gram, column_indices, confidences, self.cf_model["regularization"])
+        elif max_val - min_val > 0:
+            # Unrated cells are 0 before scaling, i.e. -min / (max - min) after it
+            unrated_value = -min_val / (max_val - min_val)
+            column_indices, levels = zip(*columns) # levels are already on the scaled 0..1 range
+            vector = project_scaled_ratings(self.cf_item_factors_f64, self.cf_item_factor_sums, self.cf_item_gram_inverse,
+                                            column_indices, levels, unrated_value)
+        else:
+            vector = np.zeros(self.cf_item_factors.shape[0]) # Training scaled every cell to 0 as well
+        vector = vector.astype(np.float32)
+
+        if CF_FOLD_IN_CACHE_SIZE > 0:
+            with self._fold_in_lock:
+                self._fold_in_cache[user_id] = (signature, vector)
+                self._fold_in_cache.move_to_end(user_id)
+                while len(self._fold_in_cache) > CF_FOLD_IN_CACHE_SIZE:
+                    self._fold_in_cache.popitem(last=False)
+        return vector
+
+    def course_position(self, course_id):
+        """Position of a course in the shared hybrid vocabulary; unknown courses sort last."""
+        return self.hybrid_course_positions.get(str(course_id), len(self.hybrid_course_ids))
+
+    def cbf_rank_matrix(self, depth):
+        """
+        Sparse (courses x courses) matrix whose row i holds 1 / (rank + 1) for the first `depth`
+        neighbors of course i. A seed-indicator matrix times this matrix gives the same per-course
+        aggregated CBF scores as looping over get_content_recommendations for every seed.
+        """
+        depth = min(depth, self.content_neighbor_indices.shape[1])
+        if depth not in self._cbf_rank_matrices:
+            n_content = self.content_neighbor_indices.shape[0]
+            rank_scores = 1 / (np.arange(depth) + 1)
+            self._cbf_rank_matrices[depth] = sparse.csr_matrix(
+                (np.tile(rank_scores, n_content), self.content_neighbor_indices[:, :depth].ravel(), np.arange(n_content + 1) * depth),
+                shape=(n_content, n_content),
+            )
+        return self._cbf_rank_matrices[depth]
+
+
+# --- Load Models (once on service startup, then hot-reloaded by the registry) ---
+
+model_registry = ModelRegistry(MODELS_DIR, ModelBundle.load)
 
-cf_predictions_df = None
-cf_user_index = [] # This might not be directly used if cf_predictions_df is a DataFrame with user_ids as index
-cf_course_columns = [] # This might not be directly used if cf_predictions_df is a DataFrame with course_ids as columns
 
 def load_all_models():
-    """Loads all pre-trained models into global variables."""
-    global tfidf_vectorizer, content_similarity, content_course_map
-    global cf_predictions_df, cf_user_index, cf_course_columns
+    """Loads the published model version (or the legacy flat models directory) into the registry."""
+    model_registry.reload(force=True)
 
-    print(f"Attempting to load recommendation models from: {MODELS_DIR}")
-    try:
-        tfidf_vectorizer = load(open(os.path.join(MODELS_DIR, "tfidf_vectorizer.pkl"), "rb"))
-        content_similarity = load(open(os.path.join(MODELS_DIR, "content_similarity.pkl"), "rb"))
-        content_course_map = load(open(os.path.join(MODELS_DIR, "content_course_map.pkl"), "rb"))
-        print("✅ Content-based prediction models loaded.")
-    except FileNotFoundError as e:
-        print(f"❌ Content-based models not found in {MODELS_DIR}. Run training first. Error: {e}")
-    except Exception as e:
-        print(f"❌ Error loading content-based models: {e}")
+load_all_models() # Call this when the predictor module is imported
+# The pre-fork server (gunicorn.conf.py) imports this module in its master process, which
+# serves no requests; there every worker starts its own watcher after the fork instead
+if os.getenv("ML_PREFORK_MASTER", "false").lower() != "true":
+    model_registry.start_watcher(MODEL_RELOAD_INTERVAL)
 
-    try:
-        cf_predictions_df = load(open(os.path.join(MODELS_DIR, "cf_predictions_df.pkl"), "rb"))
-        # The user_index and course_columns might already be part of the DataFrame
-        # if cf_predictions_df is a properly constructed Pandas DataFrame
-        if isinstance(cf_predictions_df, pd.DataFrame):
-            cf_user_index = cf_predictions_df.index.tolist()
-            cf_course_columns = cf_predictions_df.columns.tolist()
-        else:
-            print("Warning: cf_predictions_df is not a DataFrame. cf_user_index and cf_course_columns might be incorrect.")
-        print("✅ Collaborative filtering prediction models loaded.")
-    except FileNotFoundError as e:
-        print(f"❌ Collaborative filtering models not found in {MODELS_DIR}. Run training first. Error: {e}")
-    except Exception as e:
-        print(f"❌ Error loading collaborative filtering models: {e}")
 
-load_all_models() # Call this when the predictor module is imported
+def _models_or_current(models):
+    return models if models is not None else model_registry.current()
+
+
+def _create_recommendation_cache():
+    if RECOMMENDATION_CACHE_SIZE <= 0:
+        return None
+    if RECOMMENDATION_CACHE_BACKEND == "sqlite":
+        backend = SqliteCacheBackend(RECOMMENDATION_CACHE_PATH, RECOMMENDATION_CACHE_SIZE)
+    else:
+        backend = MemoryCacheBackend(RECOMMENDATION_CACHE_SIZE)
+    print(f"🗄️ Recommendation cache: {backend.name}, {RECOMMENDATION_CACHE_SIZE} entries, TTL {RECOMMENDATION_CACHE_TTL:g}s.")
+    return RecommendationCache(backend, RECOMMENDATION_CACHE_TTL)
+
+recommendation_cache = _create_recommendation_cache()
 
 # --- Recommendation Functions (using loaded models) ---
 
-def get_collaborative_recommendations(user_id, top_n=5):
-    """Get top N course recommendations for a user using CF."""
-    if cf_predictions_df is None:
-        print("CF model not loaded.")
+def _fold_in_ratings(user_data):
+    """
+    Implicit ratings (CourseID -> fraction of the rating scale) for fold-in, built from the
+    enrolledCourses/progress sent by the Node.js backend. Courses with watched content count
+    as a stronger signal than a bare enrollment.
+    """
+    ratings = {}
+    for course_id in user_data.get('enrolledCourses') or []:
+        ratings[str(course_id)] = FOLD_IN_ENROLLED_LEVEL
+    for course_progress_entry in user_data.get('progress') or []:
+        if 'courseId' in course_progress_entry:
+            level = FOLD_IN_PROGRESS_LEVEL if course_progress_entry.get('watchedContent') else FOLD_IN_ENROLLED_LEVEL
+            course_id = str(course_progress_entry['courseId'])
+            ratings[course_id] = max(ratings.get(course_id, 0), level)
+    return ratings
+
+
+def _cf_user_vector(models, user_id, user_data=None):
+    """
+    Factor vector of a user: their trained row, or a fold-in of `user_data` for users who
+    joined after the last training run. None if neither is available.
+    """
+    row = models.cf_user_positions.get(user_id)
+    if row is not None:
+        return models.cf_user_factors[row]
+    if user_data and models.can_fold_in():
+        return models.fold_in_user(user_id, _fold_in_ratings(user_data))
+    return None
+
+
+def get_cf_user_scores(user_id, models=None, user_data=None):
+    """
+    Returns the predicted ratings of one user for every course in cf_course_columns,
+    or None if the user is not part of the CF model and cannot be folded in.
+
+    In factor mode this is a single (k,) x (k, courses) dot product, so memory only
+    grows as (users + courses) x k. Users missing from the model are folded in from
+    `user_data` (see ModelBundle.fold_in_user).
+    """
+    models = _models_or_current(models)
+    user_id = str(user_id)
+    if not models.can_fold_in():
+        # Dense predictions: only users seen at training time can be scored
+        row = models.cf_user_positions.get(user_id)
+        return models.cf_user_scores_batch([row])[0] if row is not None else None
+    vector = _cf_user_vector(models, user_id, user_data)
+    if vector is None:
+        return None
+    return models.cf_scores_from_vectors(vector[np.newaxis, :])[0]
+
+
+def get_collaborative_recommendations(user_id, top_n=5, models=None, user_data=None):
+    """
+    Get top N course recommendations for a user using CF.
+
+    Args:
+        user_id (str): The ID of the user.
+        top_n (int): The number of top recommendations to return.
+        user_data (dict, optional): Payload from the Node.js backend; used to fold in
+                                     users that are not part of the trained CF model.
+    """
+    models = _models_or_current(models)
+    if not models.cf_model_loaded():
+        logger.error("CF model not loaded.")
         return []
-        
+
     user_id_str = str(user_id) # Ensure user_id is string consistent with training
-    if user_id_str not in cf_predictions_df.index:
-        print(f"User {user_id_str} not found in CF prediction matrix.")
+    scores = get_cf_user_scores(user_id_str, models, user_data)
+    if scores is None:
+        logger.debug("User %s not found in CF model.", user_id_str)
         return []
 
-    # Get predicted ratings for the user, sort them
-    sorted_courses_predictions = cf_predictions_df.loc[user_id_str].sort_values(ascending=False)
-    
+    # Partial top-k selection over the user's predicted ratings
     # We will filter out already enrolled/completed courses in the hybrid function
-    
-    recommended_courses_ids = sorted_courses_predictions.head(top_n).index.tolist()
-    
+    top_positions = top_k_indices(scores, top_n)
+
     # Return a list of dicts with CourseID
-    return [{"CourseID": course_id} for course_id in recommended_courses_ids]
+    return [{"CourseID": models.cf_course_columns[i]} for i in top_positions]
 
 
-def get_content_recommendations(course_id, top_n=5):
+def get_content_recommendations(course_id, top_n=5, models=None):
     """
     Get top N similar courses based on content similarity for a given course_id.
     This is typically used if a user has interacted with a course and you want to
     recommend similar ones, or for new users/courses.
     """
-    if content_similarity is None or content_course_map is None:
-        print("CBF models not loaded.")
+    models = _models_or_current(models)
+    if not models.content_model_loaded():
+        logger.error("CBF models not loaded.")
         return []
 
+    content_course_map = models.content_course_map
     course_id_str = str(course_id) # Ensure course_id is string
 
     if course_id_str not in content_course_map.index:
-        print(f"CourseID '{course_id_str}' not found in content map.")
-        return []
+        # Courses created after training are not in the neighbor table, but may have been added to the text index
+        index = _text_index(models)
+        similar = index.search_added_course(course_id_str, top_n) if index is not None else None
+        if similar is None:
+            logger.warning("CourseID '%s' not found in content map.", course_id_str)
+            return []
+        return [{"CourseID": course_id} for course_id, _ in similar]
 
     # Get the internal index of the course
     try:
         idx = content_course_map.index.get_loc(course_id_str) # More robust way to get integer index
     except KeyError:
-        print(f"Error: CourseID '{course_id_str}' not found in content_course_map index.")
+        logger.warning("CourseID '%s' not found in content_course_map index.", course_id_str)
         return []
 
-    # Get similarity scores for this course with all other courses
-    sim_scores = list(enumerate(content_similarity[idx]))
-
-    # Sort courses by similarity score in descending order
-    # [1:] to skip the course itself (which has similarity 1.0)
-    sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)[1 : top_n + 1]
+    # The neighbor index is already sorted by similarity and excludes the course itself,
+    # so this is an O(top_n) slice. At most K neighbors were kept at training time.
+    course_indices = models.content_neighbor_indices[idx, :top_n]
 
-    # Get the indices of the top similar courses
-    course_indices = [i[0] for i in sim_scores]
+    # Map back to CourseIDs for response
+    course_ids = content_course_map.index[course_indices]
 
-    # Map back to CourseIDs and their features for response
-    # Ensure content_course_map is a DataFrame with 'CourseID' as a column or index
-    # If content_course_map is a Series where index is CourseID, then just use index
-    # Assuming content_course_map is a DataFrame with 'CourseID' column
-    recommended_courses_info = content_course_map.iloc[course_indices].reset_index()[['CourseID']].to_dict(orient="records")
-    
     # Return list of dicts with CourseID
-    return recommended_courses_info
+    return [{"CourseID": course_id} for course_id in course_ids]
 
-# --- Hybrid Recommendation Function ---
+# --- Free-text search and courses added after training (see recommendation/text_index.py) ---
 
-def get_hybrid_recommendations(user_id, top_n=5, alpha=0.6, user_data=None): # CORRECTED: Changed `user_preferred_format` to `user_data`
+added_course_store = AddedCourseStore(ADDED_COURSES_PATH)
+
+
+def _text_index(models):
+    """The course text index of `models`, with the courses added by any worker so far, or None."""
+    index = models.course_text_index
+    if index is not None:
+        index.sync(added_course_store, ADDED_COURSES_SYNC_INTERVAL)
+    return index
+
+
+def search_similar_courses(text, top_n=5, exclude=None):
     """
-    Combines Content-Based (CBF) & Collaborative Filtering (CF) recommendations.
-    
+    Courses most similar to an arbitrary text (a search query, or the combined features of a
+    course document that is not part of the model).
+
     Args:
-        user_id (str): The ID of the user for whom to generate recommendations.
-        top_n (int): The number of top recommendations to return.
-        alpha (0.0 to 1.0): Weight for CF (higher = more CF influence).
-        user_data (dict, optional): A dictionary containing comprehensive user data (e.g.,
-                                     enrolled courses, completed content, learning style, etc.)
-                                     sent from the Node.js backend.
+        text (str): Text to vectorize with the model's TF-IDF vectorizer.
+        top_n (int): The number of courses to return.
+        exclude (list, optional): CourseIDs to leave out of the result.
+
+    Returns:
+        list[dict]: [{"CourseID": ..., "Score": cosine similarity}, ...] best first, or None
+        if the model has no text index.
     """
-    if cf_predictions_df is None or content_similarity is None or content_course_map is None:
-        print("Hybrid models not fully loaded. Cannot generate recommendations.")
-        return {"error": "Recommendation models not initialized"}
+    started = time.perf_counter()
+    with model_registry.acquire() as models:
+        index = _text_index(models) if models is not None else None
+        if index is None:
+            logger.error("Course text index not loaded.")
+            return None
+        similar = index.search_text(text, top_n, exclude or ())
+    RECOMMENDATION_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint="text_search", cache="off")
+    return [{"CourseID": course_id, "Score": round(score, 4)} for course_id, score in similar]
+
+
+def add_course_to_index(course_id, features):
+    """
+    Makes a course created or edited after training searchable and usable as a CBF seed
+    without a retrain. It is stored in the added-course store, so every worker on the host
+    picks it up within ADDED_COURSES_SYNC_INTERVAL seconds (this one at once), and it stays
+    in the index of later model versions until a training run has included it.
+
+    Args:
+        course_id (str): The CourseID.
+        features (str): Its combined features text, as training builds it (see database_utils.course_combined_features).
+
+    Returns:
+        int: Sequence number of the change in the added-course store.
+    """
+    seq = added_course_store.put(str(course_id), features)
+    models = model_registry.current()
+    if models is not None and models.course_text_index is not None:
+        models.course_text_index.sync(added_course_store)
+    return seq
+
 
-    user_id_str = str(user_id)
-    
-    # Get user's completed/enrolled courses for filtering and CBF seed
+def _added_seed_scores(models, added_seeds, depth):
+    """
+    Sparse (users x content courses) CBF scores of seed courses added after training, with
+    the rank weights of cbf_rank_matrix. Their neighbors come from the text index.
+
+    Args:
+        added_seeds (list[list[str]]): Per user, the seed CourseIDs missing from the neighbor table.
+    """
+    n_content = models.content_neighbor_indices.shape[0]
+    depth = min(depth, models.content_neighbor_indices.shape[1])
+    index = _text_index(models)
+    rows, columns, data = [], [], []
+    for row, courses in enumerate(added_seeds):
+        for course_id in courses:
+            if index.has_added(course_id):
+                neighbors = index.added_course_neighbors(course_id, depth)
+                rows.append(np.full(neighbors.size, row))
+                columns.append(neighbors)
+                data.append(1 / (np.arange(neighbors.size) + 1))
+    if not rows:
+        return None
+    return sparse.csr_matrix((np.concatenate(data), (np.concatenate(rows), np.concatenate(columns))), shape=(len(added_seeds), n_content))
+
+# --- Hybrid Recommendation Function ---
+
+HYBRID_BATCH_CHUNK_SIZE = int(os.getenv("HYBRID_BATCH_CHUNK_SIZE", 256)) # Users scored together in one dense block
+
+
+def _extract_user_history(user_data, models):
+    """
+    Returns (enrolled_or_completed_course_ids, learning_style) from the user_data sent by
+    the Node.js backend. Course IDs are de-duplicated and ordered by course position so
+    CBF seeds are always aggregated in the same order.
+    """
     user_enrolled_or_completed_courses = []
     user_learning_style = 'unknown' # Default
     if user_data:
         # Assuming user_data['current_courses_enrolled'] or similar is a list of CourseIDs
         if 'enrolledCourses' in user_data and user_data['enrolledCourses']:
             user_enrolled_or_completed_courses.extend([str(c) for c in user_data['enrolledCourses']])
-        
+
         # If progress is a map, extract course IDs from it
         if 'progress' in user_data and user_data['progress']:
             for course_progress_entry in user_data['progress']:
                 # Assuming course_progress_entry is {'courseId': '...', 'watchedContent': [...]}
                 if 'courseId' in course_progress_entry:
                     user_enrolled_or_completed_courses.append(str(course_progress_entry['courseId']))
-        
-        user_enrolled_or_completed_courses = list(set(user_enrolled_or_completed_courses)) # Remove duplicates
+
+        # Remove duplicates
+        user_enrolled_or_completed_courses = sorted(set(user_enrolled_or_completed_courses), key=lambda c: (models.course_position(c), c))
 
         if 'learningStyle' in user_data:
             user_learning_style = user_data['learningStyle']
-    
-    print(f"User {user_id_str} enrolled/completed courses: {user_enrolled_or_completed_courses}")
-    print(f"User learning style: {user_learning_style}")
-
-    # --- CF Recommendations ---
-    cf_recs = []
-    if user_id_str in cf_predictions_df.index:
-        cf_recs = get_collaborative_recommendations(user_id_str, top_n * 5) # Get more for robust blending
-        print(f"CF found {len(cf_recs)} recommendations.")
-    else:
-        print(f"User {user_id_str} not in CF matrix. CF will not contribute to recommendations.")
-
-    cf_scores = {item["CourseID"]: (1 / (i + 1)) for i, item in enumerate(cf_recs)} # Rank-based score
-
-    # --- CBF Recommendations ---
-    cbf_recs_aggregated = {}
-    
-    # 1. CBF based on user's completed/enrolled courses
-    if user_enrolled_or_completed_courses:
-        for completed_course_id in user_enrolled_or_completed_courses:
-            if str(completed_course_id) in content_course_map.index: # Ensure course exists in CBF map
-                similar_courses = get_content_recommendations(completed_course_id, top_n * 3) # Get more per seed
-                for i, item in enumerate(similar_courses):
-                    course_id = item["CourseID"]
-                    # Aggregate scores, giving more weight to higher-ranked similar items
-                    cbf_recs_aggregated[course_id] = cbf_recs_aggregated.get(course_id, 0) + (1 / (i + 1))
-            else:
-                print(f"Warning: Completed course {completed_course_id} not in content map for CBF seed.")
-        
-        # Sort and take top N for CBF contribution
-        cbf_sorted_items = sorted(cbf_recs_aggregated.items(), key=lambda x: x[1], reverse=True)[:top_n * 2]
-        cbf_scores = {item[0]: item[1] for item in cbf_sorted_items}
-        print(f"CBF (from user history) found {len(cbf_scores)} recommendations.")
-    else:
-        # Cold-start CBF: If no user history, fall back to popular courses or general recommendations
-        # based on overall content characteristics.
-        # This part requires an external function or data. For now, it will contribute 0 if no history.
-        # You might implement: get_popular_courses_based_on_learning_style(user_learning_style, top_n)
-        print("No user history for robust CBF. CBF will be limited or rely on CF.")
-        cbf_scores = {}
-
-    # --- Hybrid Score Calculation ---
-    final_scores = {}
-    all_course_ids = set(cf_scores.keys()).union(set(cbf_scores.keys()))
-
-    for course_id in all_course_ids:
-        cf_score = cf_scores.get(course_id, 0)
-        cbf_score = cbf_scores.get(course_id, 0)
-
-        # Weighted Sum
-        final_scores[course_id] = alpha * cf_score + (1 - alpha) * cbf_score
-
-    # Sort by highest scores
-    hybrid_recommendations_sorted = sorted(final_scores.items(), key=lambda x: x[1], reverse=True)
-
-    # --- Filter out already enrolled/completed courses and take top_n ---
-    filtered_recommendations = []
-    for course_id, score in hybrid_recommendations_sorted:
-        if course_id not in user_enrolled_or_completed_courses:
-            filtered_recommendations.append((course_id, score))
-        if len(filtered_recommendations) >= top_n:
-            break
-            
-    # If after filtering, we don't have enough recommendations,
-    # you might add popular general courses or fallback to a different strategy here.
-    if len(filtered_recommendations) < top_n:
-        print(f"Warning: Only {len(filtered_recommendations)} unique recommendations found after filtering.")
-        # Optional: Add some highly rated general courses if fewer than top_n
-        # This would require a function like `get_general_popular_courses()`
+    return user_enrolled_or_completed_courses, user_learning_style
 
-    # --- Attach Learning Mode and Prepare Final Output for Node.js Backend ---
-    recommendations_for_node = []
-    
-    # We will now use content_course_map (if it contains format info)
-    # or a rule based on user_learning_style
-    
-    for course_id, score in filtered_recommendations:
-        recommended_mode = "Mixed" # Default learning mode
-        
-        # Try to get course format from content_course_map if available
-        # This assumes your content_course_map has 'format' as a column/feature
-        course_data_from_map = None
-        if isinstance(content_course_map, pd.DataFrame) and course_id in content_course_map.index:
-             course_data_from_map = content_course_map.loc[course_id]
-             if 'format' in course_data_from_map:
-                 recommended_mode = course_data_from_map['format']
-
-        # Override/refine based on user's preferred learning style if available
-        if user_learning_style != 'unknown':
-            # Simple heuristic: If the course format is 'Mixed' or if the user
-            # strongly prefers a format that the course also offers primarily.
-            if user_learning_style == 'visual' and recommended_mode != 'Video Course':
-                if recommended_mode == 'Mixed' or 'Video Course' in recommended_mode: # Assuming 'Mixed' could also be video
-                    recommended_mode = 'Video Course'
-            elif user_learning_style == 'auditory' and recommended_mode != 'Video Course':
-                if recommended_mode == 'Mixed' or 'Video Course' in recommended_mode:
-                    recommended_mode = 'Video Course' # Assuming audio usually goes with video
-            elif user_learning_style == 'reading/writing' and recommended_mode not in ['Text-based Course', 'Quiz Series']:
-                if recommended_mode == 'Mixed' or 'Text-based Course' in recommended_mode:
-                    recommended_mode = 'Text-based Course'
-            elif user_learning_style == 'kinesthetic' and recommended_mode != 'Live Session':
-                if recommended_mode == 'Mixed' or 'Live Session' in recommended_mode:
-                    recommended_mode = 'Live Session'
-            
-            # If the course's primary format *is* the user's preferred style, keep it.
-            # Otherwise, if it's 'Mixed', try to align.
-            # This logic can be as complex as needed.
-            
-            # Simple: if course format is 'Mixed' or 'Unknown' default,
-            # try to set it to user's preferred style if it matches a known type
-            if recommended_mode == 'Mixed' or recommended_mode == 'Unknown':
-                 if user_learning_style == 'visual': recommended_mode = 'Video Course'
-                 elif user_learning_style == 'auditory': recommended_mode = 'Video Course' # often video-based
-                 elif user_learning_style == 'reading/writing': recommended_mode = 'Text-based Course'
-                 elif user_learning_style == 'kinesthetic': recommended_mode = 'Live Session' # more interactive
 
+@lru_cache(maxsize=1024)
+def _recommended_learning_mode(course_format, user_learning_style):
+    """
+    Picks the learning mode to suggest for a recommended course. Depends only on the course
+    format and the learning style, so results are memoized per (format, style) pair.
+    """
+    # Start from the course format ("Mixed" when the content map has none, see _build_hybrid_vocabulary)
+    recommended_mode = course_format
+
+    # Override/refine based on user's preferred learning style if available
+    if user_learning_style != 'unknown':
+        # Simple heuristic: If the course format is 'Mixed' or if the user
+        # strongly prefers a format that the course also offers primarily.
+        if user_learning_style == 'visual' and recommended_mode != 'Video Course':
+            if recommended_mode == 'Mixed' or 'Video Course' in recommended_mode: # Assuming 'Mixed' could also be video
+                recommended_mode = 'Video Course'
+        elif user_learning_style == 'auditory' and recommended_mode != 'Video Course':
+            if recommended_mode == 'Mixed' or 'Video Course' in recommended_mode:
+                recommended_mode = 'Video Course' # Assuming audio usually goes with video
+        elif user_learning_style == 'reading/writing' and recommended_mode not in ['Text-based Course', 'Quiz Series']:
+            if recommended_mode == 'Mixed' or 'Text-based Course' in recommended_mode:
+                recommended_mode = 'Text-based Course'
+        elif user_learning_style == 'kinesthetic' and recommended_mode != 'Live Session':
+            if recommended_mode == 'Mixed' or 'Live Session' in recommended_mode:
+                recommended_mode = 'Live Session'
+
+        # If the course's primary format *is* the user's preferred style, keep it.
+        # Otherwise, if it's 'Mixed', try to align.
+        # This logic can be as complex as needed.
+
+        # Simple: if course format is 'Mixed' or 'Unknown' default,
+        # try to set it to user's preferred style if it matches a known type
+        if recommended_mode == 'Mixed' or recommended_mode == 'Unknown':
+             if user_learning_style == 'visual': recommended_mode = 'Video Course'
+             elif user_learning_style == 'auditory': recommended_mode = 'Video Course' # often video-based
+             elif user_learning_style == 'reading/writing': recommended_mode = 'Text-based Course'
+             elif user_learning_style == 'kinesthetic': recommended_mode = 'Live Session' # more interactive
+    return recommended_mode
+
+
+def _format_recommendations(scored_courses, user_learning_style, models):
+    """Attaches the learning mode and shapes the output expected by the Node.js backend."""
+    recommendations_for_node = []
+    for course_id, score in scored_courses:
+        course_format = models.hybrid_format_names[models.hybrid_format_codes[models.hybrid_course_positions[course_id]]]
         recommendations_for_node.append({
             "CourseID": course_id,
-            "Score": round(score, 4), # Round score for cleaner output
-            "RecommendedLearningMode": recommended_mode,
+            "Score": round(float(score), 4), # Round score for cleaner output
+            "RecommendedLearningMode": _recommended_learning_mode(course_format, user_learning_style),
             # Do NOT include full course details here (Title, Difficulty, etc.)
             # These should be fetched by the Node.js backend for efficiency and separation of concerns.
         })
-            
-    return {"recommendations": recommendations_for_node}
\ No newline at end of file
+    return recommendations_for_node
+
+
+def get_hybrid_recommendations(user_id, top_n=5, alpha=0.6, user_data=None): # CORRECTED: Changed `user_preferred_format` to `user_data`
+    """
+    Combines Content-Based (CBF) & Collaborative Filtering (CF) recommendations.
+
+    Args:
+        user_id (str): The ID of the user for whom to generate recommendations.
+        top_n (int): The number of top recommendations to return.
+        alpha (0.0 to 1.0): Weight for CF (higher = more CF influence).
+        user_data (dict, optional): A dictionary containing comprehensive user data (e.g.,
+                                     enrolled courses, completed content, learning style, etc.)
+                                     sent from the Node.js backend.
+    """
+    started = time.perf_counter()
+    # Pin one model version for the whole request, a hot-reload cannot swap it mid-way
+    with model_registry.acquire() as models:
+        if recommendation_cache is None or models is None:
+            result = _hybrid_recommendations(models, user_id, top_n, alpha, user_data)
+            RECOMMENDATION_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint="hybrid", cache="off")
+            return result
+
+        key = cache_key(str(user_id), top_n, alpha, _user_data_fingerprint(user_data))
+        cache_version = _cache_version(models)
+        cached = recommendation_cache.get(key, cache_version)
+        if cached is not None:
+            RECOMMENDATION_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint="hybrid", cache="hit")
+            return cached
+        result = _hybrid_recommendations(models, user_id, top_n, alpha, user_data)
+        if "error" not in result:
+            recommendation_cache.put(key, cache_version, result)
+        RECOMMENDATION_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint="hybrid", cache="miss")
+        return result
+
+
+def _cache_version(models):
+    """
+    Tag of cached responses: the model version plus the last added course applied to it
+    (see add_course_to_index). Adding a course can turn an ignored seed into a CBF seed, so
+    it invalidates responses like a model reload does.
+    """
+    index = _text_index(models)
+    return f"{models.version}+{index.synced_seq}" if index is not None else models.version
+
+
+def _user_data_fingerprint(user_data):
+    """
+    The parts of user_data that affect hybrid recommendations, in a canonical form: the
+    enrolled course IDs, whether each progress entry has watched content (fold-in level)
+    and the learning style. Other fields and list order do not change the result, so
+    they are left out of the cache key.
+    """
+    if not user_data:
+        return None
+    watched = {}
+    for course_progress_entry in user_data.get('progress') or []:
+        if 'courseId' in course_progress_entry:
+            course_id = str(course_progress_entry['courseId'])
+            watched[course_id] = watched.get(course_id, False) or bool(course_progress_entry.get('watchedContent'))
+    return {
+        "enrolledCourses": sorted({str(c) for c in user_data.get('enrolledCourses') or []}),
+        "progress": watched,
+        "learningStyle": user_data.get('learningStyle', 'unknown'),
+    }
+
+
+def _hybrid_recommendations(models, user_id, top_n, alpha, user_data):
+    if models is None or not models.cf_model_loaded() or not models.content_model_loaded():
+        logger.error("Hybrid models not fully loaded. Cannot generate recommendations.")
+        return {"error": "Recommendation models not initialized"}
+
+    # Same array code as the batch path, for a chunk of one user: CF rank scores, CBF rank
+    # scores aggregated over all seed courses with one sparse product, an exclusion mask for
+    # enrolled/completed courses and a single partial top-k.
+    result = _score_hybrid_chunk(models, [str(user_id)], [user_data], top_n, alpha)[0]
+    recommendations = result["recommendations"]
+
+    # If after filtering, we don't have enough recommendations,
+    # you might add popular general courses or fallback to a different strategy here.
+    if len(recommendations) < top_n:
+        logger.warning("Only %d unique recommendations found after filtering.", len(recommendations))
+        # Optional: Add some highly rated general courses if fewer than top_n
+        # This would require a function like `get_general_popular_courses()`
+
+    return {"recommendations": recommendations}
+
+
+# --- Batch Hybrid Recommendations ---
+
+def _score_hybrid_chunk(models, user_ids, users_data, top_n, alpha):
+    """
+    Vectorized hybrid scoring for a chunk of users (the single-user path is a chunk of one).
+
+    Per user, CF contributes 1 / (rank + 1) for its top_n * 5 courses and CBF the rank-weighted
+    neighbor scores summed over all seed courses, kept for its top_n * 2 courses. The blend
+    alpha * CF + (1 - alpha) * CBF is ranked over those candidates minus the user's enrolled or
+    completed courses. Ties go to the lower course position.
+
+    Args:
+        user_ids (list[str]): One ID per user.
+        users_data (list[dict or None]): The user_data payloads, same order.
+    """
+    n_users = len(users_data)
+    n_courses = len(models.hybrid_course_ids)
+    n_content = models.content_neighbor_indices.shape[0]
+    hybrid_course_positions = models.hybrid_course_positions
+    stage_started = time.perf_counter()
+    histories = [_extract_user_history(user_data, models) for user_data in users_data]
+
+    cf_scores = np.zeros((n_users, n_courses))
+    cbf_scores = np.zeros((n_users, n_courses))
+    is_candidate = np.zeros((n_users, n_courses), dtype=bool)
+
+    # --- CF: stacked score rows for every user known to the CF model or folded in ---
+    if models.can_fold_in():
+        cf_members = [(i, _cf_user_vector(models, user_id, user_data)) for i, (user_id, user_data) in enumerate(zip(user_ids, users_data))]
+    else:
+        cf_members = [(i, models.cf_user_positions.get(user_id)) for i, user_id in enumerate(user_ids)]
+    cf_members = [(i, member) for i, member in cf_members if member is not None]
+    if cf_members:
+        member_rows, members = zip(*cf_members)
+        if models.can_fold_in():
+            member_scores = models.cf_scores_from_vectors(np.vstack(members))
+        else:
+            member_scores = models.cf_user_scores_batch(list(members))
+        for member_row, row_scores in zip(member_rows, member_scores):
+            top_positions = models.cf_column_positions[top_k_indices(row_scores, top_n * 5)]
+            cf_scores[member_row, top_positions] = 1 / (np.arange(top_positions.size) + 1) # Rank-based score
+            is_candidate[member_row, top_positions] = True
+    stage_started = _observe_stage("cf", stage_started) # Includes parsing the user histories
+
+    # --- CBF: seed indicator matrix x neighbor rank-score matrix ---
+    seed_positions = [[hybrid_course_positions[c] for c in courses if hybrid_course_positions.get(c, n_content) < n_content]
+                      for courses, _ in histories]
+    seed_indptr = np.concatenate([[0], np.cumsum([len(p) for p in seed_positions])])
+    seed_indices = np.array([p for positions in seed_positions for p in positions], dtype=np.int64)
+    seeds = sparse.csr_matrix((np.ones(seed_indices.size), seed_indices, seed_indptr), shape=(n_users, n_content))
+    aggregated = seeds @ models.cbf_rank_matrix(top_n * 3)
+    # Seeds missing from the neighbor table may be courses added after training (see add_course_to_index)
+    added_seeds = [[c for c in courses if hybrid_course_positions.get(c, n_content) >= n_content] for courses, _ in histories]
+    added_scores = _added_seed_scores(models, added_seeds, top_n * 3) if any(added_seeds) and models.course_text_index is not None else None
+    if added_scores is not None:
+        aggregated = (aggregated + added_scores).tocsr()
+    aggregated.sort_indices()
+    for row in range(n_users):
+        row_slice = slice(aggregated.indptr[row], aggregated.indptr[row + 1])
+        row_courses, row_scores = aggregated.indices[row_slice], aggregated.data[row_slice]
+        top = top_k_indices(row_scores, top_n * 2)
+        cbf_scores[row, row_courses[top]] = row_scores[top]
+        is_candidate[row, row_courses[top]] = True
+    stage_started = _observe_stage("cbf", stage_started)
+
+    # --- Blend, mask out enrolled/completed courses, per-row top-k ---
+    final_scores = alpha * cf_scores + (1 - alpha) * cbf_scores
+    ranked = []
+    for row, (courses, _) in enumerate(histories):
+        enrolled_positions = [hybrid_course_positions[c] for c in courses if c in hybrid_course_positions]
+        is_candidate[row, enrolled_positions] = False
+        candidates = np.flatnonzero(is_candidate[row])
+        top_positions = candidates[top_k_indices(final_scores[row, candidates], top_n)]
+        ranked.append([(models.hybrid_course_ids[p], final_scores[row, p]) for p in top_positions])
+    stage_started = _observe_stage("blend", stage_started)
+
+    # --- Learning mode attached, output shaped for the Node.js backend ---
+    results = [{"user_id": user_id, "recommendations": _format_recommendations(scored_courses, learning_style, models)}
+               for user_id, scored_courses, (_, learning_style) in zip(user_ids, ranked, histories)]
+    _observe_stage("learning_mode", stage_started)
+    return results
+
+
+def _observe_stage(stage, started):
+    """Records the time since `started` for a hybrid scoring stage and returns the current time."""
+    now = time.perf_counter()
+    HYBRID_STAGE_SECONDS.observe(now - started, stage=stage)
+    return now
+
+
+def get_hybrid_recommendations_batch(users_data, top_n=5, alpha=0.6):
+    """
+    Batch form of get_hybrid_recommendations: scores many users together and returns, per user,
+    exactly the recommendations the single-user path would return.
+
+    CF rows are computed with one stacked matrix product, CBF seed aggregation is a sparse
+    matrix product and top-k selection is done per row with partial selection. Users are
+    processed HYBRID_BATCH_CHUNK_SIZE at a time to bound the dense (users x courses) blocks.
+
+    Args:
+        users_data (list[dict]): One user_data payload per user, each with a 'user_id'.
+        top_n (int): The number of top recommendations to return per user.
+        alpha (0.0 to 1.0): Weight for CF (higher = more CF influence).
+
+    Returns:
+        {"results": [{"user_id": ..., "recommendations": [...]}, ...]} in input order.
+    """
+    with model_registry.acquire() as models:
+        if models is None or not models.cf_model_loaded() or not models.content_model_loaded():
+            logger.error("Hybrid models not fully loaded. Cannot generate recommendations.")
+            return {"error": "Recommendation models not initialized"}
+
+        started = time.perf_counter()
+        results = []
+        for start in range(0, len(users_data), HYBRID_BATCH_CHUNK_SIZE):
+            chunk = users_data[start:start + HYBRID_BATCH_CHUNK_SIZE]
+            results.extend(_score_hybrid_chunk(models, [str(user_data['user_id']) for user_data in chunk], chunk, top_n, alpha))
+        RECOMMENDATION_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint="hybrid_batch", cache="off")
+        return {"results": results}
@@ -0,0 +1,33 @@
+import numpy as np
+
+
+def top_k_indices(scores, k):
+    """
+    Returns the indices of the k highest scores, best first.
+
+    Uses partial selection (np.argpartition) so the cost is O(n + k log k)
+    instead of sorting the whole row. Ties are broken by the lower index, which
+    keeps the ordering deterministic between calls and between code paths.
+
+    Args:
+        scores (np.ndarray): 1-D array of scores.
+        k (int): Number of indices to return (clipped to len(scores)).
+    """
+    scores = np.asarray(scores)
+    n = scores.shape[0]
+    k = min(int(k), n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    if k < n:
+        # Everything strictly above the k-th best score is in, then the ties at the
+        # boundary are filled in index order.
+        kth_value = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        above = np.flatnonzero(scores > kth_value)
+        ties = np.flatnonzero(scores == kth_value)[:k - above.size]
+        candidates = np.concatenate([above, ties])
+    else:
+        candidates = np.arange(n)
+
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
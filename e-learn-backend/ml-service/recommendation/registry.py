@@ -0,0 +1,211 @@
+"""
+Versioned model registry with atomic hot-reload.
+
+On disk, every training run writes a new directory under `<models_dir>/versions/`
+and then publishes it by atomically replacing the `<models_dir>/CURRENT` pointer
+file. A models directory without a CURRENT pointer (models trained before
+versioning) is served as the single version "legacy".
+
+In the service, ModelRegistry owns the active model bundle. New versions are
+loaded and validated off the request path, then swapped in under a lock, so a
+request sees either the old or the new model but never a mix. Requests hold the
+bundle they started with (`with registry.acquire() as models:`); a replaced
+bundle is only released once its in-flight requests have finished.
+"""
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+VERSIONS_DIR_NAME = "versions"
+CURRENT_POINTER = "CURRENT"
+LEGACY_VERSION = "legacy"
+
+
+# --- On-disk layout ---
+
+def new_version_name():
+    """Sortable, unique-enough version name for a training run (UTC timestamp)."""
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def version_dir(models_dir, version):
+    if version == LEGACY_VERSION:
+        return models_dir
+    return os.path.join(models_dir, VERSIONS_DIR_NAME, version)
+
+
+def create_version_dir(models_dir, version=None):
+    """Creates the directory for a new (unpublished) version and returns (version, path)."""
+    version = version or new_version_name()
+    path = version_dir(models_dir, version)
+    os.makedirs(path, exist_ok=False)
+    return version, path
+
+
+def publish_version(models_dir, version):
+    """Atomically points CURRENT at `version`. Running services pick it up on their next reload."""
+    if not os.path.isdir(version_dir(models_dir, version)):
+        raise ValueError(f"Model version '{version}' does not exist in {models_dir}")
+    tmp_path = os.path.join(models_dir, CURRENT_POINTER + ".tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(models_dir, CURRENT_POINTER))
+
+
+def read_current_version(models_dir):
+    """Version named by the CURRENT pointer, or LEGACY_VERSION if there is none."""
+    try:
+        with open(os.path.join(models_dir, CURRENT_POINTER)) as f:
+            return f.read().strip() or LEGACY_VERSION
+    except FileNotFoundError:
+        return LEGACY_VERSION
+
+
+def list_versions(models_dir):
+    versions_root = os.path.join(models_dir, VERSIONS_DIR_NAME)
+    if not os.path.isdir(versions_root):
+        return []
+    return sorted(v for v in os.listdir(versions_root) if os.path.isdir(os.path.join(versions_root, v)))
+
+
+def prune_versions(models_dir, keep=3):
+    """
+    Deletes all but the newest `keep` versions, never the current one. Services that still
+    map files of a deleted version keep working: the files stay alive until unmapped.
+    """
+    current = read_current_version(models_dir)
+    versions = list_versions(models_dir)
+    for version in versions[:max(0, len(versions) - keep)]:
+        if version != current:
+            shutil.rmtree(version_dir(models_dir, version), ignore_errors=True)
+
+
+# --- In-process registry ---
+
+class ModelRegistry:
+    """
+    Holds the active model bundle and swaps in new versions without a restart.
+
+    Args:
+        models_dir (str): Root models directory (containing CURRENT and versions/).
+        loader (callable): loader(path, version) -> bundle. The bundle must expose
+            `version`, `loaded_at` and `load_seconds` attributes and a `validate()`
+            method returning a list of problems (empty when the bundle is usable).
+    """
+
+    def __init__(self, models_dir, loader):
+        self.models_dir = models_dir
+        self._loader = loader
+        self._lock = threading.Lock() # guards _active, _in_flight and _retired
+        self._reload_lock = threading.Lock() # one load at a time
+        self._active = None
+        self._in_flight = {} # id(bundle) -> requests currently using it
+        self._retired = [] # replaced bundles that still have requests in flight
+        self._last_error = None
+        self._rejected_version = None # not retried by the watcher until it is published again or forced
+        self._watcher_pid = None # process whose watcher thread is running (threads do not survive a fork)
+
+    def current(self):
+        return self._active
+
+    @contextmanager
+    def acquire(self):
+        """Pins the active bundle for the duration of one request."""
+        with self._lock:
+            bundle = self._active
+            self._in_flight[id(bundle)] = self._in_flight.get(id(bundle), 0) + 1
+        try:
+            yield bundle
+        finally:
+            with self._lock:
+                self._in_flight[id(bundle)] -= 1
+                if self._in_flight[id(bundle)] == 0:
+                    del self._in_flight[id(bundle)]
+                    if bundle in self._retired:
+                        self._retired.remove(bundle)
+                        print(f"♻️ Model version {bundle.version} drained and released.")
+
+    def reload(self, force=False):
+        """
+        Loads the version named by CURRENT (if it differs from the active one, or `force`),
+        validates it and swaps it in. Returns True if a new bundle was activated.
+
+        The very first load is activated even when validation fails, so the service can
+        start (and report the problem) before any model has been trained.
+        """
+        with self._reload_lock:
+            version = read_current_version(self.models_dir)
+            active = self._active
+            if active is not None and version in (active.version, self._rejected_version) and not force:
+                return False
+
+            print(f"🔄 Loading model version {version}...")
+            try:
+                bundle = self._loader(version_dir(self.models_dir, version), version)
+                problems = bundle.validate()
+            except Exception as e:
+                self._last_error = f"Loading version {version} failed: {e}"
+                self._rejected_version = version
+                print(f"❌ {self._last_error}")
+                return False
+
+            if problems and active is not None:
+                self._last_error = f"Version {version} rejected: {'; '.join(problems)}"
+                self._rejected_version = version
+                print(f"❌ {self._last_error}. Keeping version {active.version}.")
+                return False
+            if problems:
+                print(f"⚠️ Model version {version} is incomplete: {'; '.join(problems)}")
+
+            with self._lock:
+                if active is not None and id(active) in self._in_flight:
+                    self._retired.append(active)
+                self._active = bundle
+            self._last_error = None
+            self._rejected_version = None
+            print(f"✅ Model version {version} active (loaded in {bundle.load_seconds:.3f}s).")
+            return True
+
+    def reload_async(self, force=False):
+        """Runs reload() in a background thread and returns the thread."""
+        thread = threading.Thread(target=self.reload, kwargs={"force": force}, name="model-reload", daemon=True)
+        thread.start()
+        return thread
+
+    def start_watcher(self, interval_seconds):
+        """
+        Polls the CURRENT pointer every `interval_seconds` and reloads when it changes.
+        Starts once per process, so a forked worker calls it again to get its own watcher.
+        """
+        if self._watcher_pid == os.getpid() or interval_seconds <= 0:
+            return
+
+        def watch():
+            while True:
+                time.sleep(interval_seconds)
+                try:
+                    self.reload()
+                except Exception as e: # Never let the watcher die
+                    print(f"❌ Model watcher error: {e}")
+
+        self._watcher_pid = os.getpid()
+        threading.Thread(target=watch, name="model-watcher", daemon=True).start()
+
+    def status(self):
+        with self._lock:
+            active = self._active
+            return {
+                "active_version": active.version if active else None,
+                "loaded_at": active.loaded_at if active else None,
+                "load_seconds": round(active.load_seconds, 4) if active else None,
+                "in_flight": self._in_flight.get(id(active), 0),
+                "draining_versions": [{"version": b.version, "in_flight": self._in_flight.get(id(b), 0)} for b in self._retired],
+                "published_version": read_current_version(self.models_dir),
+                "available_versions": list_versions(self.models_dir),
+                "last_error": self._last_error,
+            }
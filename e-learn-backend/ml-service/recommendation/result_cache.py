@@ -0,0 +1,206 @@
+"""
+Cache of finished recommendation responses.
+
+Entries are tagged with the model version that produced them: a lookup made against a
+different version (after a hot-reload) is a miss and drops the entry, so a reload
+invalidates the cache without any coordination. Entries also expire after a TTL, which
+bounds how stale a response can get when course data changes between training runs.
+
+Two backends share one interface:
+  - in-process LRU (default), private to each worker;
+  - SQLite file, shared by all workers on a host (e.g. gunicorn workers), so a response
+    computed by one worker is a hit for the others.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from recommendation.sqlite_util import ThreadLocalConnections
+
+
+def cache_key(*parts):
+    """Stable key for JSON-serializable parts (dict keys are sorted, so field order does not matter)."""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCacheBackend:
+    """LRU dictionary private to the process."""
+
+    name = "memory"
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (version, expires_at, serialized value), LRU order
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, version, expires_at, value):
+        """Stores an entry and returns the number of entries evicted to make room."""
+        with self._lock:
+            self._entries[key] = (version, expires_at, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def size(self):
+        return len(self._entries)
+
+
+class SqliteCacheBackend:
+    """
+    LRU table in a SQLite file shared between processes. Every thread (and every forked
+    worker) opens its own connection (see sqlite_util); WAL mode lets readers run alongside a writer.
+
+    Args:
+        path (str): Database file, created if missing.
+        max_entries (int): Entries kept; the least recently used are evicted beyond that.
+        prune_every (int): Puts between eviction passes (eviction scans the table).
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path, max_entries, prune_every=100):
+        self.path = path
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._connections = ThreadLocalConnections(path, [
+            "PRAGMA synchronous=NORMAL",
+            "CREATE TABLE IF NOT EXISTS recommendation_cache ("
+            "key TEXT PRIMARY KEY, version TEXT, expires_at REAL, last_used REAL, value TEXT)",
+            "CREATE INDEX IF NOT EXISTS recommendation_cache_lru ON recommendation_cache (last_used)",
+        ])
+        self._puts = 0
+        self._puts_lock = threading.Lock()
+
+    def get(self, key):
+        connection = self._connections.get()
+        row = connection.execute(
+            "SELECT version, expires_at, value FROM recommendation_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None:
+            connection.execute("UPDATE recommendation_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def put(self, key, version, expires_at, value):
+        """Stores an entry and returns the number of entries evicted by this call."""
+        connection = self._connections.get()
+        connection.execute(
+            "INSERT OR REPLACE INTO recommendation_cache (key, version, expires_at, last_used, value) VALUES (?, ?, ?, ?, ?)",
+            (key, version, expires_at, time.time(), value),
+        )
+        with self._puts_lock:
+            self._puts += 1
+            if self._puts < self.prune_every:
+                return 0
+            self._puts = 0
+        # Expired entries go first, then the least recently used beyond max_entries
+        connection.execute("DELETE FROM recommendation_cache WHERE expires_at < ?", (time.time(),))
+        cursor = connection.execute(
+            "DELETE FROM recommendation_cache WHERE key IN ("
+            "SELECT key FROM recommendation_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+        return max(cursor.rowcount, 0)
+
+    def delete(self, key):
+        self._connections.get().execute("DELETE FROM recommendation_cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connections.get().execute("DELETE FROM recommendation_cache")
+
+    def size(self):
+        return self._connections.get().execute("SELECT COUNT(*) FROM recommendation_cache").fetchone()[0]
+
+
+class RecommendationCache:
+    """
+    LRU + TTL cache of recommendation responses, invalidated by model version.
+
+    Args:
+        backend: MemoryCacheBackend or SqliteCacheBackend.
+        ttl_seconds (float): Lifetime of an entry.
+    """
+
+    def __init__(self, backend, ttl_seconds):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0, "errors": 0}
+
+    def _count(self, name, amount=1):
+        with self._stats_lock:
+            self._stats[name] += amount
+
+    def get(self, key, version):
+        """Cached value for `key` computed by model `version`, or None."""
+        try:
+            entry = self.backend.get(key)
+            if entry is None:
+                self._count("misses")
+                return None
+            entry_version, expires_at, value = entry
+            if entry_version != version:
+                self.backend.delete(key)
+                self._count("invalidations")
+                self._count("misses")
+                return None
+            if expires_at < time.time():
+                self.backend.delete(key)
+                self._count("expirations")
+                self._count("misses")
+                return None
+            self._count("hits")
+            return json.loads(value) # A fresh copy, callers may mutate it
+        except Exception as e: # The cache must never fail a request
+            print(f"⚠️ Recommendation cache read failed: {e}")
+            self._count("errors")
+            self._count("misses")
+            return None
+
+    def put(self, key, version, value):
+        try:
+            evicted = self.backend.put(key, version, time.time() + self.ttl_seconds, json.dumps(value, default=str))
+            if evicted:
+                self._count("evictions", evicted)
+        except Exception as e:
+            print(f"⚠️ Recommendation cache write failed: {e}")
+            self._count("errors")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        """Counters of this process, plus the current size of the (possibly shared) backend."""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+        stats["backend"] = self.backend.name
+        stats["ttl_seconds"] = self.ttl_seconds
+        stats["max_entries"] = self.backend.max_entries
+        try:
+            stats["size"] = self.backend.size()
+        except Exception as e:
+            stats["size"] = None
+            print(f"⚠️ Recommendation cache size unavailable: {e}")
+        return stats
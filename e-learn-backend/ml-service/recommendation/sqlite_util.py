@@ -0,0 +1,42 @@
+"""
+SQLite connections for files shared by the threads and worker processes of a host.
+
+A sqlite3 connection must stay in the thread that opened it, and must not be reused after a
+fork (gunicorn forks its workers after the app is imported). ThreadLocalConnections opens
+one connection per thread, and a fresh one in a forked child, so the stores built on it
+(result_cache.SqliteCacheBackend, text_index.AddedCourseStore) never share one.
+"""
+import os
+import sqlite3
+import threading
+
+
+class ThreadLocalConnections:
+    """
+    Autocommit connections to one database file, in WAL mode so readers run alongside a writer.
+
+    Args:
+        path (str): Database file, created (with its directory) if missing.
+        setup (list[str]): Statements run on every new connection: further PRAGMAs and the
+            CREATE ... IF NOT EXISTS statements of the schema.
+    """
+
+    def __init__(self, path, setup=()):
+        self.path = path
+        self.setup = list(setup)
+        self._local = threading.local()
+
+    def get(self):
+        """The connection of the calling thread, opened on first use in this thread and process."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None) # autocommit
+            connection.execute("PRAGMA journal_mode=WAL")
+            for statement in self.setup:
+                connection.execute(statement)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
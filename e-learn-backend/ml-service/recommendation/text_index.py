@@ -0,0 +1,262 @@
+"""
+Similarity search for free text and for courses created after the last training run.
+
+The neighbor table (neighbors.py) only covers the courses of the training run. This index
+keeps the course TF-IDF vectors as an inverted index instead: one postings list per term
+(the courses using it and their weights), stored as the columns of a CSC matrix. A query is
+vectorized with the trained TF-IDF vectorizer, and only the postings of the terms it
+contains are scored. Cost grows with those postings, not with the catalog, so a search
+takes milliseconds even over a large catalog.
+
+Courses created or edited after training are added as a small overlay of extra vectors,
+scored directly, without a retrain. An overlay course replaces the base vector of a
+trained course with the same ID. The overlay is filled from an AddedCourseStore, a SQLite
+table shared by all workers on a host, so a course added through one worker is found by
+all of them.
+
+Vectors use the trained vocabulary and IDF weights, so terms the training run never saw
+are ignored until the next full run.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from recommendation.ranking import top_k_indices
+from recommendation.sqlite_util import ThreadLocalConnections
+
+# Above postings / courses of this ratio the scores are accumulated into a dense array
+# (one pass over all courses) instead of sorting the touched positions
+DENSE_ACCUMULATION_RATIO = 0.125
+
+
+class AddedCourseStore:
+    """
+    Courses added after training, as (seq, course_id, combined features, added_at) rows in
+    a SQLite file shared between processes. Re-adding a course gives it a new seq, so a
+    reader only needs the rows after the last seq it has seen.
+
+    Args:
+        path (str): Database file, created if missing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connections = ThreadLocalConnections(path, [
+            "CREATE TABLE IF NOT EXISTS added_courses ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, course_id TEXT UNIQUE, features TEXT, added_at TEXT)",
+        ])
+
+    def put(self, course_id, features):
+        """Adds or replaces a course and returns its seq."""
+        connection = self._connections.get()
+        with connection: # Commits on exit, readers never see the course missing
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM added_courses WHERE course_id = ?", (course_id,))
+            cursor = connection.execute(
+                "INSERT INTO added_courses (course_id, features, added_at) VALUES (?, ?, ?)",
+                (course_id, features, datetime.now(timezone.utc).isoformat()),
+            )
+        return cursor.lastrowid
+
+    def since(self, seq):
+        """Rows (seq, course_id, features, added_at) added after `seq`, oldest first."""
+        return self._connections.get().execute(
+            "SELECT seq, course_id, features, added_at FROM added_courses WHERE seq > ? ORDER BY seq", (seq,)
+        ).fetchall()
+
+    def size(self):
+        return self._connections.get().execute("SELECT COUNT(*) FROM added_courses").fetchone()[0]
+
+
+class _Overlay:
+    """Immutable set of added course vectors; CourseTextIndex swaps in a new one on every change."""
+
+    def __init__(self, course_ids=(), vectors=None, n_terms=0, replaced=None):
+        self.course_ids = list(course_ids)
+        self.positions = {course_id: i for i, course_id in enumerate(self.course_ids)}
+        self.vectors = vectors if vectors is not None else sparse.csr_matrix((0, n_terms), dtype=np.float32)
+        self.replaced = replaced if replaced is not None else np.empty(0, dtype=np.int64) # Base positions hidden by the overlay
+        self.neighbors = {} # (course_id, depth) -> base positions, see CourseTextIndex.added_course_neighbors
+
+
+class CourseTextIndex:
+    """
+    Inverted index of the course TF-IDF vectors of one model version (see the module docstring).
+
+    Args:
+        vectorizer: The fitted TfidfVectorizer of the model version.
+        course_ids (list[str]): CourseIDs, in the row order of `tfidf`.
+        tfidf: (courses x terms) TF-IDF matrix of those courses.
+        watermark (str, optional): ISO start time of the training run. Added courses that are
+            part of the base index and were added before it are already in the base vectors.
+    """
+
+    def __init__(self, vectorizer, course_ids, tfidf, watermark=None):
+        self.vectorizer = vectorizer
+        self.course_ids = [str(c) for c in course_ids]
+        self.course_positions = {course_id: i for i, course_id in enumerate(self.course_ids)}
+        self.n_terms = len(vectorizer.vocabulary_)
+        # Term -> courses: column j of the CSC matrix is the postings list of term j
+        self.postings = sparse.csc_matrix(normalize(sparse.csr_matrix(tfidf, dtype=np.float32)))
+        self.watermark = datetime.fromisoformat(watermark) if watermark else None
+        self._overlay = _Overlay(n_terms=self.n_terms)
+        self._synced_seq = 0
+        self._synced_at = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.course_ids) + len(self._overlay.course_ids)
+
+    def vectorize(self, texts):
+        """L2-normalized (texts x terms) TF-IDF rows of `texts` in the trained vocabulary."""
+        return normalize(sparse.csr_matrix(self.vectorizer.transform(texts), dtype=np.float32))
+
+    # --- Added courses ---
+
+    def add(self, entries):
+        """
+        Adds or replaces courses without a retrain.
+
+        Args:
+            entries (list): (course_id, combined features text) pairs.
+        """
+        if not entries:
+            return
+        new_vectors = self.vectorize([features for _, features in entries])
+        with self._lock:
+            overlay = self._overlay
+            latest = {str(course_id): row for row, (course_id, _) in enumerate(entries)} # The last entry of an ID wins
+            kept = [i for i, course_id in enumerate(overlay.course_ids) if course_id not in latest]
+            course_ids = [overlay.course_ids[i] for i in kept] + list(latest)
+            vectors = sparse.vstack([overlay.vectors[kept], new_vectors[list(latest.values())]]).tocsr()
+            replaced = np.array(sorted(self.course_positions[c] for c in course_ids if c in self.course_positions), dtype=np.int64)
+            self._overlay = _Overlay(course_ids, vectors, self.n_terms, replaced)
+
+    def sync(self, store, interval=0.0):
+        """
+        Adds the courses put into `store` since the last sync. Checks the store at most once
+        every `interval` seconds; a failing store only delays new courses.
+        """
+        now = time.monotonic()
+        if now - self._synced_at < interval:
+            return
+        self._synced_at = now
+        try:
+            rows = store.since(self._synced_seq)
+        except Exception as e:
+            print(f"⚠️ Reading added courses failed: {e}")
+            return
+        if not rows:
+            return
+        # Courses a training run started after have their vectors in the base index already
+        entries = [(course_id, features) for _, course_id, features, added_at in rows
+                   if not (self.watermark and course_id in self.course_positions and datetime.fromisoformat(added_at) < self.watermark)]
+        self.add(entries)
+        self._synced_seq = max(self._synced_seq, rows[-1][0])
+
+    @property
+    def synced_seq(self):
+        """Seq of the last added course applied to this index; changes whenever the overlay does."""
+        return self._synced_seq
+
+    def has_added(self, course_id):
+        return str(course_id) in self._overlay.positions
+
+    def added_course_neighbors(self, course_id, depth):
+        """
+        Base positions of the `depth` trained courses most similar to the added course
+        `course_id` (best first), memoized until the overlay changes. Lets an added course act
+        as a CBF seed like a row of the neighbor table.
+        """
+        overlay = self._overlay
+        key = (str(course_id), depth)
+        if key not in overlay.neighbors:
+            vector = overlay.vectors[overlay.positions[key[0]]]
+            positions, scores = self._score_base(vector)
+            overlay.neighbors[key] = positions[top_k_indices(scores, depth)]
+        return overlay.neighbors[key]
+
+    # --- Search ---
+
+    def _score_base(self, query, exclude_positions=()):
+        """Cosine scores of the base courses sharing a term with `query`: (positions, scores)."""
+        query = sparse.csr_matrix(query)
+        terms, weights = query.indices, query.data
+        starts, ends = self.postings.indptr[terms], self.postings.indptr[terms + 1]
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        # The postings of the query terms, concatenated: only these entries are read
+        take = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        rows = self.postings.indices[take]
+        contributions = self.postings.data[take] * np.repeat(weights, lengths)
+        n = len(self.course_ids)
+        if total >= n * DENSE_ACCUMULATION_RATIO:
+            dense = np.bincount(rows, contributions, minlength=n)
+            positions = np.flatnonzero(dense)
+            scores = dense[positions]
+        else:
+            positions, inverse = np.unique(rows, return_inverse=True)
+            scores = np.bincount(inverse, contributions)
+        hidden = np.concatenate([self._overlay.replaced, np.asarray(exclude_positions, dtype=np.int64)])
+        if hidden.size:
+            keep = ~np.isin(positions, hidden)
+            positions, scores = positions[keep], scores[keep]
+        return positions, scores.astype(np.float32)
+
+    def search(self, query, top_n=5, exclude=()):
+        """
+        The courses most similar to a query vector.
+
+        Args:
+            query: (1 x terms) TF-IDF row, e.g. from vectorize([text]).
+            top_n (int): Number of courses to return.
+            exclude (iterable): CourseIDs left out of the result (e.g. the query course itself).
+
+        Returns:
+            list[(course_id, score)]: Best first, cosine similarity above 0 only. Ties go to
+            trained courses first, then by position.
+        """
+        overlay = self._overlay
+        exclude = {str(c) for c in exclude}
+        positions, scores = self._score_base(query, [self.course_positions[c] for c in exclude if c in self.course_positions])
+        course_ids = self.course_ids
+        if overlay.course_ids:
+            overlay_scores = np.asarray((overlay.vectors @ sparse.csr_matrix(query).T).todense()).ravel()
+            matches = np.flatnonzero(overlay_scores > 0)
+            matches = matches[[overlay.course_ids[i] not in exclude for i in matches]] if exclude else matches
+            positions = np.concatenate([positions, len(course_ids) + matches])
+            scores = np.concatenate([scores, overlay_scores[matches].astype(np.float32)])
+        top = top_k_indices(scores, top_n)
+        return [(course_ids[p] if p < len(course_ids) else overlay.course_ids[p - len(course_ids)], float(scores[i]))
+                for i, p in zip(top, positions[top])]
+
+    def search_text(self, text, top_n=5, exclude=()):
+        """search() for a free-text query."""
+        return self.search(self.vectorize([text]), top_n, exclude)
+
+    def search_added_course(self, course_id, top_n=5):
+        """
+        search() for an added course, without the course itself. None if the course was not
+        added (trained courses are served from the neighbor table).
+        """
+        course_id = str(course_id)
+        overlay = self._overlay
+        if course_id not in overlay.positions:
+            return None
+        return self.search(overlay.vectors[overlay.positions[course_id]], top_n, exclude=[course_id])
+
+    def stats(self):
+        overlay = self._overlay
+        return {
+            "courses": len(self.course_ids),
+            "added_courses": len(overlay.course_ids),
+            "terms": self.n_terms,
+            "postings": int(self.postings.nnz),
+            "synced_seq": self._synced_seq,
+        }
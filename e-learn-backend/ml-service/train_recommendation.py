@@ -1,134 +1,218 @@
 import pandas as pd
 import numpy as np
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse.linalg import svds
 from sklearn.metrics import mean_squared_error # Added for RMSE calculation
 import pickle
 import os
+import sys
+from datetime import datetime, timezone
 
 # Import the new database utility functions
-from database_utils import fetch_all_courses_for_content_based_training, fetch_user_ratings_and_enrollments
+from database_utils import iter_course_feature_chunks, fetch_user_item_matrix
+from recommendation.neighbors import build_topk_neighbors, DEFAULT_NEIGHBORS_K, DEFAULT_BLOCK_SIZE
+from recommendation.ann import (
+    build_ann_neighbors, neighbor_recall, lsh_bits_for,
+    DEFAULT_ANN_TOP_TERMS, DEFAULT_LSH_TABLES, DEFAULT_ANN_BLOCK_SIZE, DEFAULT_RECALL_SAMPLE,
+)
+from recommendation.artifacts import save_artifacts
+from recommendation.registry import create_version_dir, publish_version, prune_versions
+from recommendation.incremental import train_incremental, save_training_state
+from recommendation.cf_engine import (
+    CF_BACKENDS, fit_implicit_als, fit_scaled_svd,
+    DEFAULT_ALS_FACTORS, DEFAULT_ALS_REGULARIZATION, DEFAULT_ALS_ALPHA, DEFAULT_ALS_ITERATIONS,
+)
 
 # --- Configuration ---
 MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
 os.makedirs(MODELS_DIR, exist_ok=True)
+CONTENT_NEIGHBORS_K = int(os.getenv("CONTENT_NEIGHBORS_K", DEFAULT_NEIGHBORS_K)) # Similar courses kept per course
+CONTENT_BLOCK_SIZE = int(os.getenv("CONTENT_BLOCK_SIZE", DEFAULT_BLOCK_SIZE)) # Rows scored at once while building neighbors
+# "exact" (all pairs, O(N^2)), "ann" (approximate, see recommendation/ann.py) or "auto": ann from CONTENT_ANN_MIN_COURSES courses on
+CONTENT_NEIGHBORS_METHOD = os.getenv("CONTENT_NEIGHBORS_METHOD", "auto").lower()
+CONTENT_ANN_MIN_COURSES = int(os.getenv("CONTENT_ANN_MIN_COURSES", 50000))
+# Recall/speed knobs of the approximate index, each one raises recall and build time
+CONTENT_ANN_TOP_TERMS = int(os.getenv("CONTENT_ANN_TOP_TERMS", DEFAULT_ANN_TOP_TERMS)) # Term buckets per course
+CONTENT_LSH_TABLES = int(os.getenv("CONTENT_LSH_TABLES", DEFAULT_LSH_TABLES)) # Random-projection hash tables
+CONTENT_ANN_BLOCK_SIZE = int(os.getenv("CONTENT_ANN_BLOCK_SIZE", DEFAULT_ANN_BLOCK_SIZE)) # Courses scored together
+CONTENT_LSH_BITS = int(os.getenv("CONTENT_LSH_BITS", 0)) # Bits per signature, fewer = bigger buckets (0 = from the catalog size)
+CONTENT_RECALL_SAMPLE = int(os.getenv("CONTENT_RECALL_SAMPLE", DEFAULT_RECALL_SAMPLE)) # Courses checked against exact neighbors
+CONTENT_MIN_RECALL = float(os.getenv("CONTENT_MIN_RECALL", 0.9)) # recall@10 below this is reported as a warning
+if CONTENT_NEIGHBORS_METHOD not in ("exact", "ann", "auto"):
+    print(f"🚨 Unknown CONTENT_NEIGHBORS_METHOD '{CONTENT_NEIGHBORS_METHOD}', expected exact, ann or auto.")
+    exit(1)
+MODEL_VERSIONS_TO_KEEP = int(os.getenv("MODEL_VERSIONS_TO_KEEP", 3)) # Older versions are deleted after a successful publish
+CF_BACKEND = os.getenv("CF_BACKEND", "als").lower() # "als" (implicit feedback) or "svd" (min-max scaled ratings)
+if CF_BACKEND not in CF_BACKENDS:
+    print(f"🚨 Unknown CF_BACKEND '{CF_BACKEND}', expected one of {CF_BACKENDS}.")
+    exit(1)
+ALS_FACTORS = int(os.getenv("ALS_FACTORS", DEFAULT_ALS_FACTORS))
+ALS_REGULARIZATION = float(os.getenv("ALS_REGULARIZATION", DEFAULT_ALS_REGULARIZATION))
+ALS_ALPHA = float(os.getenv("ALS_ALPHA", DEFAULT_ALS_ALPHA)) # Confidence per unit of rating
+ALS_ITERATIONS = int(os.getenv("ALS_ITERATIONS", DEFAULT_ALS_ITERATIONS))
+ALS_THREADS = int(os.getenv("ALS_THREADS", 0)) or None # 0 = one thread per CPU
+# Incremental mode only processes courses/enrollments changed since the last run (see recommendation/incremental.py)
+INCREMENTAL = "--incremental" in sys.argv or os.getenv("TRAIN_MODE", "full").lower() == "incremental"
+
+# Changes made after this point are picked up by the next (incremental) run
+TRAINING_STARTED_AT = datetime.now(timezone.utc)
+
+if INCREMENTAL:
+    try:
+        if train_incremental(MODELS_DIR, TRAINING_STARTED_AT, CONTENT_NEIGHBORS_K, CONTENT_BLOCK_SIZE, MODEL_VERSIONS_TO_KEEP):
+            print("\n--- Recommendation Model Training Process Finished ---")
+            sys.exit(0)
+    except Exception as e:
+        print(f"❌ Error during incremental training: {e}")
+    print("⚠️ Falling back to full training.")
 
 # --- Data Loading and Preprocessing from DB ---
-data_content = pd.DataFrame() # Initialize empty DataFrames
-data_collaborative = pd.DataFrame()
+content_course_ids, content_features = [], [] # Initialize empty data
+cf_ratings, cf_user_ids, cf_course_ids = None, [], []
 
 try:
-    # 1. Fetch data for Content-Based Filtering
-    data_content = fetch_all_courses_for_content_based_training()
-    print(f"✅ Loaded {len(data_content)} courses for content-based analysis.")
+    # 1. Fetch data for Content-Based Filtering, streamed in chunks of projected course documents
+    for chunk_ids, chunk_features in iter_course_feature_chunks():
+        content_course_ids.extend(chunk_ids)
+        content_features.extend(chunk_features)
+    print(f"✅ Loaded {len(content_course_ids)} courses for content-based analysis.")
 
-    # 2. Fetch data for Collaborative Filtering
-    data_collaborative = fetch_user_ratings_and_enrollments()
-    
-    # Ensure IDs are string types for consistency in pandas operations
-    data_collaborative['UserID'] = data_collaborative['UserID'].astype(str)
-    data_collaborative['CourseID'] = data_collaborative['CourseID'].astype(str)
-    
-    print(f"✅ Loaded {len(data_collaborative)} user-course interactions for collaborative filtering.")
+    # 2. Fetch data for Collaborative Filtering straight into a sparse users x courses rating matrix.
+    # Columns start with the content courses so both models share the course order.
+    cf_ratings, cf_user_ids, cf_course_ids = fetch_user_item_matrix(course_ids=content_course_ids)
+    print(f"✅ Loaded {cf_ratings.nnz} user-course interactions for collaborative filtering.")
 
 except Exception as e:
     print(f"❌ Error loading data from database: {e}")
     print("🚨 Exiting training due to database error. Please ensure MongoDB is running and data is present.")
     exit(1) # Exit if data loading fails
 
+# Every run writes a fresh version directory; running services only see it once it is published below
+MODEL_VERSION, VERSION_DIR = create_version_dir(MODELS_DIR)
+print(f"📦 Writing model version {MODEL_VERSION} to {VERSION_DIR}")
+
+# Numeric model components, written at the end as memory-mapped artifacts (see recommendation/artifacts.py)
+artifact_arrays = {}
+artifact_id_maps = {}
+artifact_metadata = {"watermark": TRAINING_STARTED_AT.isoformat()}
+training_state = {} # Matrices incremental runs start from
+
 # --- Content-Based Filtering Training ---
 vectorizer = None
-content_similarity = None
 content_course_map = None
 
-if not data_content.empty and 'combined_features' in data_content.columns:
+if content_course_ids:
     print("\n--- Training Content-Based Filtering Model ---")
     vectorizer = TfidfVectorizer(stop_words='english')
-    content_matrix = vectorizer.fit_transform(data_content['combined_features'])
-    content_similarity = cosine_similarity(content_matrix)
+    content_matrix = vectorizer.fit_transform(content_features)
+    use_ann = CONTENT_NEIGHBORS_METHOD == "ann" or (CONTENT_NEIGHBORS_METHOD == "auto" and len(content_course_ids) >= CONTENT_ANN_MIN_COURSES)
+    if use_ann:
+        # Approximate index: only courses sharing a bucket are scored, then checked against exact neighbors on a sample
+        lsh_bits = CONTENT_LSH_BITS or lsh_bits_for(len(content_course_ids), CONTENT_ANN_BLOCK_SIZE)
+        neighbor_indices, neighbor_scores = build_ann_neighbors(
+            content_matrix, k=CONTENT_NEIGHBORS_K, top_terms=CONTENT_ANN_TOP_TERMS, tables=CONTENT_LSH_TABLES,
+            bits=lsh_bits, block_size=CONTENT_ANN_BLOCK_SIZE)
+        recall = neighbor_recall(content_matrix, neighbor_indices, neighbor_scores, ks=(10, CONTENT_NEIGHBORS_K), sample_size=CONTENT_RECALL_SAMPLE)
+        artifact_metadata["content_neighbors"] = {
+            "method": "ann", "top_terms": CONTENT_ANN_TOP_TERMS, "lsh_tables": CONTENT_LSH_TABLES, "lsh_bits": lsh_bits,
+            "block_size": CONTENT_ANN_BLOCK_SIZE, **recall}
+        print(f"Content neighbor recall on {recall['recall_sample']} courses: "
+              + ", ".join(f"{name} = {value:.3f}" for name, value in recall.items() if name.startswith("recall@")))
+        if recall.get("recall@10", 1.0) < CONTENT_MIN_RECALL:
+            print(f"⚠️ recall@10 is below {CONTENT_MIN_RECALL}: raise CONTENT_ANN_TOP_TERMS, CONTENT_LSH_TABLES or CONTENT_ANN_BLOCK_SIZE.")
+    else:
+        # Top-K neighbor index built blockwise: memory and artifact size grow as N x K, not N x N
+        neighbor_indices, neighbor_scores = build_topk_neighbors(content_matrix, k=CONTENT_NEIGHBORS_K, block_size=CONTENT_BLOCK_SIZE)
+        artifact_metadata["content_neighbors"] = {"method": "exact"}
+    print(f"Built content neighbor index ({artifact_metadata['content_neighbors']['method']}): "
+          f"{neighbor_indices.shape[0]} courses x {neighbor_indices.shape[1]} neighbors.")
 
     # Save content-based model components
-    pickle.dump(vectorizer, open(os.path.join(MODELS_DIR, "tfidf_vectorizer.pkl"), "wb"))
-    pickle.dump(content_similarity, open(os.path.join(MODELS_DIR, "content_similarity.pkl"), "wb"))
+    pickle.dump(vectorizer, open(os.path.join(VERSION_DIR, "tfidf_vectorizer.pkl"), "wb"))
+    artifact_arrays["content_neighbor_indices"] = neighbor_indices
+    artifact_arrays["content_neighbor_scores"] = neighbor_scores
+    artifact_id_maps["content_courses"] = content_course_ids
+    training_state["content_tfidf"] = content_matrix
     # Save a mapping of CourseID to its internal index and combined features for lookup
-    content_course_map = data_content[['CourseID', 'combined_features']].reset_index().set_index('CourseID')
-    pickle.dump(content_course_map, open(os.path.join(MODELS_DIR, "content_course_map.pkl"), "wb"))
+    content_course_map = pd.DataFrame({'index': np.arange(len(content_course_ids)), 'combined_features': content_features},
+                                      index=pd.Index(content_course_ids, name='CourseID'))
+    pickle.dump(content_course_map, open(os.path.join(VERSION_DIR, "content_course_map.pkl"), "wb"))
     
     print("✅ Content-Based Model Training Completed!")
 else:
     print("⚠️ No valid course data with 'combined_features' for Content-Based Filtering. Skipping.")
 
 # --- Collaborative Filtering Training ---
-predictions_df = pd.DataFrame()
-user_item_matrix = pd.DataFrame() # Initialize
-cf_user_index = []
-cf_course_columns = []
-
-if not data_collaborative.empty and 'UserID' in data_collaborative.columns and 'CourseID' in data_collaborative.columns:
-    print("\n--- Training Collaborative Filtering Model ---")
-    
-    # Ensure all courses seen in content data are also in collaborative matrix columns
-    # and all users in collaborative data are in index
-    all_course_ids = data_content['CourseID'].unique() if not data_content.empty else data_collaborative['CourseID'].unique()
-    all_user_ids = data_collaborative['UserID'].unique()
-    
-    # Create the pivot table
-    user_item_matrix = data_collaborative.pivot_table(index='UserID', columns='CourseID', values='Rating').fillna(0)
-    
-    # Fill any missing columns (courses) or rows (users) with zeros if necessary
-    missing_courses_in_cf = set(all_course_ids) - set(user_item_matrix.columns)
-    for mc in missing_courses_in_cf:
-        user_item_matrix[mc] = 0
-    user_item_matrix = user_item_matrix.reindex(columns=all_course_ids).fillna(0) # Ensure consistent column order
-
-    matrix = user_item_matrix.values
+if cf_ratings is not None and cf_ratings.nnz > 0:
+    print(f"\n--- Training Collaborative Filtering Model ({CF_BACKEND}) ---")
 
-    if matrix.shape[0] > 1 and matrix.shape[1] > 1:
-        # Scale the matrix before SVD for better performance if ratings range widely
+    if min(cf_ratings.shape) > 1:
         # min_val and max_val logic from your previous collaborative code
-        min_val = np.min(matrix[matrix > 0]) if np.any(matrix > 0) else 0
-        max_val = np.max(matrix) if np.any(matrix > 0) else 1 # Avoid division by zero if all are zero
-        
-        # Avoid division by zero if min_val == max_val
-        if max_val - min_val > 0:
-            matrix_scaled = (matrix - min_val) / (max_val - min_val)
-        else:
-            matrix_scaled = np.zeros_like(matrix) # All values are the same, no scaling needed
-
-        optimal_k = min(100, min(matrix.shape) - 1)
-        
+        min_val = float(cf_ratings.data.min()) # Only the stored (non-zero) ratings define the scale
+        max_val = float(cf_ratings.data.max())
+
         try:
-            U, sigma, Vt = svds(matrix_scaled, k=optimal_k)
-            sigma = np.diag(sigma)
-            predicted_matrix_scaled = np.dot(np.dot(U, sigma), Vt)
-            
-            # Rescale back to original rating range
-            predicted_matrix = predicted_matrix_scaled * (max_val - min_val) + min_val
-            
-            predictions_df = pd.DataFrame(predicted_matrix, index=user_item_matrix.index, columns=user_item_matrix.columns)
-            
+            if CF_BACKEND == "als":
+                # Implicit feedback: enrollments are preferences weighted by confidence, not ratings to reconstruct
+                user_factors, item_factors = fit_implicit_als(
+                    cf_ratings, factors=min(ALS_FACTORS, min(cf_ratings.shape)), regularization=ALS_REGULARIZATION,
+                    alpha=ALS_ALPHA, iterations=ALS_ITERATIONS, threads=ALS_THREADS)
+                rating_scale = {"min_val": 0.0, "max_val": 1.0} # Scores are preferences, used as-is
+                artifact_metadata["cf_model"] = {"type": "als", "alpha": ALS_ALPHA, "regularization": ALS_REGULARIZATION, "max_rating": max_val}
+            else:
+                if max_val - min_val <= 0:
+                    raise ValueError("all ratings are equal, the min-max scaled SVD needs a rating range (use CF_BACKEND=als)")
+                # Keep the model factored: U·Σ (users x k) and Vt (k x courses).
+                # The predictor scores one user with a single dot product, so we never
+                # materialize the dense users x courses predictions matrix.
+                user_factors, item_factors = fit_scaled_svd(cf_ratings, min(100, min(cf_ratings.shape) - 1), min_val, max_val)
+                rating_scale = {"min_val": min_val, "max_val": max_val}
+                artifact_metadata["cf_model"] = {"type": "svd"}
+
             # Save collaborative filtering model components
-            pickle.dump(predictions_df, open(os.path.join(MODELS_DIR, "cf_predictions_df.pkl"), "wb"))
-            pickle.dump(user_item_matrix.columns.tolist(), open(os.path.join(MODELS_DIR, "cf_course_columns.pkl"), "wb"))
-            pickle.dump(user_item_matrix.index.tolist(), open(os.path.join(MODELS_DIR, "cf_user_index.pkl"), "wb"))
-
-            # Calculate RMSE
-            actual_ratings = matrix[matrix > 0] # Only consider actual rated items
-            predicted_ratings = predicted_matrix[matrix > 0]
-            if len(actual_ratings) > 0:
-                rmse = np.sqrt(mean_squared_error(actual_ratings, predicted_ratings))
+            artifact_arrays["cf_user_factors"] = user_factors
+            artifact_arrays["cf_item_factors"] = item_factors
+            artifact_metadata["cf_rating_scale"] = rating_scale
+            artifact_id_maps["cf_users"] = cf_user_ids
+            artifact_id_maps["cf_courses"] = cf_course_ids
+            training_state["cf_interactions"] = cf_ratings
+
+            # The dense matrix is opt-in only (e.g. for offline inspection), it grows as users x courses.
+            if os.getenv("CF_SAVE_DENSE_PREDICTIONS", "false").lower() == "true":
+                predicted_matrix = np.dot(user_factors, item_factors) * (rating_scale["max_val"] - rating_scale["min_val"]) + rating_scale["min_val"]
+                predictions_df = pd.DataFrame(predicted_matrix, index=cf_user_ids, columns=cf_course_ids)
+                pickle.dump(predictions_df, open(os.path.join(VERSION_DIR, "cf_predictions_df.pkl"), "wb"))
+
+            # Evaluate only on the observed entries, one dot product per rating
+            rated = cf_ratings.tocoo()
+            if CF_BACKEND == "svd":
+                predicted_ratings_scaled = np.einsum('ij,ji->i', user_factors[rated.row], item_factors[:, rated.col])
+                predicted_ratings = predicted_ratings_scaled * (max_val - min_val) + min_val
+                rmse = np.sqrt(mean_squared_error(rated.data, predicted_ratings))
                 print(f"✅ Collaborative Filtering Model Trained Successfully! RMSE = {rmse:.4f}")
             else:
-                print("✅ Collaborative Filtering Model Trained Successfully! No actual ratings for RMSE calculation.")
+                # Mean preference score of observed enrollments (1.0 = perfectly reproduced)
+                mean_preference = np.einsum('ij,ji->i', user_factors[rated.row], item_factors[:, rated.col]).mean()
+                print(f"✅ Collaborative Filtering Model Trained Successfully! Mean observed preference = {mean_preference:.4f}")
 
         except Exception as e:
-            print(f"❌ Error during SVD for Collaborative Filtering: {e}")
+            print(f"❌ Error while training Collaborative Filtering ({CF_BACKEND}): {e}")
             print("⚠️ Collaborative Filtering model could not be trained.")
-            predictions_df = pd.DataFrame(index=user_item_matrix.index, columns=user_item_matrix.columns) # Empty if failed
     else:
-        print(f"⚠️ Insufficient data for Collaborative Filtering SVD (matrix shape: {matrix.shape}). Skipping.")
+        print(f"⚠️ Insufficient data for Collaborative Filtering (matrix shape: {cf_ratings.shape}). Skipping.")
 else:
     print("⚠️ No valid user interaction data for Collaborative Filtering. Skipping.")
 
+# --- Save Artifacts ---
+if artifact_arrays:
+    save_artifacts(VERSION_DIR, artifact_arrays, id_maps=artifact_id_maps, metadata=artifact_metadata)
+    save_training_state(VERSION_DIR, **training_state)
+    print(f"✅ Saved memory-mapped model artifacts to {VERSION_DIR}.")
+
+    # Atomically switch CURRENT to the new version, services hot-reload it (see recommendation/registry.py)
+    publish_version(MODELS_DIR, MODEL_VERSION)
+    prune_versions(MODELS_DIR, keep=MODEL_VERSIONS_TO_KEEP)
+    print(f"✅ Published model version {MODEL_VERSION}.")
+else:
+    print(f"⚠️ No model was trained, version {MODEL_VERSION} is not published.")
+
 print("\n--- Recommendation Model Training Process Finished ---")